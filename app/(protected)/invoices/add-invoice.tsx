@@ -0,0 +1,86 @@
+'use client'
+
+import { Card, CardContent } from '@ui/core/shadcn/card'
+import { Form } from '@ui/core/shadcn/form'
+import { Sheet, SheetContent, SheetHeader, SheetTitle, SheetTrigger } from '@ui/core/shadcn/sheet'
+
+import { AiOutlineFileAdd } from 'react-icons/ai'
+import { Button } from '@ui/core/shadcn/button'
+import React from 'react'
+import { getErrorMessage } from '@common/lib/handle-error'
+import { toast } from 'sonner'
+import { useForm } from 'react-hook-form'
+import { useRouter } from 'next/navigation'
+import { z } from 'zod'
+import { zodResolver } from '@hookform/resolvers/zod'
+
+const formSchema = z.object({})
+
+export default function AddInvoice() {
+  const router = useRouter()
+  const [sheetOpen, setSheetOpen] = React.useState(false)
+
+  const form = useForm<z.infer<typeof formSchema>>({
+    resolver: zodResolver(formSchema),
+    defaultValues: {},
+  })
+
+  function onSubmit(values: z.infer<typeof formSchema>) {
+    toast.promise(
+      fetch('/api/invoice', {
+        method: 'POST',
+        body: JSON.stringify(values),
+        headers: {
+          'Content-Type': 'application/json',
+        },
+      }),
+      {
+        loading: 'Invoice is being added...',
+        success: 'Invoice added!',
+        error: (err) => getErrorMessage(err),
+      },
+    )
+    router.refresh()
+    setSheetOpen(false)
+    form.reset()
+  }
+
+  return (
+    <Sheet open={sheetOpen} onOpenChange={setSheetOpen}>
+      <SheetTrigger asChild>
+        <Button
+          aria-label="Add invoice"
+          variant="outline"
+          size="sm"
+          className="ml-auto h-8 lg:flex"
+        >
+          <AiOutlineFileAdd className="mr-2 size-4" aria-hidden="true" />
+          Add Invoice
+        </Button>
+      </SheetTrigger>
+      <SheetContent
+        className="overflow-y-scroll"
+        onOpenAutoFocus={(e) => e.preventDefault()}
+      >
+        <SheetHeader>
+          <SheetTitle>Add New Invoice</SheetTitle>
+        </SheetHeader>
+        <Card className="mt-2">
+          <CardContent>
+            <Form {...form}>
+              <form
+                onSubmit={form.handleSubmit(onSubmit)}
+                className="space-y-4"
+              >
+
+                <Button variant={'outline'} type="submit">
+                  Save
+                </Button>
+              </form>
+            </Form>
+          </CardContent>
+        </Card>
+      </SheetContent>
+    </Sheet>
+  )
+}
@@ -0,0 +1,105 @@
+//start of the code below, include use client
+'use client'
+
+import React from 'react'
+import { type ColumnDef } from '@tanstack/react-table'
+import type { DataTableFilterableColumn, DataTableSearchableColumn } from '@ui/core/types/index'
+import { useDataTable } from '@ui/core/hooks/use-data-table'
+import { Checkbox } from '@ui/core/shadcn/checkbox'
+import { DataTable } from '@ui/core/data-table/data-table'
+import { TableFloatingBarContent } from '@common/components/table-floating-bar-content'
+import TableActions from '@common/components/table-actions'
+import { InvoiceWithRelations } from '@db/prisma/zod'
+import { MdPageview } from 'react-icons/md'
+import { useRouter } from 'next/navigation'
+import AddInvoice from './add-invoice'
+
+interface InvoiceSearchTableProps {
+  invoicesPromise: Promise<{ data: InvoiceWithRelations[]; pageCount: number }>
+}
+
+export function InvoiceSearchTable({ invoicesPromise }: InvoiceSearchTableProps) {
+  const router = useRouter()
+  const { data, pageCount } = React.use(invoicesPromise)
+
+  // Memoize the columns so they don't re-render on every render
+  const columns = React.useMemo<ColumnDef<InvoiceWithRelations, unknown>[]>(
+    () => [
+      // update the columns to match the new list of fields
+      {
+        id: 'select',
+        header: ({ table }) => (
+          <Checkbox
+            checked={
+              table.getIsAllPageRowsSelected() ||
+              (table.getIsSomePageRowsSelected() && 'indeterminate')
+            }
+            onCheckedChange={(value) =>
+              table.toggleAllPageRowsSelected(!!value)
+            }
+            aria-label="Select all"
+            className="translate-y-[2px]"
+          />
+        ),
+        cell: ({ row }) => (
+          <Checkbox
+            checked={row.getIsSelected()}
+            onCheckedChange={(value) => row.toggleSelected(!!value)}
+            aria-label="Select row"
+            className="translate-y-[2px]"
+          />
+        ),
+        enableSorting: false,
+        enableHiding: false
+      },
+      {
+        id: 'actions',
+        cell: function Cell({ row }) {
+          const [isDeletePending, startDeleteTransition] = React.useTransition()
+          const [isUpdatePending, startUpdateTransition] = React.useTransition()
+
+          return (
+            <TableActions
+              actions={[
+                {
+                  label: 'View',
+                  onClick: () => {
+                    router.push(`/invoice-profile/${row.original.id}/activities`)
+                  },
+                  icon: <MdPageview />
+                }
+              ]}
+            />
+          )
+        }
+      }
+    ],
+    []
+  )
+
+  const searchableColumns: DataTableSearchableColumn<InvoiceWithRelations>[] = []
+
+  const filterableColumns: DataTableFilterableColumn<InvoiceWithRelations>[] = []
+
+  const { table } = useDataTable({
+    data,
+    columns,
+    pageCount,
+    searchableColumns,
+    filterableColumns,
+    hiddenColumns: []
+  })
+
+  return (
+    <DataTable
+      table={table}
+      columns={columns}
+      searchableColumns={searchableColumns}
+      filterableColumns={filterableColumns}
+      advancedFilter={true}
+      floatingBarContent={<TableFloatingBarContent table={table} />}
+      customButtons={[<AddInvoice />]}
+      rowUrl="/invoice-profile/[id]/activities"
+    />
+  )
+}
@@ -0,0 +1,44 @@
+import { SearchParams } from '@ui/core/types/index'
+import { DataTableSkeleton } from '@ui/core/data-table/data-table-skeleton'
+import { InvoiceSearchTable } from './invoice-search-table'
+import { InvoiceWithRelations } from '@db/prisma/zod'
+
+import React from 'react'
+
+interface IndexPageProps {
+  searchParams: SearchParams
+}
+
+export default async function InvoiceSearchPage({ searchParams }: IndexPageProps) {
+  const url = new URL('http://localhost:3000/api/invoice')
+  Object.keys(searchParams).forEach((key) => {
+    const value = searchParams[key]
+    if (typeof value === 'string') {
+      url.searchParams.append(key, value)
+    }
+  })
+
+  const invoicesPromise: Promise<{
+    data: InvoiceWithRelations[]
+    pageCount: number
+  }> = fetch(url.toString(), { method: 'GET', cache: 'no-store' }).then((res) =>
+    res.json()
+  )
+
+  
+  return (
+    <div className="m-10">
+      <h1 className="text-2xl font-bold mb-3">Invoices</h1>
+
+      <React.Suspense
+        fallback={
+          <DataTableSkeleton columnCount={2} filterableColumnCount={2} />
+        }
+      >
+        <InvoiceSearchTable
+          invoicesPromise={invoicesPromise}
+        />
+      </React.Suspense>
+    </div>
+  )
+}
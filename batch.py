@@ -0,0 +1,206 @@
+"""Headless batch generation from a manifest.
+
+The manifest is a JSON or YAML list of entities (or {"entities": [...]}):
+
+    - model: Invoice
+      fields: [id, amount, dueDate]
+      folder_location: /path/to/apps/web/src
+
+Every entity is generated and QA'd through a pool of --workers workers
+sharing one LLM rate limit. Finished entities are appended to the
+checkpoint file, so running the same command again after an interruption
+only does the rest; --restart ignores the checkpoint.
+
+    python batch.py entities.yaml --workers 4 --requests-per-second 2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import time
+
+from code_gen import (API_TEMPLATE_SET, CASES_TEMPLATE_SET, agenerate_code_single_prompt, aqa_fix_loop,
+                      generate_code_concurrent, generate_code_dag, generate_code_incremental,
+                      generate_code_offline, generate_code_wide)
+from generation_cache import normalize_fields
+from lint_runner import CommandLintRunner, find_project_root
+from llm_scheduler import scheduler
+from telemetry import current_session, telemetry
+
+
+def load_manifest(path):
+    """Returns the manifest entities with their fields as a list."""
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("PyYAML is needed for YAML manifests: pip install pyyaml")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("entities", [])
+    entities = []
+    for number, entry in enumerate(data):
+        missing = [key for key in ("model", "fields", "folder_location") if not entry.get(key)]
+        if missing:
+            raise ValueError(f"Manifest entry {number} is missing {', '.join(missing)}")
+        fields = entry["fields"]
+        if isinstance(fields, str):
+            fields = fields.split(",")
+        entities.append(dict(entry, fields=normalize_fields(fields)))
+    return entities
+
+
+def entity_key(entity, mode="single"):
+    """Returns the checkpoint key of entity generated in mode, so a run in
+    another mode generates it again."""
+    payload = json.dumps([entity["model"], entity["fields"], entity["folder_location"],
+                          entity.get("template_set", CASES_TEMPLATE_SET), mode])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def load_checkpoint(path):
+    """Returns {entity key: result} of the entities finished without error."""
+    done = {}
+    if os.path.isfile(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    if result["status"] == "ok":
+                        done[result["key"]] = result
+    return done
+
+
+async def generate_entity(entity, mode, qa, chat_model=None, lint_command=None):
+    """Generates one entity and runs the QA loop on it, with lint_command
+    in place of eslint when given.
+
+    Returns:
+        dict: the files written, failed templates and remaining warnings
+    """
+    requirements = {"model": entity["model"], "fields": entity["fields"],
+                    "folder_location": entity["folder_location"]}
+    template_set = entity.get("template_set", CASES_TEMPLATE_SET)
+    failed = {}
+    if mode == "concurrent":
+        files, failed = await generate_code_concurrent(requirements, template_set,
+                                                       chat_model=chat_model, callbacks=[])
+    elif mode == "dag":
+        # the page templates and the API route they call, unless a set is given
+        template_sets = [template_set] if "template_set" in entity else [template_set, API_TEMPLATE_SET]
+        files, failed = await generate_code_dag(requirements, template_sets, chat_model=chat_model,
+                                                callbacks=[])
+    elif mode == "wide":
+        files, failed = await generate_code_wide(requirements, template_set, chat_model=chat_model,
+                                                 callbacks=[])
+    elif mode == "incremental":
+        files, report = await generate_code_incremental(requirements, template_set,
+                                                        chat_model=chat_model, callbacks=[])
+        failed = report["failed"]
+    elif mode == "offline":
+        files = await asyncio.to_thread(generate_code_offline, requirements, template_set,
+                                        chat_model=chat_model, callbacks=[])
+    else:
+        files, failed = await agenerate_code_single_prompt(requirements, chat_model=chat_model,
+                                                           callbacks=[], template_set=template_set)
+    result = {"files": len([file for file in files if file.strip()]), "failed": failed,
+              "remaining_warnings": None}
+    if qa:
+        runner = None
+        if lint_command:
+            runner = CommandLintRunner(lint_command, find_project_root(entity["folder_location"]))
+        report = await aqa_fix_loop(files, requirements, runner=runner, chat_model=chat_model)
+        result["remaining_warnings"] = sum(map(len, report["remaining"].values()))
+    return result
+
+
+async def run_batch(entities, workers=4, mode="single", qa=True,
+                    checkpoint="debug/batch/checkpoint.jsonl", chat_model=None, lint_command=None):
+    """Generates every entity not already in the checkpoint, at most
+    workers at a time, appending each result to the checkpoint as it
+    finishes.
+
+    Returns:
+        list: one result per entity, in manifest order
+    """
+    os.makedirs(os.path.dirname(checkpoint) or ".", exist_ok=True)
+    done = load_checkpoint(checkpoint)
+    queue = asyncio.Queue()
+    results = {}
+    for number, entity in enumerate(entities):
+        key = entity_key(entity, mode)
+        if key in done:
+            print(f"Skipping {entity['model']}, finished in a previous run.")
+            results[number] = dict(done[key], resumed=True)
+        else:
+            queue.put_nowait((number, key, entity))
+    lock = asyncio.Lock()
+
+    async def worker():
+        while not queue.empty():
+            number, key, entity = queue.get_nowait()
+            current_session.set(f"batch:{entity['model']}")
+            start = time.perf_counter()
+            result = {"key": key, "model": entity["model"],
+                      "folder_location": entity["folder_location"]}
+            try:
+                result.update(await generate_entity(entity, mode, qa, chat_model, lint_command))
+                result["status"] = "ok" if not result["failed"] else "partial"
+            except Exception as e:
+                result.update(status="error", error=f"{type(e).__name__}: {e}")
+            result["seconds"] = time.perf_counter() - start
+            print(f"{entity['model']}: {result['status']} in {result['seconds']:.1f}s")
+            async with lock:
+                with open(checkpoint, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+            results[number] = result
+
+    await asyncio.gather(*(worker() for _ in range(min(workers, queue.qsize()))))
+    return [results[number] for number in range(len(entities))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest", help="JSON or YAML list of {model, fields, folder_location}")
+    parser.add_argument("--workers", type=int, default=4, help="entities generated at a time")
+    parser.add_argument("--requests-per-second", type=float, default=2.0,
+                        help="LLM requests per second shared by all workers")
+    parser.add_argument("--mode", choices=["single", "concurrent", "offline", "incremental", "dag", "wide"], default="single")
+    parser.add_argument("--no-qa", action="store_true", help="skip the lint and fix step")
+    parser.add_argument("--lint-command", help="command printing ESLint JSON, instead of eslint")
+    parser.add_argument("--checkpoint", default="debug/batch/checkpoint.jsonl")
+    parser.add_argument("--summary", default="debug/batch/summary.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args()
+
+    entities = load_manifest(args.manifest)
+    if args.restart and os.path.isfile(args.checkpoint):
+        os.remove(args.checkpoint)
+    scheduler.set_limits(requests_per_minute=args.requests_per_second * 60,
+                         request_burst=max(1, args.workers))
+
+    start = time.perf_counter()
+    lint_command = shlex.split(args.lint_command) if args.lint_command else None
+    results = asyncio.run(run_batch(entities, args.workers, args.mode, not args.no_qa,
+                                    args.checkpoint, lint_command=lint_command))
+    seconds = time.perf_counter() - start
+
+    statuses = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    summary = {"manifest": args.manifest, "seconds": seconds, "statuses": statuses,
+               "entities": results}
+    os.makedirs(os.path.dirname(args.summary) or ".", exist_ok=True)
+    with open(args.summary, "w") as f:
+        json.dump(summary, f, indent=2)
+    telemetry.write()
+    print(f"{len(results)} entities in {seconds:.1f}s: {statuses}. Summary in {args.summary}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Round trips of the requirements graph per user message.
+
+Runs the graph against FakeAgentChatModel, answering with parallel tool
+calls and with one legacy function_call per turn:
+
+    python bench_agent.py --latency 0.5
+"""
+import argparse
+import time
+
+from fake_llm import FakeAgentChatModel
+from rqmts_graph import get_requirements_bot
+
+MESSAGES = [
+    "model: Invoice",
+    "fields: id,amount,due; folder_location: src/app",
+    "model: Invoice; fields: id,amount,due; folder_location: src/app",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model latency per call")
+    args = parser.parse_args()
+
+    rows = []
+    for name, parallel in (("function_call", False), ("parallel tools", True)):
+        bot = get_requirements_bot(model=FakeAgentChatModel(latency=args.latency, parallel=parallel))
+        for message in MESSAGES:
+            requirements = {"model": "", "fields": [], "folder_location": ""}
+            start = time.perf_counter()
+            response = bot.invoke({"messages": [message], "requirements": requirements})
+            rows.append((name, message, response["round_trips"], time.perf_counter() - start))
+
+    print()
+    print(f"{'agent':<16}{'round trips':>12}{'seconds':>10}  message")
+    for name, message, round_trips, seconds in rows:
+        print(f"{name:<16}{round_trips:>12}{seconds:>10.2f}  {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""End-to-end benchmark of Kevin sessions on replayed completions.
+
+Every session goes through the real requirements turn (rqmts_parser,
+probe_chain, rqmts_graph), code generation (code_gen) and the QA loop,
+with ReplayChatModel standing in for OpenAI and bench_lint_stub.py as the
+lint command:
+
+    python bench_e2e.py --sessions 16 --concurrency 4 --latency 0.5 --tps 2000
+
+With --speculative the generation starts as soon as the model and fields
+are known, during the --think-time the simulated user takes per answer.
+
+Completions are replayed from --recordings; prompts without a recording are
+answered by the offline fakes of fake_llm and recorded, so later runs
+replay exactly the same text. Results go to bench_results/<commit>.json and
+are compared with the previous result, or with --compare FILE.
+"""
+import argparse
+import asyncio
+import datetime
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from code_gen import (agenerate_code_single_prompt, aqa_fix_loop, generate_code_concurrent,
+                      generate_code_dag)
+from fake_llm import FakeAgentChatModel, FakeCodeChatModel, ReplayChatModel
+from file_writer import FileWriter
+from lint_runner import CommandLintRunner
+from rqmts_graph import get_requirements_bot
+from rqmts_turn import arequirements_turn
+from speculative import Speculator, stats as speculation_stats
+
+RESULTS_DIR = "bench_results"
+WORK_DIR = "debug/bench_e2e"
+# the first answer needs the LLM, the other two are parsed locally
+ANSWERS = [
+    "Let's do invoices, set model=Invoice please",
+    "id, amount, dueDate, status, customer",
+    "{location}",
+]
+class Timings:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            stages[stage] = {
+                "count": len(samples),
+                "mean": statistics.fmean(samples),
+                "p50": _percentile(ordered, 50),
+                "p95": _percentile(ordered, 95),
+            }
+        return stages
+
+
+def _percentile(ordered, percent):
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def session(number, args, bot, agent_model, code_model, runner, timings):
+    location = os.path.join(WORK_DIR, f"session{number}")
+    requirements = {"model": "", "fields": [], "folder_location": ""}
+    history = ["What is the model entity you want to work with?"]
+
+    async def generate(requirements, writer=None):
+        if args.generation_mode == "concurrent":
+            files, failed = await generate_code_concurrent(requirements, chat_model=code_model,
+                                                           callbacks=[], use_cache=False,
+                                                           writer=writer)
+            return files
+        if args.generation_mode == "dag":
+            files, failed = await generate_code_dag(requirements, chat_model=code_model,
+                                                    callbacks=[], use_cache=False, writer=writer)
+            return files
+        files, failed = await agenerate_code_single_prompt(requirements, chat_model=code_model,
+                                                           callbacks=[], use_cache=False,
+                                                           writer=writer)
+        return files
+    speculator = Speculator(generate) if args.speculative else None
+
+    started = time.perf_counter()
+    for answer in ANSWERS:
+        await asyncio.sleep(args.think_time)
+        history.append(answer.format(location=location))
+        start = time.perf_counter()
+        requirements, probe = await arequirements_turn(history[-1], requirements, history, bot,
+                                                       args.requirements_mode, agent_model)
+        timings.add("requirements_turn", time.perf_counter() - start)
+        if speculator:
+            speculator.update(requirements)
+        if probe is None:
+            break
+        history.append(probe)
+
+    start = time.perf_counter()
+    with FileWriter() as writer:
+        files = await speculator.collect(requirements, writer) if speculator else None
+        if files is None:
+            files = await generate(requirements, writer)
+        await asyncio.to_thread(writer.flush)
+    timings.add("generation", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await aqa_fix_loop(files, requirements, runner=runner, chat_model=code_model)
+    timings.add("qa", time.perf_counter() - start)
+    timings.add("session", time.perf_counter() - started)
+
+
+async def run(args, agent_model, code_model):
+    bot = get_requirements_bot(model=agent_model)
+    runner = CommandLintRunner([sys.executable, os.path.abspath("bench_lint_stub.py")], WORK_DIR)
+    timings = Timings()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(number):
+        async with semaphore:
+            await session(number, args, bot, agent_model, code_model, runner, timings)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(number) for number in range(args.sessions)))
+    return timings, time.perf_counter() - start
+
+
+def _bytes_written(directory):
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, "**", "*"),
+                                                              recursive=True)
+               if os.path.isfile(path))
+
+
+def _commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def _previous(path):
+    results = [result for result in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if result != path]
+    return max(results, key=os.path.getmtime) if results else None
+
+
+def report(result, baseline=None):
+    print()
+    print(f"commit {result['commit']}: {result['config']['sessions']} sessions, "
+          f"concurrency {result['config']['concurrency']}")
+    print(f"{'stage':<20}{'count':>7}{'p50':>9}{'p95':>9}{'mean':>9}" + (f"{'p95 before':>12}" if baseline else ""))
+    for stage, stats in result["stages"].items():
+        line = f"{stage:<20}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['mean']:>9.3f}"
+        if baseline and stage in baseline["stages"]:
+            line += f"{baseline['stages'][stage]['p95']:>12.3f}"
+        print(line)
+    for name in ("sessions_per_second", "bytes_per_second"):
+        line = f"{name}: {result[name]:.2f}"
+        if baseline:
+            line += f" (before {baseline[name]:.2f}, {result[name] / baseline[name] - 1:+.1%})"
+        print(line)
+    print(f"replay: {result['replay']}")
+    if result["config"].get("speculative"):
+        print(f"speculation: {result['speculation']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4, help="sessions in flight at a time")
+    parser.add_argument("--latency", type=float, default=0.5, help="time to first token per call")
+    parser.add_argument("--tps", type=float, default=2000.0, help="tokens per second of a completion")
+    parser.add_argument("--requirements-mode", choices=["combined", "graph"], default="combined")
+    parser.add_argument("--generation-mode", choices=["single", "concurrent", "dag"], default="single")
+    parser.add_argument("--speculative", action="store_true",
+                        help="generate while the user is still answering")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="seconds the simulated user takes per answer")
+    parser.add_argument("--recordings", default=os.path.join(RESULTS_DIR, "recordings", "completions.json"))
+    parser.add_argument("--compare", help="result file to compare with, defaults to the previous run")
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(args.recordings) or ".", exist_ok=True)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+    os.makedirs(WORK_DIR)
+    with open(os.path.join(WORK_DIR, "package.json"), "w") as f:
+        f.write("{}")
+
+    speed = {"first_token_latency": args.latency, "tokens_per_second": args.tps}
+    agent_model = ReplayChatModel.load(args.recordings, fallback=FakeAgentChatModel(latency=0), **speed)
+    code_model = ReplayChatModel.load(args.recordings, fallback=FakeCodeChatModel(first_token_latency=0,
+                                                                                   tokens_per_second=1e9),
+                                      **speed)
+    timings, seconds = asyncio.run(run(args, agent_model, code_model))
+
+    result = {
+        "commit": _commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {name: value for name, value in vars(args).items() if name != "compare"},
+        "seconds": seconds,
+        "stages": timings.summary(),
+        "sessions_per_second": args.sessions / seconds,
+        "bytes_per_second": _bytes_written(WORK_DIR) / seconds,
+        "replay": {"hits": agent_model.hits + code_model.hits,
+                   "misses": agent_model.misses + code_model.misses},
+        "speculation": speculation_stats.as_dict(),
+    }
+    if result["replay"]["misses"]:
+        recordings = dict(agent_model.recordings, **code_model.recordings)
+        ReplayChatModel(recordings=recordings).save(args.recordings)
+
+    path = os.path.join(RESULTS_DIR, f"{result['commit']}.json")
+    baseline_path = args.compare or _previous(path)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    report(result, baseline)
+    print(f"saved {path}" + (f", compared with {baseline_path}" if baseline else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Timing comparison of the single-prompt and the per-template generation paths.
+
+Runs against FakeCodeChatModel, so no OpenAI key or network is needed:
+
+    python bench_generation.py --tps 2000 --latency 0.5 --concurrency 1 2 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from code_gen import generate_code_concurrent, generate_code_single_prompt
+from fake_llm import FakeCodeChatModel
+from generation_cache import cache
+
+REQUIREMENTS = {
+    "model": "Department",
+    "fields": ["id", "name", "type", "category", "description", "isRequired"],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tps", type=float, default=2000.0, help="fake model tokens per second")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model time to first token")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="share of truncated completions")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    os.makedirs("debug", exist_ok=True)
+    timings = []
+    with tempfile.TemporaryDirectory() as location:
+        requirements = dict(REQUIREMENTS, folder_location=location)
+        cache.directory = os.path.join(location, "cache")
+
+        model = FakeCodeChatModel(first_token_latency=args.latency, tokens_per_second=args.tps)
+        start = time.perf_counter()
+        files, failed = generate_code_single_prompt(requirements, chat_model=model, callbacks=[],
+                                                    use_cache=False)
+        timings.append(("single prompt", time.perf_counter() - start, len(failed)))
+
+        for concurrency in args.concurrency:
+            model = FakeCodeChatModel(first_token_latency=args.latency, tokens_per_second=args.tps,
+                                      truncate_rate=args.truncate_rate, seed=concurrency)
+            start = time.perf_counter()
+            files, failed = asyncio.run(generate_code_concurrent(
+                requirements, max_concurrency=concurrency, chat_model=model, callbacks=[],
+                use_cache=False))
+            timings.append((f"per template, concurrency={concurrency}",
+                            time.perf_counter() - start, len(failed)))
+
+        # populate the cache once, then time the regeneration of the same entity
+        asyncio.run(generate_code_concurrent(requirements, chat_model=model, callbacks=[]))
+        start = time.perf_counter()
+        files, failed = asyncio.run(generate_code_concurrent(requirements, chat_model=model, callbacks=[]))
+        timings.append(("per template, cached", time.perf_counter() - start, len(failed)))
+
+    print()
+    print(f"{'mode':<32}{'seconds':>10}{'speedup':>10}{'failed':>8}")
+    baseline = timings[0][1]
+    for mode, seconds, failed in timings:
+        print(f"{mode:<32}{seconds:>10.2f}{baseline / seconds:>9.2f}x{failed:>8}")
+    print(f"cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark of the lint log parser on a synthetic log built from report.txt.
+
+    python bench_lint_log.py --megabytes 16
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from lint_log import parse_lint_log_file
+
+
+def build_log(path, megabytes, source="report.txt"):
+    """Repeats the file blocks of source under new file names until the log
+    reaches the requested size, alternating two turbo package prefixes."""
+    with open(source, "r") as f:
+        lines = f.read().split("\n")
+    header = [line for line in lines if not line.startswith("web:lint:")][:6]
+    body = [line[len("web:lint: "):] if line.startswith("web:lint: ") else "" for line in lines
+            if line.startswith("web:lint:")]
+    target = megabytes * 1024 * 1024
+    written = 0
+    copy = 0
+    with open(path, "w") as f:
+        f.write("\n".join(header) + "\n")
+        while written < target:
+            task = "web:lint: " if copy % 2 == 0 else "admin:lint: "
+            block = "\n".join(task + line.replace("./src/", f"./src/copy{copy}/") for line in body) + "\n"
+            f.write(block)
+            written += len(block)
+            copy += 1
+    return written
+
+
+def legacy_find_warnings(file):
+    """The previous find_warnings loop, without its per-line prints."""
+    filename = ""
+    with open(file, "r") as f:
+        lints = f.read()
+    lints = lints.split("\n")
+    warnings = {}
+    for lint in lints:
+        lint = lint.strip()
+        lint = re.sub(r'\x1b\[.*?m', '', lint)
+        if lint.startswith("./"):
+            filename = lint
+        elif not lint.strip():
+            filename = ""
+            continue
+        elif filename:
+            if filename not in warnings:
+                warnings[filename] = [lint]
+            else:
+                warnings[filename] += [lint]
+    return warnings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lint.txt")
+        size = build_log(path, args.megabytes) / 1024 / 1024
+
+        start = time.perf_counter()
+        legacy = legacy_find_warnings(path)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = parse_lint_log_file(path)
+        seconds = time.perf_counter() - start
+
+    print(f"log size: {size:.1f} MB")
+    print(f"{'parser':<12}{'seconds':>10}{'MB/s':>10}{'files':>10}{'records':>10}")
+    print(f"{'legacy':<12}{legacy_seconds:>10.2f}{size / legacy_seconds:>10.1f}{len(legacy):>10}"
+          f"{sum(map(len, legacy.values())):>10}")
+    print(f"{'lint_log':<12}{seconds:>10.2f}{size / seconds:>10.1f}{len(index.files()):>10}{len(index):>10}")
+    print(f"rules: {index.rules()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Stand-in for "eslint --format json" used by the benchmarks.
+
+Flags the named imports that are used nowhere else in the file, the most
+common warning on generated code (see report.txt):
+
+    python bench_lint_stub.py path/to/file.tsx ...
+"""
+import json
+import os
+import re
+import sys
+
+NAMED_IMPORT_PATTERN = re.compile(r"^import\s+(?:type\s+)?\{(?P<names>[^}]*)\}\s+from", re.M)
+
+
+def lint_stub(paths):
+    """Prints ESLint JSON flagging the named imports used nowhere else."""
+    results = []
+    for path in paths:
+        with open(path, "r") as f:
+            code = f.read()
+        messages = []
+        for match in NAMED_IMPORT_PATTERN.finditer(code):
+            line = code.count("\n", 0, match.start()) + 1
+            for name in match.group("names").split(","):
+                name = re.split(r"\s+as\s+", name.strip())[-1].replace("type ", "").strip()
+                if name and len(re.findall(rf"\b{re.escape(name)}\b", code)) == 1:
+                    lines = code.split("\n")
+                    # the name may sit on a later line of a multi-line import
+                    for number in range(line, len(lines) + 1):
+                        col = lines[number - 1].find(name)
+                        if col >= 0:
+                            break
+                    messages.append({"line": number, "column": col + 1, "severity": 1,
+                                     "message": f"'{name}' is defined but never used.",
+                                     "ruleId": "@typescript-eslint/no-unused-vars"})
+        results.append({"filePath": os.path.abspath(path), "messages": messages})
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    lint_stub(sys.argv[1:])
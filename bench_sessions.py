@@ -0,0 +1,126 @@
+"""Load test of concurrent chat sessions on one event loop.
+
+Every session answers the three requirement questions, generates the code
+and runs the QA loop, against fake models and a stub linter, so no OpenAI
+key, network or node toolchain is needed:
+
+    python bench_sessions.py --sessions 8 --latency 0.5
+
+The blocking pipeline makes the same calls the chat handlers used to make
+(invoke, ask_next_question, chain.stream, subprocess.run) and so holds the
+loop for every session; the async pipeline is what kevin.py runs now.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from code_gen import aqa_fix_loop, agenerate_code_single_prompt, generate_code_single_prompt, qa_generate_code
+from fake_llm import FakeAgentChatModel, FakeCodeChatModel
+from generation_cache import cache
+from lint_runner import CommandLintRunner
+from probe_chain import aask_next_question, ask_next_question
+from rqmts_graph import get_requirements_bot
+
+ANSWERS = [
+    "model: Department",
+    "fields: id,name,type,category,description,isRequired",
+    "folder_location: {location}",
+]
+
+
+async def async_session(number, location, bot, agent_model, code_model, runner, timeline):
+    requirements = {"model": "", "fields": [], "folder_location": ""}
+    history = ["What is the model entity you want to work with?"]
+    for answer in ANSWERS:
+        history.append(answer.format(location=location))
+        response = await bot.ainvoke({"messages": history[-2:], "requirements": requirements})
+        requirements = response.get("requirements")
+        timeline.append((number, "answer", time.perf_counter()))
+        if not requirements["folder_location"]:
+            history.append(await aask_next_question(requirements, history, chat_model=agent_model))
+            timeline.append((number, "probe", time.perf_counter()))
+    files, failed = await agenerate_code_single_prompt(requirements, chat_model=code_model,
+                                                       callbacks=[], use_cache=False)
+    timeline.append((number, "generate", time.perf_counter()))
+    await aqa_fix_loop(files, requirements, runner=runner, chat_model=code_model)
+    timeline.append((number, "qa", time.perf_counter()))
+
+
+async def blocking_session(number, location, bot, agent_model, code_model, runner, timeline):
+    requirements = {"model": "", "fields": [], "folder_location": ""}
+    history = ["What is the model entity you want to work with?"]
+    for answer in ANSWERS:
+        history.append(answer.format(location=location))
+        response = bot.invoke({"messages": history[-2:], "requirements": requirements})
+        requirements = response.get("requirements")
+        timeline.append((number, "answer", time.perf_counter()))
+        await asyncio.sleep(0)
+        if not requirements["folder_location"]:
+            history.append(ask_next_question(requirements, history, chat_model=agent_model))
+            timeline.append((number, "probe", time.perf_counter()))
+            await asyncio.sleep(0)
+    files, failed = generate_code_single_prompt(requirements, chat_model=code_model, callbacks=[],
+                                                use_cache=False)
+    timeline.append((number, "generate", time.perf_counter()))
+    await asyncio.sleep(0)
+    qa_generate_code(files, requirements, runner=runner, chat_model=code_model)
+    timeline.append((number, "qa", time.perf_counter()))
+
+
+async def run_sessions(session, count, root, latency, tps):
+    agent_model = FakeAgentChatModel(latency=latency)
+    code_model = FakeCodeChatModel(first_token_latency=latency, tokens_per_second=tps)
+    bot = get_requirements_bot(model=agent_model)
+    # a linter that finds nothing, so the QA step is one lint per session
+    runner = CommandLintRunner([sys.executable, "-c", "print('[]')"], root)
+    timeline = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        session(number, os.path.join(root, f"session{number}"), bot, agent_model, code_model,
+                runner, timeline)
+        for number in range(count)))
+    return start, timeline
+
+
+def report(name, start, timeline, count):
+    print()
+    print(f"{name}: {count} sessions")
+    print(f"{'session':<10}{'first answer':>14}{'generated':>12}{'done':>10}")
+    firsts = []
+    for number in range(count):
+        events = [(step, moment - start) for session, step, moment in timeline if session == number]
+        firsts.append(next(seconds for step, seconds in events if step == "answer"))
+        generated = next(seconds for step, seconds in events if step == "generate")
+        print(f"{number:<10}{firsts[-1]:>14.2f}{generated:>12.2f}{events[-1][1]:>10.2f}")
+    done = max(moment for session, step, moment in timeline) - start
+    print(f"total {done:.2f}s, worst time to first answer {max(firsts):.2f}s")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model latency per call")
+    parser.add_argument("--tps", type=float, default=2000.0, help="fake code model tokens per second")
+    args = parser.parse_args()
+
+    os.makedirs("debug", exist_ok=True)
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, "package.json"), "w") as f:
+            f.write("{}")
+        cache.directory = os.path.join(root, "cache")
+        results = {}
+        for name, session in (("blocking", blocking_session), ("async", async_session)):
+            start, timeline = asyncio.run(run_sessions(session, args.sessions, root, args.latency,
+                                                       args.tps))
+            results[name] = report(name, start, timeline, args.sessions)
+
+    print()
+    print(f"speedup: {results['blocking'] / results['async']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,33 @@
+import asyncio
+import json
 import os
-import re
+import time
 import chainlit as cl
 from langchain.prompts import ChatPromptTemplate
-from langchain_community.chat_models import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain.schema.runnable.config import RunnableConfig
 
-import subprocess
-
-def save_to_file(result, location):
-    print("Saving to file...")
-    files = result.split("Filename: ")
-    for file in files:
-        if not file:
-            continue
-        filename, code = file.split("Code:")
-        print("Saving to file: ", filename)
-        dir = location
-        # append  dir to filename
-        filename = os.path.join(dir, filename.strip())
-        output_file = filename.strip().replace("templates/","")
-        if "-page.tsx" in output_file:
-            # remove name before -page.tsx
-            # get the filename only
-            dir_only = os.path.dirname(output_file)
-            output_file = os.path.join(dir_only, "page.tsx")
-        # add directory if not exists        
-        dir_name = os.path.dirname(output_file)
-        # sanity check of code
-        code = code.replace("```tsx", "").replace("```typescript", "").replace("```", "")
-        if not os.path.isfile(dir_name):
-            os.makedirs(dir_name, exist_ok=True)
-        with open(output_file, "w") as f:
-            f.write(code)
-            print(f"File {filename} has been generated.")
-    return files
-
-@cl.step
-def generate_code(requirements):
-    current_step = cl.context.current_step
-    current_step.input = "Generating code..."
-    print("Generating code...")
-    templates = {}
-    for root, dirs, files in os.walk("templates/app/(protected)/cases"):
-        for file in files:
-            with open(os.path.join(root, file), "r") as f:
-                templates[os.path.join(root, file)] = f.read()
-
-    # create the prompt with all the templates
-    boilerplate = ""
-    for index, template in enumerate(templates):
-        boilerplate += f"Start of Boilerplate #{index+1}: {template}\n"
-        boilerplate += f"{templates[template]}\n"
-        boilerplate += f"End of Boilerplate #{index+1}: {template}\n\n"
-
-        
-    template = """Generate {count} source code using next.js and prisma 
+from generation_cache import cache, llm_name
+from file_writer import staging, write_file
+from generation_manifest import GenerationManifest
+from lint_autofix import autofix
+from lint_log import parse_lint_log_file
+from lint_runner import EslintRunner, find_project_root
+from model_registry import models
+from prompt_budget import build_boilerplate
+from speculative import BufferWriter
+from stream_parser import StreamingFileParser
+from structure_check import StructureCheck
+from telemetry import telemetry
+import template_dag
+from template_registry import registry
+from template_renderer import render_template
+import wide_entity
+
+CASES_TEMPLATE_SET = "app/(protected)/cases"
+API_TEMPLATE_SET = "app/api/case"
+
+SINGLE_PROMPT_TEMPLATE = """Generate {count} source code using next.js and prisma 
     based on the given {count} boilerplate below. 
     Follow the boilerplate markers to generate the multiple code. 
 
@@ -73,43 +45,30 @@ def generate_code(requirements):
     Filename: [filename]
     Code: [code] 
     """
-    prompt = ChatPromptTemplate.from_template(template)
-
-    openai_chat_model = ChatOpenAI(model="gpt-4o", temperature=0)
-    cb = cl.AsyncLangchainCallbackHandler(stream_final_answer=True)
-    config = RunnableConfig(callbacks=[cb])
-    chain = prompt | openai_chat_model | StrOutputParser()
-    print(f"Invoking model with {len(templates)} templates...")
-    result = chain.invoke({"boilerplate": {boilerplate}, 
-                           "count": len(templates),
-                           "model": requirements["model"],
-                           "fields_newline": "\n".join(requirements["fields"])},
-                           config=config)
-    # save boilerplate to file
-    with open("debug/boilerplate.txt", "w") as f:
-        f.write(boilerplate)
+SINGLE_PROMPT = ChatPromptTemplate.from_template(SINGLE_PROMPT_TEMPLATE)
 
-    files = save_to_file(result, requirements["folder_location"])
+ONE_CODE_TEMPLATE = """Generate source code using next.js and prisma 
+    based on the given boilerplate below. 
+    Follow the boilerplate markers to generate the multiple code. 
 
-    print("Code generation complete.")
-    current_step.output = "Code generation complete."
-    return files
+    -----------------
+    {boilerplate}
+    -----------------
 
-def generate_one_code(requirements, filename):
-    print("Generating code...")
-    with open(filename, "r") as f:
-        template = f.read()
+    Replace the table name case to {model}.
+
+    Replace the fields of the boilerplate with to include the new fields below:
+      {fields_newline} 
 
-    # create the prompt with all the templates
-    boilerplate = ""
-    boilerplate += f"Start of Boilerplate: {filename}\n"
-    boilerplate += f"{template}\n"
-    boilerplate += f"End of Boilerplate: {filename}\n\n"
 
-        
-    template = """Generate source code using next.js and prisma 
+    Respond immediately in the following format:
+    Filename: [filename]
+    Code: [code] 
+    """
+ONE_CODE_PROMPT = ChatPromptTemplate.from_template(ONE_CODE_TEMPLATE)
+
+DEPENDENT_TEMPLATE = """Generate source code using next.js and prisma 
     based on the given boilerplate below. 
-    Follow the boilerplate markers to generate the multiple code. 
 
     -----------------
     {boilerplate}
@@ -120,119 +79,877 @@ def generate_one_code(requirements, filename):
     Replace the fields of the boilerplate with to include the new fields below:
       {fields_newline} 
 
+    The code uses these files, already generated for {model}. Import and call them
+    exactly as they are declared here:
+
+{signatures}
+
+
+    Respond immediately in the following format:
+    Filename: [filename]
+    Code: [code] 
+    """
+DEPENDENT_PROMPT = ChatPromptTemplate.from_template(DEPENDENT_TEMPLATE)
+
+FIX_TEMPLATE = """Fix the warnings that are present in the given source code below.
+
+    -----------------
+    {code}
+    -----------------
+
+    {warnings}
 
     Respond immediately in the following format:
     Filename: [filename]
     Code: [code] 
     """
-    prompt = ChatPromptTemplate.from_template(template)
-
-    openai_chat_model = ChatOpenAI(model="gpt-4o", temperature=0)
-    cb = cl.AsyncLangchainCallbackHandler(stream_final_answer=True)
-    config = RunnableConfig(callbacks=[cb])
-    chain = prompt | openai_chat_model | StrOutputParser()
-    print(f"Invoking model with {filename}...")
-    result = chain.invoke({"boilerplate": {boilerplate}, 
-                           "model": requirements["model"],
-                           "fields_newline": "\n".join(requirements["fields"])},
-                           config=config)
+FIX_PROMPT = ChatPromptTemplate.from_template(FIX_TEMPLATE)
+
+PATCH_TEMPLATE = """Update the source code below, generated for the model {model}, to its new list of fields.
+    Fields added: {added}
+    Fields removed: {removed}
+
+    -----------------
+Start of Boilerplate: {filename}
+{code}
+End of Boilerplate: {filename}
+    -----------------
+
+    The code may have been edited by hand. Change only what declares, displays, validates or
+    submits the added and removed fields, and keep every other line exactly as it is.
+
+    Respond immediately in the following format:
+    Filename: [filename]
+    Code: [code]
+    """
+PATCH_PROMPT = ChatPromptTemplate.from_template(PATCH_TEMPLATE)
+
+def save_to_file(result, location, writer=None, check=None):
+    """Writes the files of a completion. With a writer they are only staged,
+    and the caller flushes it. Files check finds problems in are skipped."""
+    print("Saving to file...")
+    with staging(writer) as batch:
+        parser = file_stream_parser(location, batch, check)
+        parser.feed(result)
+        parser.close()
+        if writer is None:
+            batch.flush()
+    return result.split("Filename: ")
+
+def file_stream_parser(location, writer, check=None):
+    """Returns a StreamingFileParser that stages every file under location
+    in writer as soon as it is complete, unless check(filename, code)
+    returns problems."""
+    def on_file(filename, code):
+        if check is not None and check(filename, code):
+            return
+        print("Saving to file: ", filename)
+        write_code(filename, code, location, writer)
+    return StreamingFileParser(on_file)
+
+def stream_to_file(chunks, location, writer=None, check=None):
+    """Consumes a completion stream, staging files while it arrives and
+    writing them together once it is complete, or leaving them staged in
+    writer for the caller to flush.
+
+    Returns:
+        tuple: (result, timings) with the full completion text and the
+        per-file time to first byte and time to complete.
+    """
+    with staging(writer) as batch:
+        parser = file_stream_parser(location, batch, check)
+        result = ""
+        for chunk in chunks:
+            result += chunk
+            parser.feed(chunk)
+        timings = parser.close()
+        if writer is None:
+            batch.flush()
+    _print_timings(timings)
+    return result, timings
+
+async def astream_to_file(chunks, location, writer=None, check=None):
+    """Async variant of stream_to_file. Files are staged on worker threads
+    so the event loop keeps serving other sessions."""
+    with staging(writer) as batch:
+        writes = []
+
+        def on_file(filename, code):
+            if check is not None and check(filename, code):
+                return
+            print("Saving to file: ", filename)
+            writes.append(asyncio.create_task(asyncio.to_thread(write_code, filename, code,
+                                                                location, batch)))
+        parser = StreamingFileParser(on_file)
+        result = ""
+        async for chunk in chunks:
+            result += chunk
+            parser.feed(chunk)
+        timings = parser.close()
+        await asyncio.gather(*writes)
+        if writer is None:
+            await asyncio.to_thread(batch.flush)
+    _print_timings(timings)
+    return result, timings
+
+def _print_timings(timings):
+    for timing in timings:
+        if timing.truncated:
+            print(f"{timing.filename}: truncated, not saved")
+        elif timing.completed is not None:
+            print(f"{timing.filename}: first byte {timing.first_byte:.2f}s, complete {timing.completed:.2f}s")
+
+def _without_file(files, *filenames):
+    """Drops the files named filenames from a save_to_file result."""
+    filenames = {filename.strip() for filename in filenames}
+    return [file for file in files if file.split("\n", 1)[0].strip() not in filenames]
+
+def output_path(filename, location):
+    dir = location
+    # append  dir to filename
+    filename = os.path.join(dir, filename.strip())
+    output_file = filename.strip().replace("templates/","")
+    if "-page.tsx" in output_file:
+        # remove name before -page.tsx
+        # get the filename only
+        dir_only = os.path.dirname(output_file)
+        output_file = os.path.join(dir_only, "page.tsx")
+    return output_file
+
+def output_paths(files, location):
+    """Maps the save_to_file result back to the paths that were written."""
+    paths = []
+    for file in files:
+        filename = file.split("\n", 1)[0].strip()
+        if filename:
+            paths.append(output_path(filename, location))
+    return paths
+
+def write_code(filename, code, location, writer=None):
+    """Stages the file in writer, or writes it right away without one.
+    Files whose content is unchanged are not rewritten."""
+    with telemetry.stage("saving"):
+        output_file = output_path(filename, location)
+        # sanity check of code
+        code = code.replace("```tsx", "").replace("```typescript", "").replace("```", "")
+        if writer is None:
+            status = write_file(output_file, code)
+        else:
+            status = writer.stage(output_file, code)
+        if status == "unchanged":
+            print(f"File {output_file} is unchanged.")
+    return output_file
+
+@cl.step
+def generate_code(requirements, use_cache=True):
+    current_step = cl.context.current_step
+    current_step.input = "Generating code..."
+    files, failed = generate_code_single_prompt(requirements, use_cache=use_cache)
+    current_step.output = "Code generation complete."
+    return files, failed
+
+def _single_prompt_chain(requirements, chat_model=None, template_set=CASES_TEMPLATE_SET):
+    templates = registry.templates(template_set)
+    openai_chat_model = chat_model or models.model("generation")
+    chain = models.chain("single_prompt", lambda model: SINGLE_PROMPT | model | StrOutputParser(),
+                         openai_chat_model)
+    inputs = {"count": len(templates),
+              "model": requirements["model"],
+              "fields_newline": "\n".join(requirements["fields"])}
+    boilerplate = build_boilerplate("single_prompt",
+                                    [(template.path, template.code) for template in templates],
+                                    SINGLE_PROMPT_TEMPLATE, inputs, llm_name(openai_chat_model),
+                                    numbered=True)
+    inputs["boilerplate"] = boilerplate
+    key = cache.key(boilerplate, requirements, SINGLE_PROMPT_TEMPLATE, openai_chat_model)
+    return chain, inputs, boilerplate, key
+
+def _split_rejected(check):
+    """Splits the files check rejected into {filename: template} to
+    generate again and {filename: error} of the files no template matches.
+    """
+    templates, failed = {}, {}
+    for filename, problems in check.rejected.items():
+        template = check.template(filename)
+        if template is None:
+            failed[filename] = "; ".join(problems)
+        else:
+            templates[filename] = template
+    return templates, failed
+
+def generate_code_single_prompt(requirements, chat_model=None, callbacks=None, use_cache=True,
+                                writer=None, template_set=CASES_TEMPLATE_SET):
+    """Generates every template of template_set in one completion. A file
+    that fails the structural check is generated again on its own.
+
+    Returns:
+        tuple: (files, failed) as for generate_code_concurrent
+    """
+    print("Generating code...")
+    chain, inputs, boilerplate, key = _single_prompt_chain(requirements, chat_model, template_set)
+    check = StructureCheck(requirements)
+    with telemetry.stage("generation"):
+        result = cache.get(key) if use_cache else None
+        if result is None:
+            if callbacks is None:
+                callbacks = [cl.AsyncLangchainCallbackHandler(stream_final_answer=True)]
+            config = RunnableConfig(callbacks=callbacks)
+            print(f"Invoking model with {inputs['count']} templates...")
+            chunks = chain.stream(inputs, config=config)
+            result, timings = stream_to_file(chunks, requirements["folder_location"], writer, check)
+            if not check.rejected:
+                cache.put(key, result)
+            files = result.split("Filename: ")
+        else:
+            print("Using cached completion.")
+            files = save_to_file(result, requirements["folder_location"], writer, check)
+    files = _without_file(files, *check.rejected)
+    rejected, failed = _split_rejected(check)
+    for filename, template in rejected.items():
+        generated = generate_one_code(requirements, template.path, chat_model, callbacks,
+                                      use_cache=use_cache, writer=writer)
+        if output_paths(generated, ""):
+            files += generated
+        else:
+            failed[template.path] = "; ".join(check.rejected[filename])
     # save boilerplate to file
     with open("debug/boilerplate.txt", "w") as f:
         f.write(boilerplate)
 
-    files = save_to_file(result, requirements["folder_location"])
+    print("Code generation complete.")
+    return files, failed
+
+async def agenerate_code_single_prompt(requirements, chat_model=None, callbacks=None, use_cache=True,
+                                       writer=None, template_set=CASES_TEMPLATE_SET):
+    """Async variant of generate_code_single_prompt.
+
+    Returns:
+        tuple: (files, failed) as for generate_code_concurrent
+    """
+    print("Generating code...")
+    chain, inputs, boilerplate, key = _single_prompt_chain(requirements, chat_model, template_set)
+    check = StructureCheck(requirements)
+    with telemetry.stage("generation"):
+        result = await asyncio.to_thread(cache.get, key) if use_cache else None
+        if result is None:
+            if callbacks is None:
+                callbacks = [cl.AsyncLangchainCallbackHandler(stream_final_answer=True)]
+            config = RunnableConfig(callbacks=callbacks)
+            print(f"Invoking model with {inputs['count']} templates...")
+            chunks = chain.astream(inputs, config=config)
+            result, timings = await astream_to_file(chunks, requirements["folder_location"], writer,
+                                                    check)
+            if not check.rejected:
+                await asyncio.to_thread(cache.put, key, result)
+            files = result.split("Filename: ")
+        else:
+            print("Using cached completion.")
+            files = await asyncio.to_thread(save_to_file, result, requirements["folder_location"],
+                                            writer, check)
+    # files that failed the check are generated again on their own, right away
+    files = _without_file(files, *check.rejected)
+    rejected, failed = _split_rejected(check)
+    semaphore = asyncio.Semaphore(4)
+    results = await asyncio.gather(*(
+        _agenerate_with_retries(requirements, template.path, semaphore, 2, chat_model,
+                                callbacks, use_cache, writer)
+        for template in rejected.values()))
+    for template, (generated, error) in zip(rejected.values(), results):
+        files += generated
+        if error:
+            failed[template.path] = error
+
+    def save_boilerplate():
+        os.makedirs("debug", exist_ok=True)
+        with open("debug/boilerplate.txt", "w") as f:
+            f.write(boilerplate)
+    await asyncio.to_thread(save_boilerplate)
+
+    print("Code generation complete.")
+    return files, failed
+
+def _one_code_chain(requirements, filename, chat_model=None, boilerplate=None, signatures=None):
+    """Returns (chain, inputs, boilerplate, key) for one template. An explicit
+    boilerplate, like the partial rendering of generate_code_offline, is
+    used as is."""
+    openai_chat_model = chat_model or models.model("generation")
+    inputs = {"model": requirements["model"],
+              "fields_newline": "\n".join(requirements["fields"])}
+    if signatures:
+        name, prompt, template = "dependent_code", DEPENDENT_PROMPT, DEPENDENT_TEMPLATE
+        inputs["signatures"] = signatures
+    else:
+        name, prompt, template = "one_code", ONE_CODE_PROMPT, ONE_CODE_TEMPLATE
+    chain = models.chain(name, lambda model: prompt | model | StrOutputParser(), openai_chat_model)
+    if boilerplate is None:
+        code = registry.get_path(filename).code
+        boilerplate = build_boilerplate(name, [(filename, code)], template, inputs,
+                                        llm_name(openai_chat_model))
+    inputs["boilerplate"] = boilerplate
+    key = cache.key(boilerplate + (signatures or ""), requirements, template, openai_chat_model)
+    return chain, inputs, boilerplate, key
+
+def generate_one_code(requirements, filename, chat_model=None, callbacks=None, boilerplate=None,
+                      use_cache=True, writer=None):
+    print("Generating code...")
+    chain, inputs, boilerplate, key = _one_code_chain(requirements, filename, chat_model, boilerplate)
+    with telemetry.stage("generation", template=filename):
+        # one more completion when the file fails the structural check
+        for attempt in range(2):
+            check = StructureCheck(requirements)
+            result = cache.get(key) if use_cache and attempt == 0 else None
+            if result is None:
+                if callbacks is None:
+                    callbacks = [cl.AsyncLangchainCallbackHandler(stream_final_answer=True)]
+                config = RunnableConfig(callbacks=callbacks)
+                print(f"Invoking model with {filename}...")
+                chunks = chain.stream(inputs, config=config)
+                result, timings = stream_to_file(chunks, requirements["folder_location"], writer,
+                                                 check)
+                if not check.rejected:
+                    cache.put(key, result)
+                files = result.split("Filename: ")
+            else:
+                print(f"Using cached completion for {filename}.")
+                files = save_to_file(result, requirements["folder_location"], writer, check)
+            if not check.rejected:
+                break
+            files = _without_file(files, *check.rejected)
+            telemetry.retry("generation", filename)
+    # save boilerplate to file
+    with open("debug/boilerplate.txt", "w") as f:
+        f.write(boilerplate)
 
     print("Code generation complete.")
     return files
 
+async def agenerate_one_code(requirements, filename, chat_model=None, callbacks=None, use_cache=True,
+                             writer=None, signatures=None):
+    """Async variant of generate_one_code. The file is written as soon as
+    this template's completion arrives. signatures, from template_dag, are
+    the declarations of the generated files this one depends on."""
+    chain, inputs, boilerplate, key = _one_code_chain(requirements, filename, chat_model,
+                                                      signatures=signatures)
+    with telemetry.stage("generation", template=filename):
+        result = await asyncio.to_thread(cache.get, key) if use_cache else None
+        if result is not None:
+            print(f"Using cached completion for {filename}.")
+            check = StructureCheck(requirements)
+            files = await asyncio.to_thread(save_to_file, result, requirements["folder_location"],
+                                            writer, check)
+            if not check.rejected:
+                return files
+        check = StructureCheck(requirements)
+        config = RunnableConfig(callbacks=callbacks or [])
+        print(f"Invoking model with {filename}...")
+        chunks = chain.astream(inputs, config=config)
+        result, timings = await astream_to_file(chunks, requirements["folder_location"], writer,
+                                                check)
+        if not any(timing.completed is not None for timing in timings):
+            raise ValueError(f"No file found in the completion for {filename}")
+        if any(timing.truncated for timing in timings):
+            raise ValueError(f"Truncated completion for {filename}")
+        if check.rejected:
+            raise ValueError(f"Structural check failed for {check.describe()}")
+        await asyncio.to_thread(cache.put, key, result)
+        return result.split("Filename: ")
+
+async def generate_code_concurrent(requirements, template_set=CASES_TEMPLATE_SET,
+                                   max_concurrency=4, max_retries=2,
+                                   chat_model=None, callbacks=None, use_cache=True, writer=None):
+    """Generates every template of template_set with one request per
+    template, at most max_concurrency in flight at a time.
+
+    A template whose completion fails or cannot be parsed is retried on its
+    own, up to max_retries times, without touching the others. The files
+    are written together at the end, or left staged in writer.
+
+    Returns:
+        tuple: (files, failed) where files is the save_to_file output of all
+        successful templates and failed maps template filename to the last
+        error message.
+    """
+    print("Generating code concurrently...")
+    filenames = [template.path for template in registry.templates(template_set)]
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with staging(writer) as batch:
+        results = await asyncio.gather(*(
+            _agenerate_with_retries(requirements, filename, semaphore, max_retries, chat_model,
+                                    callbacks, use_cache, batch)
+            for filename in filenames))
+        if writer is None:
+            await asyncio.to_thread(batch.flush)
+    files, failed = [], {}
+    for filename, (generated, error) in zip(filenames, results):
+        files += generated
+        if error:
+            failed[filename] = error
+    print(f"Code generation complete. {len(filenames) - len(failed)}/{len(filenames)} templates generated.")
+    return files, failed
+
+async def _agenerate_with_retries(requirements, filename, semaphore, max_retries,
+                                  chat_model=None, callbacks=None, use_cache=True, writer=None,
+                                  signatures=None):
+    """Runs agenerate_one_code under semaphore, retrying it on failure.
+
+    Returns:
+        tuple: (files, error) with the error message of the last attempt,
+        or None when the template was generated.
+    """
+    error = None
+    for attempt in range(max_retries + 1):
+        async with semaphore:
+            try:
+                return await agenerate_one_code(requirements, filename, chat_model,
+                                                callbacks, use_cache, writer, signatures), None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"Generation of {filename} failed (attempt {attempt+1}): {error}")
+                if attempt < max_retries:
+                    telemetry.retry("generation", filename)
+    return [], error
+
+def _file_signatures(files):
+    """Returns the template_dag signatures of the files of a completion."""
+    signatures = []
+    for file in files:
+        filename, _, code = file.partition("\n")
+        if filename.strip() and "Code:" in code:
+            code = code.split("Code:", 1)[1]
+            code = code.replace("```tsx", "").replace("```typescript", "").replace("```", "")
+            signatures.append(template_dag.signatures(filename.strip(), code))
+    return "\n\n".join(signatures)
+
+async def generate_code_dag(requirements, template_sets=(CASES_TEMPLATE_SET, API_TEMPLATE_SET),
+                            max_concurrency=4, max_retries=2, chat_model=None, callbacks=None,
+                            use_cache=True, writer=None):
+    """Generates the templates of template_sets in the order of their
+    import and API dependencies, one request per template.
+
+    A template starts once the templates it depends on are generated, and
+    gets their signatures (exported names, props, API shape) in its prompt
+    instead of their boilerplate; independent templates run concurrently,
+    at most max_concurrency at a time. A template whose dependency failed
+    is still generated, without that signature.
+
+    Returns:
+        tuple: (files, failed) as for generate_code_concurrent
+    """
+    templates = [template for template_set in template_sets
+                 for template in registry.templates(template_set)]
+    graph = template_dag.dependencies(templates)
+    order = template_dag.levels(graph)
+    print("Generating code by dependencies: "
+          + " -> ".join(str([os.path.basename(path) for path in level]) for level in order))
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with staging(writer) as batch:
+        tasks = {}
+
+        async def run(filename):
+            results = [await tasks[depend] for depend in graph[filename]]
+            signatures = "\n\n".join(signature for _, _, signature in results if signature)
+            generated, error = await _agenerate_with_retries(requirements, filename, semaphore,
+                                                             max_retries, chat_model, callbacks,
+                                                             use_cache, batch, signatures or None)
+            return generated, error, _file_signatures(generated)
+
+        # dependencies come first in order, so their tasks exist when awaited
+        for level in order:
+            for filename in level:
+                tasks[filename] = asyncio.create_task(run(filename))
+        results = await asyncio.gather(*tasks.values())
+        if writer is None:
+            await asyncio.to_thread(batch.flush)
+    files, failed = [], {}
+    for filename, (generated, error, _) in zip(tasks, results):
+        files += generated
+        if error:
+            failed[filename] = error
+    print(f"Code generation complete. {len(tasks) - len(failed)}/{len(tasks)} templates generated.")
+    return files, failed
+
+async def _agenerate_group(requirements, filename, fields, template_sections, semaphore,
+                           max_retries, chat_model=None, callbacks=None, use_cache=True):
+    """Generates filename for one group of fields into memory, again with
+    the cache bypassed while the output misses or repeats any of them.
+
+    Returns:
+        tuple: ((path, code), error) with the error message of the last
+        attempt, or None when the group was generated.
+    """
+    group = dict(requirements, fields=fields, folder_location="")
+    error = None
+    for attempt in range(max_retries + 1):
+        buffer = BufferWriter()
+        generated, error = await _agenerate_with_retries(group, filename, semaphore, 0, chat_model,
+                                                         callbacks, use_cache and attempt == 0,
+                                                         buffer)
+        if error is None:
+            if len(buffer.files) != 1:
+                error = f"Expected one file, got {len(buffer.files)}"
+            else:
+                path, code = next(iter(buffer.files.items()))
+                problems = wide_entity.validate(code, fields, template_sections)
+                if not problems:
+                    return (path, code), None
+                error = "; ".join(problems)
+        print(f"Generation of {filename} for {fields[0]}..{fields[-1]} failed "
+              f"(attempt {attempt+1}): {error}")
+        if attempt < max_retries:
+            telemetry.retry("generation", filename)
+    return None, error
+
+async def generate_code_wide(requirements, template_set=CASES_TEMPLATE_SET, group_size=None,
+                             max_concurrency=4, max_retries=2, chat_model=None, callbacks=None,
+                             use_cache=True, writer=None):
+    """Generates the templates of template_set for an entity with too many
+    fields for one completion.
+
+    The fields are split into groups of group_size (KEVIN_WIDE_FIELD_GROUP
+    by default). Templates with field-dependent sections are generated once
+    per group, concurrently, and merged by wide_entity into one file whose
+    sections hold every field exactly once, and which goes through the
+    structural check like any generated file; the other templates get one
+    request with all the fields. The files are written together at the
+    end, or left staged in writer.
+
+    Returns:
+        tuple: (files, failed) as for generate_code_concurrent
+    """
+    groups = wide_entity.field_groups(requirements["fields"], group_size)
+    print(f"Generating code for {len(requirements['fields'])} fields "
+          f"in {len(groups)} groups of up to {len(groups[0])}...")
+    location = requirements["folder_location"]
+    semaphore = asyncio.Semaphore(max_concurrency)
+    check = StructureCheck(requirements)
+    with staging(writer) as batch:
+
+        async def run(template):
+            template_sections = wide_entity.sections(template.code)
+            if not template_sections or len(groups) == 1:
+                return await _agenerate_with_retries(requirements, template.path, semaphore,
+                                                     max_retries, chat_model, callbacks, use_cache,
+                                                     batch)
+            results = await asyncio.gather(*(
+                _agenerate_group(requirements, template.path, fields, template_sections, semaphore,
+                                 max_retries, chat_model, callbacks, use_cache)
+                for fields in groups))
+            errors = [error for _, error in results if error]
+            if errors:
+                return [], "; ".join(errors)
+            path = results[0][0][0]
+            merged = wide_entity.merge([code for (_, code), _ in results], groups, template_sections)
+            problems = wide_entity.validate(merged, requirements["fields"], template_sections)
+            if problems:
+                return [], f"Merged {path}: " + "; ".join(problems)
+            problems = check(path, merged)
+            if problems:
+                return [], f"Structural check failed for merged {path}: " + "; ".join(problems)
+            print(f"Merged {template.path} from {len(groups)} groups.")
+            await asyncio.to_thread(batch.stage, os.path.join(location, path), merged)
+            return [f"{path}\nCode:{merged}"], None
+
+        templates = registry.templates(template_set)
+        results = await asyncio.gather(*(run(template) for template in templates))
+        if writer is None:
+            await asyncio.to_thread(batch.flush)
+    files, failed = [], {}
+    for template, (generated, error) in zip(templates, results):
+        files += generated
+        if error:
+            failed[template.path] = error
+    print(f"Code generation complete. {len(templates) - len(failed)}/{len(templates)} templates generated.")
+    return files, failed
+
+def _patch_chain(chat_model=None):
+    return models.chain("patch", lambda model: PATCH_PROMPT | model | StrOutputParser(),
+                        chat_model or "generation")
+
+async def apatch_code(requirements, item, chat_model=None, callbacks=None, use_cache=True,
+                      writer=None):
+    """Applies the field diff of a manifest plan item to its hand-edited
+    output files, one LLM call per file, keeping the manual edits.
+
+    Returns:
+        list: the patched files in the save_to_file format
+    """
+    location = requirements["folder_location"]
+    openai_chat_model = chat_model or models.model("generation")
+    chain = _patch_chain(openai_chat_model)
+    files = []
+    for path in item.outputs:
+        filename = os.path.relpath(path, location)
+        with telemetry.stage("generation", template=item.template.path):
+            code = await asyncio.to_thread(_read_code, path)
+            key = cache.key(code, requirements, PATCH_TEMPLATE, openai_chat_model)
+            result = await asyncio.to_thread(cache.get, key) if use_cache else None
+            if result is None:
+                print(f"Patching {filename}: {item.reason}...")
+                result = await chain.ainvoke({"model": requirements["model"],
+                                              "added": ", ".join(item.diff.added) or "none",
+                                              "removed": ", ".join(item.diff.removed) or "none",
+                                              "filename": filename, "code": code},
+                                             config=RunnableConfig(callbacks=callbacks or []))
+            patched = []
+            parser = StreamingFileParser(lambda _, code: patched.append(code))
+            parser.feed(result)
+            parser.close()
+            if len(patched) != 1:
+                raise ValueError(f"Expected one file in the patch of {filename}, got {len(patched)}")
+            await asyncio.to_thread(cache.put, key, result)
+            await asyncio.to_thread(write_code, filename, patched[0], location, writer)
+            files.append(f"{filename}\nCode:{patched[0]}")
+    return files
 
-def find_warnings():
-    file = "debug/lint.txt"
-    filename = ""
-    with open(file, "r") as f:
-        lints = f.read()
-    # split into "web:lint"
-    lints = lints.split("\n")
-    warnings = {}
-    # check if there are any warnings for the files generated
-    for lint in lints:        
-        # if this refers to new file, get the filename
-        lint = lint.strip()
-        lint = re.sub(r'\x1b\[.*?m', '', lint)        
-        print(lint)
-        if lint.startswith("./"):
-            print('START')
-            filename = lint
-        # if blank, disregard
-        elif not lint.strip():
-            print('END')
-            filename = ""
+def _read_code(path):
+    with open(path, "r") as f:
+        return f.read()
+
+async def generate_code_incremental(requirements, template_set=CASES_TEMPLATE_SET,
+                                    max_concurrency=4, max_retries=2, force=False,
+                                    chat_model=None, callbacks=None, use_cache=True, writer=None):
+    """Regenerates only what changed since the last generation of this model
+    in folder_location, as planned from its generation_manifest.
+
+    Templates whose inputs are unchanged are skipped, changed ones are
+    regenerated, and files edited by hand since are patched with the field
+    diff instead. Files whose template changed under manual edits are left
+    alone and reported as conflicts, unless force is set.
+
+    The files are written together before the manifest records their
+    hashes, so writer is always flushed.
+
+    Returns:
+        tuple: (files, report) where files is the save_to_file output of
+        the generated and patched templates, and report maps every action
+        to its template paths, plus "failed" to the errors per template.
+    """
+    print("Planning incremental generation...")
+    location = requirements["folder_location"]
+    manifest = await asyncio.to_thread(GenerationManifest, location)
+    plan = await asyncio.to_thread(manifest.plan, requirements,
+                                   registry.templates(template_set), force)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with staging(writer) as writer:
+
+        async def run(item):
+            print(f"{item.template.path}: {item.action}, {item.reason}")
+            if item.action in ("generate", "regenerate"):
+                return await _agenerate_with_retries(requirements, item.template.path, semaphore,
+                                                     max_retries, chat_model, callbacks, use_cache,
+                                                     writer)
+            if item.action == "patch":
+                async with semaphore:
+                    try:
+                        return await apatch_code(requirements, item, chat_model, callbacks,
+                                                 use_cache, writer), None
+                    except Exception as e:
+                        return [], f"{type(e).__name__}: {e}"
+            return [], None
+
+        results = await asyncio.gather(*(run(item) for item in plan))
+        await asyncio.to_thread(writer.flush)
+    files = []
+    report = {action: [] for action in ("generate", "regenerate", "patch", "skip", "conflict")}
+    report["failed"] = {}
+    for item, (generated, error) in zip(plan, results):
+        files += generated
+        if error:
+            report["failed"][item.template.path] = error
             continue
-        elif filename:
-            print('.')
-            # add the rows to the warnings
-            # if dict does not exist, add it else, append to array of warnings
-            if filename not in warnings:
-                warnings[filename] = [lint]
-            else:
-                warnings[filename] += [lint]
-    
-    return warnings
+        report[item.action].append(item.template.path)
+        if item.action in ("generate", "regenerate"):
+            manifest.record(requirements, item.template, output_paths(generated, location))
+        elif item.action == "patch":
+            manifest.record(requirements, item.template, item.outputs, manual_edits=True)
+        elif item.action == "skip" and item.diff:
+            manifest.update_fields(requirements, item.template)
+    await asyncio.to_thread(manifest.save)
+    print("Incremental generation complete: "
+          + ", ".join(f"{len(paths)} {action}" for action, paths in report.items()))
+    return files, report
+
+def generate_code_offline(requirements, template_set=CASES_TEMPLATE_SET, llm_fallback=True,
+                          chat_model=None, callbacks=None, use_cache=True, writer=None,
+                          cancelled=None):
+    """Offline-first generation: renders the templates locally with
+    template_renderer and calls the LLM only for templates that still have
+    unresolved regions, handing it the partially rendered code.
+
+    With llm_fallback=False the partially rendered code is written as is.
+    The files are written together at the end, or left staged in writer.
+    cancelled, a threading.Event, stops the generation before the next
+    template, since it runs on a worker thread that a cancelled task does
+    not stop.
+
+    Raises:
+        RuntimeError: when cancelled is set
+    """
+    print("Rendering code...")
+    with staging(writer) as batch:
+        files = []
+        for template in registry.templates(template_set):
+            if cancelled is not None and cancelled.is_set():
+                raise RuntimeError(f"Generation of {requirements['model']} cancelled")
+            result = render_template(template.path, template.code,
+                                     requirements["model"], requirements["fields"])
+            if not result.unresolved:
+                files.append(f"{result.path}\nCode:{result.code}")
+                write_code(result.path, result.code, requirements["folder_location"], batch)
+                continue
+            print(f"Unresolved regions in {template.path}: {result.unresolved}")
+            if not llm_fallback:
+                files.append(f"{result.path}\nCode:{result.code}")
+                write_code(result.path, result.code, requirements["folder_location"], batch)
+                continue
+            boilerplate = (f"Start of Boilerplate: {result.path}\n"
+                           f"{result.code}\n"
+                           f"End of Boilerplate: {result.path}\n\n")
+            files += generate_one_code(requirements, result.path, chat_model, callbacks, boilerplate,
+                                       use_cache, batch)
+        if writer is None:
+            batch.flush()
+    print("Code generation complete.")
+    return files
+
+def find_warnings(file="debug/lint.txt"):
+    """Returns the warning lines of a saved lint log, per file."""
+    index = parse_lint_log_file(file)
+    return {filename: [str(warning) for warning in warnings]
+            for filename, warnings in index.by_file.items()}
 
 
-def qa_generate_code(files):
-    # execute pnpm lint as a command line on the project folder and save result to file
-    # base_folder = path.dirname(files[0])
-    base_path = "/Users/mlmnl/Documents/psi/brad/apps/web/"
-    lint_file = "debug/lint.txt"
+def _lint_paths(files, requirements, runner=None):
+    location = requirements["folder_location"]
+    paths = [os.path.abspath(path) for path in output_paths(files, location)]
+    if runner is None:
+        runner = EslintRunner(find_project_root(location))
+    return paths, runner
 
+def _save_lint(warnings, lint_file="debug/lint.json"):
+    os.makedirs(os.path.dirname(lint_file), exist_ok=True)
     with open(lint_file, "w") as f:
-        # run the command and redirect output to file
-        subprocess.run(["pnpm", "lint"], cwd=base_path, stdout=f)
-        print("Linting complete.")
-    # check the results of linting for the given files
-    warnings = find_warnings()
-    for file in files:
-        # if there is a warning for this file
-        file_rel = file.replace(base_path, "./")
-        print(f"Checking lint of {file_rel}...")
-        if file_rel in warnings:
-            print(f"Fixing warnings for {file_rel}...")
-            # read the contents of the file
-            with open(file, "r") as f:
-                code = f.read()
-
-            template = """Fix the warnings that are present in the given source code below.
-
-            -----------------
-            {code}
-            -----------------
-
-            {warnings}
-
-            Respond immediately in the following format:
-            Filename: [filename]
-            Code: [code] 
-            """
-            prompt = ChatPromptTemplate.from_template(template)     
-            openai_chat_model = ChatOpenAI(model="gpt-4o")        
-            chain = prompt | openai_chat_model | StrOutputParser()
-            result = chain.invoke({"code": {code}, 
-                                  "warnings": warnings[file_rel]})
-            
-            subfiles = result.split("Filename: ")
-            for subfile in subfiles:
-                if not subfile:
-                    continue
-                filename, code = subfile.split("Code:")
-                print("Updating file: ", file)
-                with open(file, "w") as f:
-                    f.write(code)
-                    print(f"File {file} has been updated.")
+        json.dump({path: [w.as_dict() for w in file_warnings]
+                   for path, file_warnings in warnings.items()}, f, indent=2)
+
+def _fix_chain(chat_model=None):
+    return models.chain("fix", lambda model: FIX_PROMPT | model | StrOutputParser(),
+                        chat_model or "fixing", priority="fix")
+
+def _fix_inputs(file, warnings):
+    # read the contents of the file
+    with open(file, "r") as f:
+        code = f.read()
+    return {"code": code, "warnings": "\n".join(str(w) for w in warnings)}
+
+def _save_fix(file, result):
+    def update(filename, code):
+        print("Updating file: ", file)
+        print(f"File {file} is {write_file(file, code)}.")
+    parser = StreamingFileParser(update)
+    parser.feed(result)
+    parser.close()
+
+def qa_generate_code(files, requirements, runner=None, chat_model=None):
+    """Lints only the generated files and asks the LLM to fix the ones with
+    warnings, in a single pass.
+
+    Args:
+        files: the save_to_file result of the generation
+        requirements: the requirements, folder_location locates the project
+        runner: lint runner with a run(paths) method returning
+            {path: [LintWarning]}, defaults to eslint in the project root
+
+    Returns:
+        dict: the warnings found per file before fixing
+    """
+    paths, runner = _lint_paths(files, requirements, runner)
+    with telemetry.stage("linting"):
+        warnings = runner.run(paths)
+    print("Linting complete.")
+    _save_lint(warnings)
+    with telemetry.stage("fixing"):
+        escalated, counts = autofix(warnings)
+        chain = _fix_chain(chat_model)
+        for file in paths:
+            # if there is a warning for this file
+            print(f"Checking lint of {file}...")
+            if file in escalated:
+                print(f"Fixing warnings for {file}...")
+                result = chain.invoke(_fix_inputs(file, escalated[file]))
+                _save_fix(file, result)
+    print(f"Autofix: {counts['fixed']} warnings fixed locally, {counts['escalated']} by the LLM.")
+    return warnings
+
+async def _alint(runner, paths):
+    """Lints on an asyncio subprocess when the runner supports it, else on a
+    worker thread."""
+    with telemetry.stage("linting"):
+        if hasattr(runner, "arun"):
+            return await runner.arun(paths)
+        return await asyncio.to_thread(runner.run, paths)
+
+async def aqa_fix_loop(files, requirements, runner=None, max_rounds=3, max_concurrency=4,
+                       chat_model=None):
+    """Lints the generated files, fixes every flagged file concurrently and
+    re-lints only the files it touched, until they are clean or max_rounds
+    fix rounds have run.
+
+    Warnings the rule-based fixer in lint_autofix can handle are fixed
+    locally first; only the rest go to the LLM.
+
+    Returns:
+        dict: "initial" and "remaining" warnings per file, per "rounds" the
+        number of files fixed, warnings fixed locally and escalated, fix
+        and lint seconds and the number of warnings left.
+    """
+    paths, runner = _lint_paths(files, requirements, runner)
+    start = time.perf_counter()
+    warnings = await _alint(runner, paths)
+    print(f"Linting complete in {time.perf_counter() - start:.2f}s.")
+    initial = dict(warnings)
+    chain = _fix_chain(chat_model)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fix(file, file_warnings):
+        async with semaphore:
+            print(f"Fixing warnings for {file}...")
+            with telemetry.stage("fixing", template=os.path.basename(file)):
+                inputs = await asyncio.to_thread(_fix_inputs, file, file_warnings)
+                result = await chain.ainvoke(inputs)
+                await asyncio.to_thread(_save_fix, file, result)
+
+    rounds = []
+    for round_number in range(1, max_rounds + 1):
+        flagged = [file for file in paths if warnings.get(file)]
+        if not flagged:
+            break
+        start = time.perf_counter()
+        with telemetry.stage("fixing"):
+            escalated, counts = await asyncio.to_thread(autofix,
+                                                        {file: warnings[file] for file in flagged})
+        await asyncio.gather(*(fix(file, file_warnings) for file, file_warnings in escalated.items()))
+        fixed = time.perf_counter()
+        relinted = await _alint(runner, flagged)
+        linted = time.perf_counter()
+        for file in flagged:
+            warnings[file] = relinted.get(file, [])
+        remaining = sum(len(warnings[file]) for file in flagged)
+        rounds.append({"round": round_number, "files": len(flagged),
+                       "autofixed": counts["fixed"], "escalated": counts["escalated"],
+                       "fix_seconds": fixed - start, "lint_seconds": linted - fixed,
+                       "remaining": remaining})
+        print(f"Round {round_number}: fixed {len(flagged)} files in {fixed - start:.2f}s "
+              f"({rounds[-1]['autofixed']} warnings locally, {rounds[-1]['escalated']} by the LLM), "
+              f"re-linted in {linted - fixed:.2f}s, {remaining} warnings left.")
+    remaining = {file: file_warnings for file, file_warnings in warnings.items() if file_warnings}
+    await asyncio.to_thread(_save_lint, remaining)
+    return {"initial": initial, "remaining": remaining, "rounds": rounds}
 
 # create a main
 def main():
-  qa_generate_code(['/Users/mlmnl/Documents/psi/brad/apps/web/src/app/(protected)/departments/add-department.tsx'])
+  qa_generate_code(['templates/app/(protected)/departments/add-department.tsx'],
+                   {"folder_location": '/Users/mlmnl/Documents/psi/brad/apps/web/src/'})
     # requirements = {
     #     "model": "User",
     #     "fields": ["id", "name", "email", "password", "created_at", "updated_at"],
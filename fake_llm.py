@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, messages_from_dict, messages_to_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from rqmts_parser import QUESTIONS, SLOTS
+from template_renderer import render_template
+
+BOILERPLATE_PATTERN = re.compile(
+    r"Start of Boilerplate(?: #\d+)?: (?P<filename>\S[^\n]*)\n(?P<code>.*?)\nEnd of Boilerplate",
+    re.S,
+)
+
+ASSIGN_PATTERN = re.compile(r"\b(model|fields|folder_location)=(\S+)")
+MODEL_PATTERN = re.compile(r"Replace the table name case to (?P<model>[\w$]+)\.")
+FIELDS_PATTERN = re.compile(r"new fields below:\n(?P<fields>.*?)\n\s*\n", re.S)
+KNOWN_PATTERN = re.compile(r"^(model|fields|folder_location): '(.*)'$", re.M)
+
+
+def _next_question(text, updates):
+    """The question for the first requirement neither known in the prompt
+    nor in updates, as the probing prompts ask for, None when the prompt
+    does not list the known requirements."""
+    known = dict(KNOWN_PATTERN.findall(text))
+    if not known:
+        return None
+    for slot in SLOTS:
+        if not updates.get(slot) and known.get(slot, "") in ("", "[]"):
+            return QUESTIONS[slot].format(model=updates.get("model") or known.get("model"))
+    return "Anything else? 🤔"
+
+
+class FakeCodeChatModel(BaseChatModel):
+    """Offline stand-in for ChatOpenAI used by the benchmarks.
+
+    It answers every boilerplate found in the prompt in the
+    "Filename: / Code:" format, rendered for the requested model and fields
+    with template_renderer (echoed as is with render=False), and sleeps
+    like a real model would: a fixed time to first token plus a per-token
+    generation rate.
+    """
+
+    first_token_latency: float = 0.5
+    tokens_per_second: float = 2000.0
+    truncate_rate: float = 0.0
+    seed: Optional[int] = None
+    render: bool = True
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-code"
+
+    def _completion(self, messages: List[BaseMessage]) -> str:
+        text = "\n".join(str(message.content) for message in messages)
+        model = MODEL_PATTERN.search(text) if self.render else None
+        fields = FIELDS_PATTERN.search(text)
+        fields = [field.strip() for field in fields.group("fields").split("\n")] if fields else []
+        sections = text.split("-----------------")
+        if len(sections) >= 3:
+            text = sections[1]
+        result = ""
+        for match in BOILERPLATE_PATTERN.finditer(text):
+            filename, code = match.group("filename").strip(), match.group("code")
+            if model:
+                rendered = render_template(filename, code, model.group("model"),
+                                           [field for field in fields if field])
+                filename, code = rendered.path, rendered.code
+            result += f"Filename: {filename}\n"
+            result += f"Code: ```tsx\n{code}\n```\n"
+        self.calls += 1
+        rng = random.Random(None if self.seed is None else self.seed + self.calls)
+        if result and rng.random() < self.truncate_rate:
+            # simulate a completion cut off by the output token limit
+            result = result[: len(result) // 3].replace("Code:", "")
+        return result
+
+    def _delay(self, text: str) -> float:
+        # roughly four characters per token
+        return self.first_token_latency + len(text) / 4 / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        completion = self._completion(messages)
+        time.sleep(self._delay(completion))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=completion))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        completion = self._completion(messages)
+        await asyncio.sleep(self._delay(completion))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=completion))])
+
+    def _chunks(self, completion: str, size: int = 64) -> List[str]:
+        return [completion[i:i + size] for i in range(0, len(completion), size)]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        completion = self._completion(messages)
+        time.sleep(self.first_token_latency)
+        for piece in self._chunks(completion):
+            time.sleep(len(piece) / 4 / self.tokens_per_second)
+            if run_manager:
+                run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        completion = self._completion(messages)
+        await asyncio.sleep(self.first_token_latency)
+        for piece in self._chunks(completion):
+            await asyncio.sleep(len(piece) / 4 / self.tokens_per_second)
+            if run_manager:
+                await run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+class FakeAgentChatModel(BaseChatModel):
+    """Offline stand-in for the requirements agent and the probe chain.
+
+    A human turn of "name: value" pairs separated by ";" (or "name=value"
+    anywhere) is answered with update_requirement calls: all of them as
+    parallel tool calls, or with parallel=False one legacy function_call
+    per turn. Once the calls are answered it acknowledges. The combined
+    extraction prompt gets its JSON answer with the "name=value" pairs,
+    and any other prompt gets a question, for the first requirement still
+    missing when the prompt lists them. Every call takes latency seconds.
+    """
+
+    latency: float = 0.5
+    parallel: bool = True
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-agent"
+
+    def bind_functions(self, functions, **kwargs: Any):
+        # the calls are decided from the message, not the schema
+        return self
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self
+
+    def _message(self, messages: List[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        answered = 0
+        for message in reversed(messages):
+            if message.type == "human":
+                break
+            answered += message.type in ("function", "tool")
+        text = str(message.content)
+        if '"question"' in text:
+            updates = {name: value for name, value in ASSIGN_PATTERN.findall(text)}
+            if "fields" in updates:
+                updates["fields"] = updates["fields"].split(",")
+            question = _next_question(text, updates) or "What else should I know? 🤔"
+            return AIMessage(content=json.dumps(dict(updates, question=question)))
+        question = _next_question(text, {})
+        if question:
+            # the probing prompt, which only asks
+            return AIMessage(content=question)
+        pairs = []
+        for part in text.split(";"):
+            name, separator, value = part.partition(":")
+            if separator and name.strip() in ("model", "fields", "folder_location"):
+                pairs.append({"variable_name": name.strip(), "value": value.strip()})
+        pairs += [{"variable_name": name, "value": value} for name, value in ASSIGN_PATTERN.findall(text)]
+        if not pairs:
+            return AIMessage(content="What else should the model have? 🤔")
+        if self.parallel:
+            if answered:
+                return AIMessage(content="Noted.")
+            return AIMessage(content="", tool_calls=[
+                {"name": "update_requirement", "args": args, "id": f"call_{self.calls}_{number}"}
+                for number, args in enumerate(pairs)])
+        if answered >= len(pairs):
+            return AIMessage(content="Noted.")
+        return AIMessage(content="", additional_kwargs={"function_call": {
+            "name": "update_requirement", "arguments": json.dumps(pairs[answered])}})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+
+def prompt_key(messages: List[BaseMessage]) -> str:
+    text = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ReplayChatModel(BaseChatModel):
+    """Replays recorded completions with a configurable latency.
+
+    recordings maps prompt_key(messages) to a message dict (as written by
+    messages_to_dict), so tool calls replay too. A prompt without a
+    recording is answered by fallback, another chat model, and the answer
+    is recorded; save() writes the recordings back for the next run.
+    Streamed completions arrive at tokens_per_second.
+    """
+
+    recordings: Dict[str, Any] = {}
+    fallback: Optional[BaseChatModel] = None
+    first_token_latency: float = 0.5
+    tokens_per_second: float = 2000.0
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "ReplayChatModel":
+        recordings = {}
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                recordings = json.load(f)
+        return cls(recordings=recordings, **kwargs)
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.recordings, f, indent=1, sort_keys=True)
+
+    def bind_functions(self, functions, **kwargs: Any):
+        return self
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self
+
+    def _message(self, messages: List[BaseMessage]) -> BaseMessage:
+        key = prompt_key(messages)
+        if key in self.recordings:
+            self.hits += 1
+        else:
+            if self.fallback is None:
+                raise KeyError(f"No recorded completion for prompt {key}")
+            self.misses += 1
+            message = self.fallback.invoke(messages)
+            self.recordings[key] = messages_to_dict([message])[0]
+        return messages_from_dict([self.recordings[key]])[0]
+
+    def _delay(self, message: BaseMessage) -> float:
+        return self.first_token_latency + len(str(message.content)) / 4 / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        message = self._message(messages)
+        time.sleep(self._delay(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        message = self._message(messages)
+        await asyncio.sleep(self._delay(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._message(messages)
+        content = str(message.content)
+        await asyncio.sleep(self.first_token_latency)
+        for i in range(0, len(content), 64):
+            piece = content[i:i + 64]
+            await asyncio.sleep(len(piece) / 4 / self.tokens_per_second)
+            if run_manager:
+                await run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        message = self._message(messages)
+        content = str(message.content)
+        time.sleep(self.first_token_latency)
+        for i in range(0, len(content), 64):
+            piece = content[i:i + 64]
+            time.sleep(len(piece) / 4 / self.tokens_per_second)
+            if run_manager:
+                run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
@@ -0,0 +1,168 @@
+"""Atomic, change-aware writes of the generated files.
+
+A dev server watching the project rebuilds on every write, and a crash in
+the middle of a write leaves a half-written file behind. FileWriter only
+writes files whose content changed, stages each one in a temp file next
+to it as soon as it is known, and renames the whole batch into place on
+flush(), so the watcher sees complete files, once.
+"""
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+
+# os.umask can only be read by setting it, so once, before any thread runs
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _disk_sha256(path):
+    try:
+        with open(path, "rb") as f:
+            return _sha256(f.read())
+    except FileNotFoundError:
+        return None
+
+
+class WriteReport:
+    """The files of one or more batches, by what happened to them."""
+
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.unchanged = []
+
+    def add(self, status, path):
+        paths = getattr(self, status)
+        if path not in paths:
+            paths.append(path)
+
+    def as_dict(self):
+        return {"created": self.created, "updated": self.updated, "unchanged": self.unchanged}
+
+    def summary(self, location=None):
+        """Returns the report as lines for the user, with the paths relative
+        to location when given."""
+        lines = []
+        for status, paths in self.as_dict().items():
+            if paths:
+                names = [os.path.relpath(path, location) if location else path for path in paths]
+                lines.append(f"{status.capitalize()} ({len(paths)}): " + ", ".join(names))
+        return "\n".join(lines) or "No files written."
+
+
+class FileWriter:
+    """Stages writes and commits them together on flush().
+
+    Writers are thread-safe and can be flushed several times; report
+    covers every flushed batch. Used as a context manager, the files still
+    staged when the block exits, e.g. on an error, are discarded.
+    """
+
+    def __init__(self):
+        self.report = WriteReport()
+        self._staged = {}
+        self._lock = threading.Lock()
+
+    def stage(self, path, code):
+        """Stages code for path, unless path already holds it.
+
+        Returns:
+            str: "unchanged" or "staged"
+        """
+        data = code.encode()
+        if _disk_sha256(path) == _sha256(data):
+            self._unstage(path)
+            with self._lock:
+                self.report.add("unchanged", path)
+            return "unchanged"
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # same directory, so the rename stays on one filesystem and is atomic
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file 0600, keep the mode a plain write gives
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = 0o666 & ~_UMASK
+            os.chmod(tmp, mode)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self._lock:
+            previous = self._staged.pop(path, None)
+            self._staged[path] = tmp
+        if previous:
+            os.remove(previous)
+        return "staged"
+
+    def _unstage(self, path):
+        with self._lock:
+            tmp = self._staged.pop(path, None)
+        if tmp:
+            os.remove(tmp)
+
+    def flush(self):
+        """Renames every staged file into place.
+
+        Returns:
+            WriteReport: the report of all batches so far
+        """
+        with self._lock:
+            staged, self._staged = self._staged, {}
+            for path, tmp in staged.items():
+                status = "updated" if os.path.exists(path) else "created"
+                os.replace(tmp, path)
+                self.report.add(status, path)
+                print(f"File {path} has been {status}.")
+            return self.report
+
+    def discard(self):
+        """Drops the staged files, leaving the project as it was."""
+        with self._lock:
+            staged, self._staged = self._staged, {}
+        for tmp in staged.values():
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.discard()
+
+
+@contextlib.contextmanager
+def staging(writer=None):
+    """Yields writer, or a new FileWriter that is discarded on exit when
+    the block did not flush it, so an error or a cancellation leaves no
+    temp files in the project. The caller owns a writer it passes in."""
+    if writer is not None:
+        yield writer
+        return
+    with FileWriter() as batch:
+        yield batch
+
+
+def write_file(path, code):
+    """Writes one file atomically if its content changed.
+
+    Returns:
+        str: "created", "updated" or "unchanged"
+    """
+    writer = FileWriter()
+    if writer.stage(path, code) == "unchanged":
+        return "unchanged"
+    return "created" if writer.flush().created else "updated"
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+
+CACHE_DIR = os.environ.get("KEVIN_CACHE_DIR", "debug/cache")
+CACHE_MAX_BYTES = int(os.environ.get("KEVIN_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def normalize_fields(fields):
+    """Strips the field names and drops empty ones. Order is kept since it
+    decides the order of the generated fields."""
+    return [field.strip() for field in fields if field.strip()]
+
+
+def llm_name(chat_model):
+    return getattr(chat_model, "model_name", None) or chat_model._llm_type
+
+
+class GenerationCache:
+    """Content-addressed on-disk cache of generation completions.
+
+    An entry is keyed on the boilerplate text (and so the template
+    contents), the requested model, the normalized field list, the prompt
+    text and the LLM name. The least recently used entries are evicted
+    once the cache grows past max_bytes; a hit refreshes the entry's mtime.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, boilerplate, requirements, prompt, chat_model):
+        payload = json.dumps({
+            "template": hashlib.sha256(boilerplate.encode()).hexdigest(),
+            "model": requirements["model"].strip(),
+            "fields": normalize_fields(requirements["fields"]),
+            "prompt": prompt,
+            "llm": llm_name(chat_model),
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def get(self, key):
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, "r") as f:
+                    result = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with self._lock:
+            with open(path + ".tmp", "w") as f:
+                f.write(result)
+            os.replace(path + ".tmp", path)
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".txt"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+cache = GenerationCache()
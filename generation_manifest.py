@@ -0,0 +1,171 @@
+"""Manifest of the generated files, for incremental regeneration.
+
+Every generated output is recorded in <folder_location>/.kevin/manifest.json
+with the hash of its source template, the field list it was generated for
+and the hash of the written file. On a repeat request plan() compares the
+request with the manifest and decides per template:
+
+    generate    nothing recorded yet
+    skip        same template and fields, or a field change that does not
+                show in this template's rendered code
+    regenerate  the template or the fields changed and the file is as
+                Kevin wrote it
+    patch       the fields changed and the file was edited by hand since;
+                only the field diff is applied, keeping the edits
+    conflict    the template changed and the file was edited by hand; it
+                is left alone unless regeneration is forced
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from generation_cache import normalize_fields
+from template_renderer import render_template
+
+MANIFEST_FILE = os.path.join(".kevin", "manifest.json")
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_sha256(path):
+    try:
+        with open(path, "r") as f:
+            return sha256(f.read())
+    except FileNotFoundError:
+        return None
+
+
+class FieldDiff:
+    def __init__(self, old, new):
+        self.old = normalize_fields(old)
+        self.new = normalize_fields(new)
+        self.added = [field for field in self.new if field not in self.old]
+        self.removed = [field for field in self.old if field not in self.new]
+
+    def __bool__(self):
+        return self.old != self.new
+
+    def __str__(self):
+        return f"+{self.added} -{self.removed}"
+
+
+class PlanItem:
+    def __init__(self, template, action, reason, diff=None, outputs=None):
+        self.template = template
+        self.action = action
+        self.reason = reason
+        self.diff = diff
+        self.outputs = outputs or []
+
+    def as_dict(self):
+        return {"template": self.template.path, "action": self.action, "reason": self.reason,
+                "added": self.diff.added if self.diff else [],
+                "removed": self.diff.removed if self.diff else [],
+                "outputs": self.outputs}
+
+
+class GenerationManifest:
+    """The recorded outputs of one folder_location, keyed by model and
+    template path."""
+
+    def __init__(self, location):
+        self.location = location
+        self.path = os.path.join(location, MANIFEST_FILE)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(model, template_path):
+        return f"{model.strip()}:{template_path}"
+
+    def get(self, model, template_path):
+        return self.entries.get(self.key(model, template_path))
+
+    def record(self, requirements, template, outputs, manual_edits=False):
+        """Records the files generated from template for requirements.
+        Patched files keep manual_edits, so they are never overwritten by a
+        later regeneration."""
+        with self._lock:
+            self.entries[self.key(requirements["model"], template.path)] = {
+                "template": template.path,
+                "template_sha256": template.sha256,
+                "model": requirements["model"].strip(),
+                "fields": normalize_fields(requirements["fields"]),
+                "outputs": {os.path.relpath(output, self.location): file_sha256(output)
+                            for output in outputs},
+                "manual_edits": manual_edits,
+                "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+
+    def update_fields(self, requirements, template):
+        """Moves the entry of a template the field change did not affect to
+        the new fields."""
+        with self._lock:
+            entry = self.entries[self.key(requirements["model"], template.path)]
+            entry["fields"] = normalize_fields(requirements["fields"])
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def edited(self, entry):
+        """Returns the outputs of entry changed on disk since generation."""
+        if entry.get("manual_edits"):
+            return list(entry["outputs"])
+        return [path for path, digest in entry["outputs"].items()
+                if file_sha256(os.path.join(self.location, path)) not in (digest, None)]
+
+    def plan(self, requirements, templates, force=False):
+        """Returns a PlanItem per template for the requested model and fields."""
+        items = []
+        for template in templates:
+            entry = self.get(requirements["model"], template.path)
+            if entry is None:
+                items.append(PlanItem(template, "generate", "not generated yet"))
+                continue
+            outputs = [os.path.join(self.location, path) for path in entry["outputs"]]
+            missing = [path for path in outputs if not os.path.isfile(path)]
+            diff = FieldDiff(entry["fields"], requirements["fields"])
+            template_changed = entry["template_sha256"] != template.sha256
+            edited = self.edited(entry)
+            if force:
+                items.append(PlanItem(template, "regenerate", "forced", diff, outputs))
+            elif missing or not outputs:
+                items.append(PlanItem(template, "regenerate", "output missing", diff, outputs))
+            elif template_changed:
+                if edited:
+                    items.append(PlanItem(template, "conflict",
+                                          f"template changed and {edited} edited by hand",
+                                          diff, outputs))
+                else:
+                    items.append(PlanItem(template, "regenerate", "template changed", diff, outputs))
+            elif not diff:
+                items.append(PlanItem(template, "skip", "inputs unchanged", diff, outputs))
+            elif not self.affects(template, requirements["model"], diff):
+                items.append(PlanItem(template, "skip", f"fields {diff} do not change this file",
+                                      diff, outputs))
+            elif edited:
+                items.append(PlanItem(template, "patch", f"fields {diff}, keeping manual edits",
+                                      diff, outputs))
+            else:
+                items.append(PlanItem(template, "regenerate", f"fields {diff}", diff, outputs))
+        return items
+
+    @staticmethod
+    def affects(template, model, diff):
+        """Whether the field change shows in the template's rendered code.
+        Templates the renderer cannot fully handle are assumed affected."""
+        old = render_template(template.path, template.code, model, diff.old)
+        new = render_template(template.path, template.code, model, diff.new)
+        return bool(old.unresolved or new.unresolved) or old.code != new.code
@@ -1,11 +1,18 @@
+import asyncio
 import os
 import chainlit as cl
 from langchain_core.messages import HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
 
-from code_gen import generate_code, generate_one_code, qa_generate_code
+from code_gen import (agenerate_code_single_prompt, aqa_fix_loop, generate_code_concurrent,
+                      generate_code_dag, generate_code_incremental, generate_code_offline,
+                      generate_code_wide, generate_one_code)
+from file_writer import FileWriter
 from rqmts_graph import get_requirements_bot
-from probe_chain import ask_next_question
+from rqmts_turn import arequirements_turn
+from session_store import SessionStore
+from speculative import Speculator
+from telemetry import current_session, telemetry
 
 template = ChatPromptTemplate.from_messages([
     ("user", "{content}"),
@@ -13,37 +20,75 @@ template = ChatPromptTemplate.from_messages([
 
 rqmt_bot = get_requirements_bot()
 
+# "single" sends every template in one prompt, "concurrent" fans out one
+# request per template, "offline" renders locally and falls back to the LLM
+# only for what the renderer cannot handle (unless KEVIN_LLM_FALLBACK=0),
+# "incremental" regenerates only the files a repeat request changes, "dag"
+# generates the page and API templates in dependency order, "wide" splits
+# the fields into groups of KEVIN_WIDE_FIELD_GROUP for very wide entities
+GENERATION_MODE = os.environ.get("KEVIN_GENERATION_MODE", "single")
+# the modes that return (files, failed) and take the same arguments
+GENERATORS = {"concurrent": generate_code_concurrent, "dag": generate_code_dag,
+              "wide": generate_code_wide}
+# modes with one request per template, whose answers would interleave if
+# streamed to the chat
+MULTI_REQUEST_MODES = ("concurrent", "dag", "wide", "incremental", "offline")
+GENERATION_CONCURRENCY = int(os.environ.get("KEVIN_GENERATION_CONCURRENCY", "4"))
+LLM_FALLBACK = os.environ.get("KEVIN_LLM_FALLBACK", "1") != "0"
+QA_MAX_ROUNDS = int(os.environ.get("KEVIN_QA_MAX_ROUNDS", "3"))
+# answers the local parser cannot read go to one "combined" LLM call that
+# updates the requirements and picks the next question, or with "graph" to
+# the requirements agent followed by the probe chain
+REQUIREMENTS_MODE = os.environ.get("KEVIN_REQUIREMENTS_MODE", "combined")
+# with KEVIN_SPECULATIVE=1, generate in the background as soon as the model
+# and fields are known, while the user is still answering (not in
+# "incremental" mode, which depends on the files already in the folder);
+# off by default since a session that is never confirmed still pays for it
+SPECULATIVE = os.environ.get("KEVIN_SPECULATIVE", "0") == "1" and GENERATION_MODE != "incremental"
+# per-stage metrics go to debug/telemetry after every message, and to
+# http://127.0.0.1:<port>/metrics when KEVIN_METRICS_PORT is set
+if os.environ.get("KEVIN_METRICS_PORT"):
+    telemetry.serve(int(os.environ["KEVIN_METRICS_PORT"]))
+# requirements and the last KEVIN_SESSION_HISTORY messages of every chat,
+# dropped after KEVIN_SESSION_TTL_SECONDS idle
+sessions = SessionStore(on_evict=telemetry.retire)
+telemetry.register("session_store", sessions)
+INITIAL_MESSAGE = "What is the model entity you want to work with?"
+
 
 @cl.on_chat_start
 async def on_chat_start():
     await cl.sleep(1)
 
     # Set up the user session
-    initial_message = "What is the model entity you want to work with?"
     cl.user_session.set("runnable", rqmt_bot)
-    cl.user_session.set(
-        "requirements",
-        {"model": "", "fields": [], "folder_location": "" },
-    )
-    cl.user_session.set(
-        "message_history",
-        [initial_message]
-    )
+    state = sessions.create(cl.user_session.get("id"))
+    state.add_message(INITIAL_MESSAGE)
     msg = cl.Message(content="""
                      Hi! I'm Kevin 🤖, your programming assistant 💻. I can help build CRUD pages.
                      What is the model entity you want to work with?
                      """)
     await msg.send()
 
+@cl.on_chat_end
+async def on_chat_end():
+    sessions.drop(cl.user_session.get("id"))
+
 @cl.on_message
 async def on_message(message: cl.Message):
     # Initiate the context variables with user_session variables
-    requirements = cl.user_session.get("requirements")
-    message_history = cl.user_session.get("message_history")
+    current_session.set(cl.user_session.get("id"))
+    state = sessions.get(cl.user_session.get("id"))
+    if state is None:
+        # idle for too long, start over with this answer to the first question
+        state = sessions.create(cl.user_session.get("id"))
+        state.add_message(INITIAL_MESSAGE)
+    requirements = state.requirements
     # print("Input message:\n", input_message.content)
 
     # # append message to message_history
-    message_history.append(message.content)
+    state.add_message(message.content)
+    message_history = state.recent()
 
     # # Pass the requirements object to the bot when it is invoked
     # # send the last conversation message to the bot
@@ -53,38 +98,96 @@ async def on_message(message: cl.Message):
     print(message_history[-2:])
     async with cl.Step(name="Kevin as Systems Analyst") as parent_step:
         parent_step.input = "Analyzing answer..."        
-        response = rqmt_bot.invoke(
-            {"messages": message_history[-2:],
-            "requirements": requirements},
-        )
+        new_requirements, probe = await arequirements_turn(
+            message.content, requirements, message_history, rqmt_bot, REQUIREMENTS_MODE)
         parent_step.output = f"{message.content} is noted." # response.get("messages")[-1]
 
         # Update requirements in the session
-        new_requirements = response.get("requirements")
-        cl.user_session.set("requirements", new_requirements)
+        state.requirements = new_requirements
+        if SPECULATIVE:
+            if state.speculator is None:
+                state.speculator = Speculator(speculative_generate)
+            state.speculator.update(new_requirements)
         
         print('******** REQUIREMENTS **********')
-        print(requirements)
+        print(new_requirements)
         # if requirements is Complete, ask the user to generate  the code
-        if len(requirements['model']) > 0 and \
-          len(requirements['fields']) > 0 and \
-          len(requirements['folder_location']) > 0:
-          files = await next_phase(new_requirements)
-          await confirm_qa(files)
+        if probe is None:
+          files = await next_phase(new_requirements, state.speculator)
+          await confirm_qa(files, new_requirements)
+          await asyncio.to_thread(telemetry.write)
           return
         
     async with cl.Step(name="Kevin is probing...") as child_step:
         # # let's probe the user for the next question
         child_step.input = "Probing next question..."
-        probe = ask_next_question(new_requirements, message_history)
-        message_history.append(probe)
+        state.add_message(probe)
         child_step.output = probe
 
         # Send the probe to the user
         await cl.Message(content=probe).send()
+    await asyncio.to_thread(telemetry.write)
 
     
-async def next_phase(requirements):
+async def generate_in_mode(requirements, writer, callbacks, on_failed, cancelled=None):
+    """Generates in GENERATION_MODE into writer.
+
+    Args:
+        on_failed: awaited with {template: error} when some templates
+            could not be generated
+        cancelled: a threading.Event that stops offline generation, which
+            runs on a worker thread
+
+    Returns:
+        list: the generated files in the save_to_file format
+    """
+    failed = None
+    if GENERATION_MODE in GENERATORS:
+        files, failed = await GENERATORS[GENERATION_MODE](
+            requirements, max_concurrency=GENERATION_CONCURRENCY, callbacks=callbacks,
+            writer=writer)
+    elif GENERATION_MODE == "incremental":
+        files, report = await generate_code_incremental(
+            requirements, max_concurrency=GENERATION_CONCURRENCY, callbacks=callbacks,
+            writer=writer)
+        if report["conflict"]:
+            await cl.Message(content=f"These templates changed but their files were edited by hand, "
+                                     f"so they were left alone: {report['conflict']}").send()
+        failed = report["failed"]
+    elif GENERATION_MODE == "offline":
+        files = await asyncio.to_thread(generate_code_offline, requirements,
+                                        llm_fallback=LLM_FALLBACK, callbacks=callbacks,
+                                        writer=writer, cancelled=cancelled)
+    else:
+        files, failed = await agenerate_code_single_prompt(requirements, callbacks=callbacks,
+                                                           writer=writer)
+    if failed:
+        await on_failed(failed)
+    return files
+
+async def speculative_generate(requirements, writer):
+    """Generation for the Speculator, without streaming to the chat."""
+
+    async def on_failed(failed):
+        raise RuntimeError(f"Templates not generated: {list(failed)}")
+
+    return await generate_in_mode(requirements, writer, [], on_failed, cancelled=writer.cancelled)
+
+async def generate(requirements, writer):
+    """Generates in GENERATION_MODE, streaming to the chat."""
+
+    async def on_failed(failed):
+        await cl.Message(content=f"Some templates could not be generated: {list(failed)}").send()
+
+    async with cl.Step(name="generate_code") as step:
+        step.input = "Generating code..."
+        callbacks = [cl.AsyncLangchainCallbackHandler(
+            stream_final_answer=GENERATION_MODE not in MULTI_REQUEST_MODES)]
+        files = await generate_in_mode(requirements, writer, callbacks, on_failed)
+        step.output = "Code generation complete."
+    return files
+
+async def next_phase(requirements, speculator=None):
     message = f"""Your requirements are complete. Do you want to generate the code?
     
     Model: {requirements['model']}
@@ -115,19 +218,25 @@ async def next_phase(requirements):
 
         await cl.Message("").send()
         
-        files = generate_code(requirements)
+        # files are written together once generation is done
+        with FileWriter() as writer:
+            files = await speculator.collect(requirements, writer) if speculator else None
+            if files is None:
+                files = await generate(requirements, writer)
+            written = await asyncio.to_thread(writer.flush)
 
         msg = cl.Message(content=f"""Code generation complete. 
-                         The following files have been created. 
                          
-                         {files}
+{written.summary(requirements["folder_location"])}
                          
                          Thank you! 🎉""")
         await msg.send()
 
         return files
+    elif speculator:
+        speculator.cancel()
     
-async def confirm_qa(files):
+async def confirm_qa(files, requirements):
     message = f"""Would you like to check the code for syntax errors?"""
 
     res = await cl.AskActionMessage(
@@ -144,11 +253,24 @@ async def confirm_qa(files):
         ).send()
 
         await cl.Message("").send()
-        files = qa_generate_code(files)
+        report = await aqa_fix_loop(files, requirements,
+                                    max_rounds=QA_MAX_ROUNDS,
+                                    max_concurrency=GENERATION_CONCURRENCY)
+        rounds = "\n".join(
+            f"Round {r['round']}: {r['files']} files fixed in {r['fix_seconds']:.1f}s "
+            f"({r['autofixed']} warnings fixed locally, {r['escalated']} by the LLM), "
+            f"{r['remaining']} warnings left"
+            for r in report["rounds"])
+        remaining = "\n".join(
+            f"{file}: {warning}"
+            for file, warnings in report["remaining"].items()
+            for warning in warnings)
 
         msg = cl.Message(content=f"""QA cleanup has been completed. 
                          
-                         {files}
+                         {rounds or "No warnings found."}
+                         
+                         {remaining or "All files are clean."}
                          
                          Thank you! 🎉""")
         await msg.send()
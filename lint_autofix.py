@@ -0,0 +1,205 @@
+"""Rule-based fixes for the mechanical lint warnings.
+
+Most warnings on generated code are no-unused-vars on imports and
+destructured bindings (see report.txt). Those, and a few other
+single-line rules, are fixed here from the structured LintWarning
+records; anything else is returned so only it goes to the LLM.
+"""
+import re
+from collections import Counter
+
+from file_writer import write_file
+from template_renderer import IMPORT_PATTERN
+
+UNUSED_RULES = {"no-unused-vars", "@typescript-eslint/no-unused-vars"}
+UNUSED_PATTERN = re.compile(r"^'(?P<name>[^']+)' is (?:defined|assigned a value) but never used")
+ARRAY_PATTERN = re.compile(r"\b(?:const|let|var)\s*\[(?P<items>[^\]]*)\]\s*=")
+OBJECT_PATTERN = re.compile(r"\b(?:const|let|var)\s*\{(?P<items>[^}]*)\}\s*=")
+
+
+class AutofixCounters:
+    """How many warnings were fixed locally and how many went to the LLM."""
+
+    def __init__(self):
+        self.fixed = Counter()
+        self.escalated = Counter()
+
+    def as_dict(self):
+        return {
+            "fixed": sum(self.fixed.values()),
+            "escalated": sum(self.escalated.values()),
+            "fixed_by_rule": dict(self.fixed),
+            "escalated_by_rule": dict(self.escalated),
+        }
+
+
+counters = AutofixCounters()
+
+
+def _offset(lines, line, col):
+    return sum(len(text) + 1 for text in lines[:line - 1]) + col - 1
+
+
+def _remove_import(code, offset, name):
+    for match in IMPORT_PATTERN.finditer(code):
+        if not match.start() <= offset < match.end():
+            continue
+        default = match.group("default")
+        named = [item.strip() for item in (match.group("named") or "").split(",") if item.strip()]
+        if default == name:
+            default = None
+        else:
+            kept = [item for item in named
+                    if re.split(r"\s+as\s+", item)[-1].replace("type ", "").strip() != name]
+            if len(kept) == len(named):
+                return None
+            named = kept
+        if not default and not named:
+            return code[:match.start()] + code[match.end():]
+        statement = "import "
+        if match.group(0).startswith("import type"):
+            statement += "type "
+        statement += ", ".join(filter(None, [default, "{ " + ", ".join(named) + " }" if named else None]))
+        return code[:match.start()] + f"{statement} from {match.group('module')}\n" + code[match.end():]
+    return None
+
+
+def _remove_binding(line_text, col, name):
+    """Drops name from an array or object destructuring on the line, or
+    returns None when it is not a destructured binding we can drop."""
+    for pattern, is_array in ((ARRAY_PATTERN, True), (OBJECT_PATTERN, False)):
+        for match in pattern.finditer(line_text):
+            start, end = match.span("items")
+            if not start <= col - 1 < end:
+                continue
+            items = match.group("items").split(",")
+            names = [item.strip() for item in items]
+            if name not in names:
+                return None
+            if is_array:
+                names[names.index(name)] = ""
+                while names and not names[-1]:
+                    names.pop()
+            else:
+                names.remove(name)
+            if not any(names):
+                # keep the right-hand side, hooks must still be called
+                return line_text[:match.start()] + line_text[match.end():].lstrip()
+            rendered = ", ".join(names) if is_array else " " + ", ".join(names) + " "
+            return line_text[:start] + rendered + line_text[end:]
+    return None
+
+
+def _enclosing_bracket(code, offset):
+    """Returns the unclosed bracket before code[offset], None at top level.
+    Strings and comments are not skipped, destructurings rarely have any."""
+    depth = 0
+    for i in range(offset - 1, -1, -1):
+        char = code[i]
+        if char in ")]}":
+            depth += 1
+        elif char in "([{":
+            if not depth:
+                return char
+            depth -= 1
+    return None
+
+
+def _remove_member_line(lines, line):
+    """Drops name on its own line of a multi-line destructuring: the line of
+    an object pattern, a hole in an array pattern so the later elements
+    keep their positions. Parameters are left to the LLM, dropping one
+    would shift the others."""
+    bracket = _enclosing_bracket("\n".join(lines), _offset(lines, line, 1))
+    if bracket == "{":
+        del lines[line - 1]
+        return "\n".join(lines)
+    if bracket == "[":
+        following = next((text.strip() for text in lines[line:] if text.strip()), "")
+        if following.startswith("]"):
+            # the last element, nothing after it to keep in place
+            del lines[line - 1]
+        else:
+            text = lines[line - 1]
+            lines[line - 1] = text[:len(text) - len(text.lstrip())] + ","
+        return "\n".join(lines)
+    return None
+
+
+def _fix(code, warning):
+    lines = code.split("\n")
+    if not 0 < warning.line <= len(lines):
+        return None
+    line_text = lines[warning.line - 1]
+    if warning.rule in UNUSED_RULES:
+        match = UNUSED_PATTERN.match(warning.message)
+        if not match:
+            return None
+        name = match.group("name")
+        if line_text[warning.col - 1:warning.col - 1 + len(name)] != name:
+            return None
+        fixed = _remove_import(code, _offset(lines, warning.line, warning.col), name)
+        if fixed is not None:
+            return fixed
+        if re.match(rf"^\s*{re.escape(name)},?\s*$", line_text):
+            # a member on its own line of a multi-line destructuring
+            return _remove_member_line(lines, warning.line)
+        fixed_line = _remove_binding(line_text, warning.col, name)
+        if fixed_line is None:
+            return None
+        lines[warning.line - 1] = fixed_line
+        return "\n".join(lines)
+    if warning.rule == "prefer-const":
+        fixed_line = re.sub(r"\blet\b", "const", line_text, count=1)
+    elif warning.rule == "no-var":
+        fixed_line = re.sub(r"\bvar\b", "let", line_text, count=1)
+    else:
+        return None
+    if fixed_line == line_text:
+        return None
+    lines[warning.line - 1] = fixed_line
+    return "\n".join(lines)
+
+
+def autofix_code(code, warnings):
+    """Applies the local fixes to code.
+
+    Returns:
+        tuple: (code, escalated) with the fixed code and the warnings that
+        need the LLM.
+    """
+    escalated = []
+    # bottom-up, right to left, so earlier positions stay valid
+    for warning in sorted(warnings, key=lambda w: (w.line, w.col), reverse=True):
+        fixed = _fix(code, warning)
+        if fixed is None:
+            escalated.append(warning)
+            counters.escalated[warning.rule] += 1
+        else:
+            code = fixed
+            counters.fixed[warning.rule] += 1
+    escalated.reverse()
+    return code, escalated
+
+
+def autofix(warnings):
+    """Fixes what it can in each file of {path: [LintWarning]}, in place.
+
+    Returns:
+        tuple: (remaining, counts) with the warnings per file that still
+        need the LLM, and the number of warnings of this call "fixed" and
+        "escalated", which counters sums over every session.
+    """
+    remaining = {}
+    counts = {"fixed": 0, "escalated": 0}
+    for file, file_warnings in warnings.items():
+        with open(file, "r") as f:
+            code = f.read()
+        fixed, escalated = autofix_code(code, file_warnings)
+        if fixed != code:
+            write_file(file, fixed)
+        if escalated:
+            remaining[file] = escalated
+        counts["fixed"] += len(file_warnings) - len(escalated)
+        counts["escalated"] += len(escalated)
+    return remaining, counts
@@ -0,0 +1,131 @@
+"""Streaming parser for turbo / next lint logs (see report.txt).
+
+Lines look like
+
+    web:lint: ./src/app/(protected)/admin/users/table.tsx
+    web:lint: 39:5  Warning: 'isError' is assigned a value but never used.  no-unused-vars
+
+with ANSI colours, a turbo task prefix per package and a blank line
+closing each file's block. Files are tracked per task, so interleaved
+output from several packages is attributed correctly.
+"""
+import asyncio
+import os
+import re
+import subprocess
+
+from lint_runner import LintWarning
+
+ANSI_PATTERN = re.compile(r"\x1b\[[0-9;]*m")
+TASK_PATTERN = re.compile(r"^(?P<task>[A-Za-z@][\w@/.-]*:[A-Za-z][\w-]*): ?")
+FILE_PATTERN = re.compile(r"^(?:\./|/)\S.*$")
+# the message and the rule are split off with rpartition, a lazy regex
+# over the message is the slowest part of parsing
+WARNING_PATTERN = re.compile(r"(\d+):(\d+)\s+(Warning|Error):\s+")
+PACKAGE_DIR_PATTERN = re.compile(r"^> \S+ lint (?P<dir>/\S.*)$")
+
+
+class LintIndex:
+    """Lint records indexed by file and by rule."""
+
+    def __init__(self):
+        self.by_file = {}
+        self.by_rule = {}
+        self.count = 0
+
+    def add(self, warning):
+        self.by_file.setdefault(warning.file, []).append(warning)
+        self.by_rule.setdefault(warning.rule, []).append(warning)
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def files(self):
+        return list(self.by_file)
+
+    def rules(self):
+        return {rule: len(warnings) for rule, warnings in self.by_rule.items()}
+
+
+def parse_lint_log(lines, resolve=False, index=None):
+    """Parses an iterable of log lines (an open file works) into a LintIndex.
+
+    With resolve=True, files of a package whose directory was announced
+    in the log ("> web@1.0.0 lint /path/apps/web") are made absolute.
+    """
+    index = index if index is not None else LintIndex()
+    current = {}
+    package_dirs = {}
+    ansi_sub = ANSI_PATTERN.sub
+    task_match = TASK_PATTERN.match
+    warning_match = WARNING_PATTERN.match
+    for line in lines:
+        if "\x1b" in line:
+            line = ansi_sub("", line)
+        task = ""
+        match = task_match(line)
+        if match:
+            task = match.group("task")
+            line = line[match.end():]
+        line = line.strip()
+        if not line:
+            current.pop(task, None)
+            continue
+        file = current.get(task)
+        if file:
+            match = warning_match(line)
+            if match:
+                message, separator, rule = line[match.end():].rpartition("  ")
+                if not separator or " " in rule:
+                    message, rule = line[match.end():], None
+                line_number, col, severity = match.groups()
+                index.add(LintWarning(file, int(line_number), int(col), severity,
+                                      message.rstrip(), rule))
+                continue
+        if line[0] in "./" and FILE_PATTERN.match(line):
+            if resolve and task in package_dirs:
+                line = os.path.normpath(os.path.join(package_dirs[task], line))
+            current[task] = line
+        elif line[0] == ">":
+            match = PACKAGE_DIR_PATTERN.match(line)
+            if match:
+                package_dirs[task] = match.group("dir")
+    return index
+
+
+def parse_lint_log_file(path, resolve=False):
+    with open(path, "r", errors="replace") as f:
+        return parse_lint_log(f, resolve)
+
+
+class TurboLintRunner:
+    """Lint runner for the whole monorepo ("pnpm lint" through turbo).
+
+    Slower than EslintRunner since every package is linted, but needs no
+    eslint formatter support. The raw log is kept in log_file.
+    """
+
+    def __init__(self, cwd, command=("pnpm", "lint"), log_file="debug/lint.txt"):
+        self.cwd = cwd
+        self.command = list(command)
+        self.log_file = log_file
+
+    def run(self, paths):
+        os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+        with open(self.log_file, "w") as f:
+            subprocess.run(self.command, cwd=self.cwd, stdout=f)
+        return self._select(paths)
+
+    async def arun(self, paths):
+        os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+        with open(self.log_file, "w") as f:
+            process = await asyncio.create_subprocess_exec(*self.command, cwd=self.cwd, stdout=f)
+            await process.wait()
+        return await asyncio.to_thread(self._select, paths)
+
+    def _select(self, paths):
+        index = parse_lint_log_file(self.log_file, resolve=True)
+        wanted = {os.path.abspath(path) for path in paths}
+        return {file: warnings for file, warnings in index.by_file.items()
+                if os.path.abspath(file) in wanted}
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+import subprocess
+
+SEVERITIES = {1: "Warning", 2: "Error"}
+
+
+class LintWarning:
+    """One lint message for one file."""
+
+    __slots__ = ("file", "line", "col", "severity", "message", "rule")
+
+    def __init__(self, file, line, col, severity, message, rule):
+        self.file = file
+        self.line = line
+        self.col = col
+        self.severity = severity
+        self.message = message
+        self.rule = rule
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        # same layout as the eslint stylish formatter
+        return f"{self.line}:{self.col}  {self.severity}: {self.message}  {self.rule or ''}".rstrip()
+
+    def __repr__(self):
+        return f"LintWarning({self.file!r}, {self})"
+
+
+def find_project_root(path):
+    """Returns the nearest directory at or above path holding a
+    package.json, which is where the linter has to run."""
+    path = os.path.abspath(path)
+    while True:
+        if os.path.isfile(os.path.join(path, "package.json")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise FileNotFoundError(f"No package.json found above {path}")
+        path = parent
+
+
+def parse_eslint_json(output, cwd):
+    """Parses ESLint's JSON formatter output into {absolute path: [LintWarning]}."""
+    warnings = {}
+    for result in json.loads(output or "[]"):
+        file = os.path.abspath(os.path.join(cwd, result["filePath"]))
+        for message in result.get("messages", []):
+            warnings.setdefault(file, []).append(LintWarning(
+                file,
+                message.get("line", 0),
+                message.get("column", 0),
+                SEVERITIES.get(message.get("severity"), "Warning"),
+                message.get("message", ""),
+                message.get("ruleId"),
+            ))
+    return warnings
+
+
+class CommandLintRunner:
+    """Lints the given files with a command that prints ESLint JSON.
+
+    The file paths are appended to the command, relative to cwd. Any
+    command that speaks the same JSON format can be plugged in, such as a
+    local stub linter in place of pnpm.
+    """
+
+    def __init__(self, command, cwd):
+        self.command = list(command)
+        self.cwd = cwd
+
+    def args(self, paths):
+        return self.command + [os.path.relpath(os.path.abspath(path), self.cwd) for path in paths]
+
+    def run(self, paths):
+        if not paths:
+            return {}
+        completed = subprocess.run(self.args(paths), cwd=self.cwd, capture_output=True, text=True)
+        # eslint exits with 1 when it found errors
+        if completed.returncode not in (0, 1):
+            raise RuntimeError(f"Lint failed: {completed.stderr.strip()}")
+        return parse_eslint_json(completed.stdout, self.cwd)
+
+    async def arun(self, paths):
+        """Async variant of run on an asyncio subprocess."""
+        if not paths:
+            return {}
+        process = await asyncio.create_subprocess_exec(
+            *self.args(paths), cwd=self.cwd,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        if process.returncode not in (0, 1):
+            raise RuntimeError(f"Lint failed: {stderr.decode().strip()}")
+        return parse_eslint_json(stdout.decode(), self.cwd)
+
+
+class EslintRunner(CommandLintRunner):
+    """Runs only the project's eslint on the given files, instead of the
+    full turbo "pnpm lint" over every package of the monorepo."""
+
+    def __init__(self, cwd, command=("pnpm", "exec", "eslint", "--format", "json")):
+        super().__init__(command, cwd)
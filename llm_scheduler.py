@@ -0,0 +1,480 @@
+"""One scheduler for every LLM request of the process.
+
+The chains built through models.chain() and the requirements agent call
+their model through a ScheduledModel. Before a request goes out it waits
+in one queue ordered by priority class, then by arrival:
+
+    interactive  the requirements and probe calls a user is waiting on
+    generation   code generation and patches
+    fix          the QA fix loop
+
+and takes from two token buckets shared by all sessions: one refilled at
+KEVIN_LLM_REQUESTS_PER_MINUTE requests, one at KEVIN_LLM_TOKENS_PER_MINUTE
+tokens. A request costs its prompt tokens plus the completion it may
+produce, corrected with the usage the provider reports once it is done.
+
+Rate limit, timeout, connection and server errors are retried up to
+KEVIN_LLM_MAX_RETRIES times after a random delay of up to
+KEVIN_LLM_RETRY_SECONDS * 2^attempt, at least the Retry-After of the
+response; a 429 holds back every queued request until then. A stream is
+only retried before its first chunk. Identical requests in flight at the
+same time, e.g. a speculative and a confirmed generation, are sent once
+and share the result.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+from langchain_core.messages import BaseMessage, convert_to_messages, messages_to_dict
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable
+
+from prompt_budget import count_tokens
+from telemetry import current_stage, telemetry
+
+REQUESTS_PER_MINUTE = float(os.environ.get("KEVIN_LLM_REQUESTS_PER_MINUTE", "500"))
+TOKENS_PER_MINUTE = float(os.environ.get("KEVIN_LLM_TOKENS_PER_MINUTE", "300000"))
+MAX_RETRIES = int(os.environ.get("KEVIN_LLM_MAX_RETRIES", "4"))
+RETRY_SECONDS = float(os.environ.get("KEVIN_LLM_RETRY_SECONDS", "1"))
+MAX_RETRY_SECONDS = 60.0
+# tokens reserved for the completion of a model without max_tokens
+COMPLETION_TOKENS = int(os.environ.get("KEVIN_LLM_COMPLETION_TOKENS", "2000"))
+PRIORITIES = ["interactive", "generation", "fix"]
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError,
+                    httpx.TransportError)
+
+# result of a request whose leader was cancelled, its followers send it again
+ABANDONED = object()
+
+
+class TokenBucket:
+    """Holds up to capacity tokens, refilled at per_minute. A rate of 0
+    does not limit."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait(self, amount, now):
+        """Returns the seconds until amount can be taken, at most capacity."""
+        if self.rate <= 0:
+            return 0.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """Takes amount more, or gives back a negative amount."""
+        self.level = min(self.capacity, self.level - amount)
+
+
+class Request:
+    """The scheduling data of one model call."""
+
+    def __init__(self, key, priority, tokens):
+        self.key = key
+        self.priority = priority
+        self.tokens = tokens
+        self.ticket = None
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def _usage(output):
+    """Returns the total tokens reported for a message or a list of stream
+    chunks, None when the provider reported none."""
+    messages = output if isinstance(output, list) else [output]
+    totals = [message.usage_metadata["total_tokens"] for message in messages
+              if getattr(message, "usage_metadata", None)]
+    return sum(totals) if totals else None
+
+
+class Scheduler:
+    """Queues, rate limits, retries and coalesces LLM requests.
+
+    Thread-safe, for sync calls from worker threads and async calls alike;
+    waiting requests sleep until they are at the head of the queue and the
+    buckets hold enough, polling every poll_interval seconds meanwhile.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, retry_seconds=RETRY_SECONDS, poll_interval=0.05):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.retry_seconds = retry_seconds
+        self.poll_interval = poll_interval
+        self._queue = []
+        self._order = itertools.count()
+        self._paused_until = 0.0
+        self._in_flight = {}
+        self._counters = collections.Counter()
+        self._waits = {priority: {"count": 0, "seconds": 0.0, "max": 0.0} for priority in PRIORITIES}
+        self._lock = threading.Lock()
+
+    def set_limits(self, requests_per_minute=None, tokens_per_minute=None, request_burst=None):
+        """Replaces the buckets, e.g. with the rate of a batch run.
+        request_burst caps the requests sent at once, a minute's worth by
+        default."""
+        with self._lock:
+            if requests_per_minute is not None:
+                self.requests = TokenBucket(requests_per_minute, request_burst)
+            if tokens_per_minute is not None:
+                self.tokens = TokenBucket(tokens_per_minute)
+
+    def _enqueue(self, request):
+        with self._lock:
+            request.ticket = (PRIORITIES.index(request.priority), next(self._order))
+            heapq.heappush(self._queue, request.ticket)
+        return time.monotonic()
+
+    def _admit(self, request):
+        """Takes the request off the queue when it may go.
+
+        Returns:
+            float: 0 when admitted, else the seconds to wait before trying again
+        """
+        with self._lock:
+            if self._queue[0] != request.ticket:
+                return self.poll_interval
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self.requests.wait(1, now),
+                       self.tokens.wait(request.tokens, now))
+            if wait > 0:
+                return min(wait, self.poll_interval * 10)
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(request.tokens)
+            request.ticket = None
+            return 0.0
+
+    def _dequeue(self, request, start):
+        with self._lock:
+            if request.ticket is not None:
+                # given up while waiting, e.g. a cancelled speculation
+                self._queue.remove(request.ticket)
+                heapq.heapify(self._queue)
+                request.ticket = None
+                return
+            seconds = time.monotonic() - start
+            waits = self._waits[request.priority]
+            waits["count"] += 1
+            waits["seconds"] += seconds
+            waits["max"] = max(waits["max"], seconds)
+
+    def acquire(self, request):
+        """Blocks until request may be sent."""
+        start = self._enqueue(request)
+        try:
+            while True:
+                wait = self._admit(request)
+                if not wait:
+                    break
+                time.sleep(wait)
+        finally:
+            self._dequeue(request, start)
+
+    async def aacquire(self, request):
+        start = self._enqueue(request)
+        try:
+            while True:
+                wait = self._admit(request)
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            self._dequeue(request, start)
+
+    def _retry_delay(self, request, error, attempt):
+        """Returns the seconds to wait before retrying, None when error is
+        final."""
+        if attempt >= self.max_retries or not isinstance(error, RETRYABLE_ERRORS):
+            self._count("failed")
+            return None
+        delay = random.uniform(0, min(MAX_RETRY_SECONDS, self.retry_seconds * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if isinstance(error, openai.RateLimitError):
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        print(f"LLM request ({request.priority}) failed with {type(error).__name__}, "
+              f"retrying in {delay:.1f}s (attempt {attempt+1}).")
+        self._count("retries")
+        telemetry.retry(*current_stage.get())
+        return delay
+
+    def _settle(self, request, output):
+        usage = _usage(output)
+        with self._lock:
+            self._counters["completed"] += 1
+            self._counters["tokens_reserved"] += request.tokens
+            if usage is not None:
+                self._counters["tokens_used"] += usage
+                self.tokens.adjust(usage - request.tokens)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _join(self, request):
+        """Returns (future, leading): a new future when no identical request
+        is in flight, else the future of the one that is."""
+        with self._lock:
+            future = self._in_flight.get(request.key)
+            if future is None:
+                future = self._in_flight[request.key] = concurrent.futures.Future()
+                return future, True
+            self._counters["coalesced"] += 1
+            return future, False
+
+    def _finish(self, request, future, result=ABANDONED, error=None):
+        with self._lock:
+            if self._in_flight.get(request.key) is future:
+                del self._in_flight[request.key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def call(self, request, function):
+        """Returns function(), the model call of request, once scheduled."""
+        while True:
+            future, leading = self._join(request)
+            if leading:
+                break
+            result = future.result()
+            if result is not ABANDONED:
+                return result
+        try:
+            for attempt in itertools.count():
+                self.acquire(request)
+                try:
+                    result = function()
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(request, e, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+        except Exception as e:
+            self._finish(request, future, error=e)
+            raise
+        except BaseException:
+            self._finish(request, future)
+            raise
+        self._settle(request, result)
+        self._finish(request, future, result)
+        return result
+
+    async def acall(self, request, function):
+        """Async variant of call, function returning an awaitable."""
+        while True:
+            future, leading = self._join(request)
+            if leading:
+                break
+            result = await asyncio.wrap_future(future)
+            if result is not ABANDONED:
+                return result
+        try:
+            for attempt in itertools.count():
+                await self.aacquire(request)
+                try:
+                    result = await function()
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(request, e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            self._finish(request, future, error=e)
+            raise
+        except BaseException:
+            self._finish(request, future)
+            raise
+        self._settle(request, result)
+        self._finish(request, future, result)
+        return result
+
+    def stream(self, request, function):
+        """Yields the chunks of function(), the model stream of request.
+        An identical stream in flight is replayed once it is complete."""
+        while True:
+            future, leading = self._join(request)
+            if leading:
+                break
+            chunks = future.result()
+            if chunks is not ABANDONED:
+                yield from chunks
+                return
+        chunks = []
+        try:
+            for attempt in itertools.count():
+                self.acquire(request)
+                try:
+                    for chunk in function():
+                        chunks.append(chunk)
+                        yield chunk
+                    break
+                except Exception as e:
+                    delay = None if chunks else self._retry_delay(request, e, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+        except Exception as e:
+            self._finish(request, future, error=e)
+            raise
+        except BaseException:
+            self._finish(request, future)
+            raise
+        self._settle(request, chunks)
+        self._finish(request, future, chunks)
+
+    async def astream(self, request, function):
+        """Async variant of stream, function returning an async iterator."""
+        while True:
+            future, leading = self._join(request)
+            if leading:
+                break
+            chunks = await asyncio.wrap_future(future)
+            if chunks is not ABANDONED:
+                for chunk in chunks:
+                    yield chunk
+                return
+        chunks = []
+        try:
+            for attempt in itertools.count():
+                await self.aacquire(request)
+                try:
+                    async for chunk in function():
+                        chunks.append(chunk)
+                        yield chunk
+                    break
+                except Exception as e:
+                    delay = None if chunks else self._retry_delay(request, e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            self._finish(request, future, error=e)
+            raise
+        except BaseException:
+            self._finish(request, future)
+            raise
+        self._settle(request, chunks)
+        self._finish(request, future, chunks)
+
+    def as_dict(self):
+        """Returns the queue depth and the waits per priority, and the
+        request counters."""
+        with self._lock:
+            depth = collections.Counter(PRIORITIES[rank] for rank, _ in self._queue)
+            return {
+                "queue_depth": {priority: depth[priority] for priority in PRIORITIES},
+                "in_flight": len(self._in_flight),
+                "waits": {priority: dict(waits) for priority, waits in self._waits.items()},
+                **{name: self._counters[name] for name in
+                   ("completed", "retries", "failed", "coalesced", "tokens_reserved", "tokens_used")},
+            }
+
+    def to_prometheus(self):
+        stats = self.as_dict()
+        lines = ["# TYPE kevin_llm_queue_depth gauge"]
+        lines += [f'kevin_llm_queue_depth{{priority="{priority}"}} {depth}'
+                  for priority, depth in stats["queue_depth"].items()]
+        lines += ["# TYPE kevin_llm_in_flight gauge", f"kevin_llm_in_flight {stats['in_flight']}"]
+        for name, kind in (("count", "counter"), ("seconds", "counter"), ("max", "gauge")):
+            metric = f"kevin_llm_wait_{name}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines += [f'{metric}{{priority="{priority}"}} {waits[name]}'
+                      for priority, waits in stats["waits"].items()]
+        for name in ("completed", "retries", "failed", "coalesced", "tokens_reserved", "tokens_used"):
+            metric = f"kevin_llm_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {stats[name]}"]
+        return "\n".join(lines) + "\n"
+
+
+scheduler = Scheduler()
+telemetry.register("llm_scheduler", scheduler)
+
+
+def _messages(input):
+    if isinstance(input, PromptValue):
+        return input.to_messages()
+    if isinstance(input, str):
+        return convert_to_messages([("human", input)])
+    return convert_to_messages(input)
+
+
+class ScheduledModel(Runnable):
+    """A chat model, or one with bound tools, whose calls go through the
+    scheduler with priority, one of PRIORITIES."""
+
+    def __init__(self, model, priority, scheduler=scheduler):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority}, expected one of {PRIORITIES}")
+        self.model = model
+        self.priority = priority
+        self.scheduler = scheduler
+
+    @property
+    def InputType(self):
+        return self.model.InputType
+
+    @property
+    def OutputType(self):
+        return self.model.OutputType
+
+    def _request(self, mode, input, kwargs):
+        messages = _messages(input)
+        text = json.dumps([mode, messages_to_dict(messages), kwargs], sort_keys=True, default=str)
+        key = (id(self.model), hashlib.sha256(text.encode()).hexdigest())
+        completion = (kwargs.get("max_tokens") or getattr(self.model, "max_tokens", None)
+                      or COMPLETION_TOKENS)
+        prompt = count_tokens("\n".join(str(message.content) for message in messages
+                                        if isinstance(message, BaseMessage)))
+        return Request(key, self.priority, prompt + completion)
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.scheduler.call(self._request("invoke", input, kwargs),
+                                   lambda: self.model.invoke(input, config, **kwargs))
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.scheduler.acall(self._request("invoke", input, kwargs),
+                                          lambda: self.model.ainvoke(input, config, **kwargs))
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self.scheduler.stream(self._request("stream", input, kwargs),
+                                         lambda: self.model.stream(input, config, **kwargs))
+
+    async def astream(self, input, config=None, **kwargs):
+        async for chunk in self.scheduler.astream(self._request("stream", input, kwargs),
+                                                  lambda: self.model.astream(input, config, **kwargs)):
+            yield chunk
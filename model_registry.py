@@ -0,0 +1,144 @@
+"""Process-wide chat model clients, one per role.
+
+Every role gets one ChatOpenAI, built on first use and shared by all
+sessions, and all of them share one pooled keep-alive HTTP client, so a
+request reuses an open connection instead of a new TLS handshake.
+Chains are compiled once per (name, model) through chain(), on a
+ScheduledModel, so their calls go through the llm_scheduler queue with
+the priority of the role.
+
+The model name and temperature of a role can be set with
+KEVIN_<ROLE>_MODEL and KEVIN_<ROLE>_TEMPERATURE, e.g.
+
+    KEVIN_PROBING_MODEL=gpt-4o-mini KEVIN_FIXING_TEMPERATURE=0
+"""
+import os
+import threading
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from llm_scheduler import ScheduledModel
+from telemetry import telemetry
+
+# role: (model name, temperature)
+ROLES = {
+    "extraction": ("gpt-4o", 0.0),
+    "probing": ("gpt-3.5-turbo", 0.7),
+    "generation": ("gpt-4o", 0.0),
+    "fixing": ("gpt-4o", 0.7),
+}
+# role: llm_scheduler priority class
+ROLE_PRIORITIES = {
+    "extraction": "interactive",
+    "probing": "interactive",
+    "generation": "generation",
+    "fixing": "fix",
+}
+MAX_CONNECTIONS = int(os.environ.get("KEVIN_HTTP_MAX_CONNECTIONS", "20"))
+KEEPALIVE_SECONDS = float(os.environ.get("KEVIN_HTTP_KEEPALIVE_SECONDS", "60"))
+REQUEST_TIMEOUT = float(os.environ.get("KEVIN_HTTP_TIMEOUT", "600"))
+
+
+def role_config(role):
+    """Returns the (model name, temperature) of role with the environment
+    overrides applied."""
+    if role not in ROLES:
+        raise KeyError(f"Unknown model role: {role}")
+    model_name, temperature = ROLES[role]
+    prefix = f"KEVIN_{role.upper()}_"
+    model_name = os.environ.get(prefix + "MODEL", model_name)
+    temperature = float(os.environ.get(prefix + "TEMPERATURE", temperature))
+    return model_name, temperature
+
+
+class ModelRegistry:
+    """Hands out the shared chat model of a role and the chains built on it."""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, keepalive_seconds=KEEPALIVE_SECONDS,
+                 timeout=REQUEST_TIMEOUT):
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections,
+                                   keepalive_expiry=keepalive_seconds)
+        self.timeout = timeout
+        self._models = {}
+        self._chains = {}
+        self._http_client = None
+        self._http_async_client = None
+        self._lock = threading.Lock()
+
+    def _clients(self):
+        if self._http_client is None:
+            self._http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+            self._http_async_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._http_client, self._http_async_client
+
+    def model(self, role):
+        """Returns the chat model of role, creating it on first use."""
+        config = role_config(role)
+        with self._lock:
+            model = self._models.get((role, config))
+            if model is None:
+                http_client, http_async_client = self._clients()
+                model_name, temperature = config
+                # stream_usage reports the tokens of streamed completions too;
+                # the scheduler retries, not the client
+                model = ChatOpenAI(model=model_name, temperature=temperature,
+                                   http_client=http_client, http_async_client=http_async_client,
+                                   stream_usage=True, callbacks=[telemetry.callback],
+                                   max_retries=0)
+                self._models[(role, config)] = model
+            return model
+
+    def _role(self, chat_model):
+        with self._lock:
+            return next((role for (role, _), model in self._models.items() if model is chat_model),
+                        None)
+
+    def chain(self, name, build, chat_model, priority=None):
+        """Returns build(chat_model), with the model's calls scheduled by
+        llm_scheduler. Chains of the registry's models are compiled once
+        per name, model and priority; an ad-hoc model, e.g. a test double,
+        gets a new chain on every call so the registry does not keep it.
+
+        Args:
+            name: the chain name, unique per prompt
+            build: function of the chat model returning the chain
+            chat_model: a chat model, or a role name for the shared model
+            priority: the llm_scheduler priority class, by default that of
+                the model's role, else "generation"
+        """
+        if isinstance(chat_model, str):
+            priority = priority or ROLE_PRIORITIES[chat_model]
+            chat_model = self.model(chat_model)
+        role = self._role(chat_model)
+        priority = priority or ROLE_PRIORITIES.get(role, "generation")
+        if role is None:
+            return build(ScheduledModel(chat_model, priority))
+        key = (name, id(chat_model), priority)
+        with self._lock:
+            # the model is kept with the chain so its id is not reused
+            entry = self._chains.get(key)
+            if entry is None:
+                entry = self._chains[key] = (chat_model, build(ScheduledModel(chat_model, priority)))
+            return entry[1]
+
+    def clear(self):
+        """Drops the models and chains, e.g. after the configuration changed,
+        and closes the sync connection pool."""
+        with self._lock:
+            self._models.clear()
+            self._chains.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+            self._http_client = None
+            self._http_async_client = None
+
+    def stats(self):
+        return {
+            "models": {role: config[0] for role, config in self._models},
+            "chains": len(self._chains),
+        }
+
+
+models = ModelRegistry()
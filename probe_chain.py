@@ -1,9 +1,10 @@
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.exceptions import OutputParserException
 
-def ask_next_question(requirements, history):
-  template = """You are a helpful systems analyst. Your task is to ask for the following information:
+from model_registry import models
+
+PROBE_TEMPLATE = """You are a helpful systems analyst. Your task is to ask for the following information:
 1. model: [model or entity name]
 2. fields: [fields of the model]
 3. folder_location: [folder location to generate the code]
@@ -22,10 +23,74 @@ then ask one question with missing information in proper order.
 Use emoji to make the conversation more engaging.
 
 """
-  openai_chat_model = ChatOpenAI(model="gpt-3.5-turbo")
-  prompt = ChatPromptTemplate.from_template(template)
-  chain = prompt | openai_chat_model | StrOutputParser()
+PROBE_PROMPT = ChatPromptTemplate.from_template(PROBE_TEMPLATE)
+
+def _probe_chain(chat_model=None):
+  return models.chain("probe", lambda model: PROBE_PROMPT | model | StrOutputParser(),
+                      chat_model or "probing", priority="interactive")
+
+def ask_next_question(requirements, history, chat_model=None):
+  chain = _probe_chain(chat_model)
   requirements['message_history'] = '\n'.join(history[-2:])
   result = chain.invoke(requirements)
   print('ask_next_question:', result)  
-  return result
\ No newline at end of file
+  return result
+
+async def aask_next_question(requirements, history, chat_model=None):
+  chain = _probe_chain(chat_model)
+  requirements['message_history'] = '\n'.join(history[-2:])
+  result = await chain.ainvoke(requirements)
+  print('ask_next_question:', result)
+  return result
+
+COMBINED_TEMPLATE = """You are a helpful systems analyst. You need the following information:
+1. model: [model or entity name]
+2. fields: [fields of the model]
+3. folder_location: [folder location to generate the code]
+
+below are the information you know
+
+model: '{model}'
+fields: '{fields}'
+folder_location: '{folder_location}'
+
+For reference, below is the message history: 
+{message_history}
+
+Take any of the information above from the last message of message_history,
+then ask one question with the first information still missing, in proper order.
+Use emoji to make the conversation more engaging.
+
+Respond only with JSON in the following format, with null for what the last
+message does not give:
+{{"model": "[model]", "fields": ["[field]"], "folder_location": "[folder]", "question": "[question]"}}
+"""
+COMBINED_PROMPT = ChatPromptTemplate.from_template(COMBINED_TEMPLATE)
+
+def _combined_chain(chat_model=None):
+  return models.chain("extract_and_probe", lambda model: COMBINED_PROMPT | model | JsonOutputParser(),
+                      chat_model or "extraction", priority="interactive")
+
+def _combined_result(result):
+  if not isinstance(result, dict):
+    raise OutputParserException(f"Expected a JSON object, got: {result!r}")
+  updates = {slot: result.get(slot) for slot in ("model", "fields", "folder_location")
+             if result.get(slot)}
+  if isinstance(updates.get("fields"), str):
+    updates["fields"] = updates["fields"].split(",")
+  print('extract_and_probe:', result)
+  return updates, result.get("question") or ""
+
+def extract_and_probe(requirements, history, chat_model=None):
+  """Takes the requirement updates from the last answer and picks the next
+  question in one LLM call.
+
+  Returns:
+      tuple: (updates, question)
+  """
+  inputs = dict(requirements, message_history='\n'.join(history[-2:]))
+  return _combined_result(_combined_chain(chat_model).invoke(inputs))
+
+async def aextract_and_probe(requirements, history, chat_model=None):
+  inputs = dict(requirements, message_history='\n'.join(history[-2:]))
+  return _combined_result(await _combined_chain(chat_model).ainvoke(inputs))
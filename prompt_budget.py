@@ -0,0 +1,277 @@
+"""Token budgeting and boilerplate compaction for the generation prompts.
+
+The boilerplate is the bulk of every generation prompt. build_boilerplate()
+renders the "Start of Boilerplate / End of Boilerplate" blocks of the
+templates at the configured compaction level, counts the tokens of each
+prompt section, and moves on to the next level while the prompt is over
+KEVIN_PROMPT_TOKEN_BUDGET:
+
+    none        the templates verbatim
+    whitespace  trailing spaces dropped, runs of blank lines collapsed
+    imports     also multi-line imports on one line, same-module imports merged
+    comments    also // and /* */ comments stripped
+    dedup       also blocks of DEDUP_MIN_LINES lines repeated from an earlier
+                template replaced by a reference to it
+
+The default, KEVIN_PROMPT_COMPACTION=imports, keeps the comments since the
+templates use them to instruct the model. Tokens are counted with tiktoken,
+with cl100k_base for models it does not know, else estimated at four
+characters per token when no encoding is available locally. The counts of
+the boilerplate and of the instructions are cached along with the
+compacted boilerplate, so a repeated build only counts the inputs. Every
+build is recorded, with the tokens before and after.
+"""
+import collections
+import functools
+import os
+import re
+import threading
+
+from telemetry import telemetry
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("KEVIN_PROMPT_TOKEN_BUDGET", "24000"))
+PROMPT_COMPACTION = os.environ.get("KEVIN_PROMPT_COMPACTION", "imports")
+LEVELS = ["none", "whitespace", "imports", "comments", "dedup"]
+DEDUP_MIN_LINES = 6
+
+MULTILINE_IMPORT_PATTERN = re.compile(
+    r"^import\s+(?P<type>type\s+)?\{(?P<names>[^}]*)\}\s*from\s*(?P<module>['\"][^'\"]+['\"])[ \t]*;?",
+    re.M)
+LINE_COMMENT_PATTERN = re.compile(r"(?<![:'\"\w])//.*$", re.M)
+# a JSX comment {/* */} goes with its braces, a plain one leaves them
+BLOCK_COMMENT_PATTERN = re.compile(
+    r"\{\s*/\*(?:(?!\*/).)*\*/\s*\}|/\*(?:(?!\*/).)*\*/", re.S)
+BLANK_RUN_PATTERN = re.compile(r"\n{3,}")
+
+
+class PromptBudgetError(ValueError):
+    """The prompt is over the token budget even fully compacted."""
+
+
+@functools.lru_cache(maxsize=None)
+def _fallback_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # not installed, or the encoding cannot be downloaded
+        print(f"No local tokenizer, estimating tokens: {type(e).__name__}")
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model_name):
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model_name or "gpt-4o")
+    except Exception:
+        # an unknown model, or its encoding cannot be downloaded
+        return _fallback_encoding()
+
+
+def count_tokens(text, model_name=None):
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _whitespace(code):
+    code = "\n".join(line.rstrip() for line in code.split("\n"))
+    return BLANK_RUN_PATTERN.sub("\n\n", code).strip("\n")
+
+
+def _imports(code):
+    """Puts every named import on one line and merges the named imports of
+    the same module."""
+    merged = {}
+    first = {}
+
+    def collect(match):
+        key = (match.group("module"), bool(match.group("type")))
+        names = [name.strip() for name in match.group("names").split(",") if name.strip()]
+        known = merged.setdefault(key, [])
+        known += [name for name in names if name not in known]
+        if key in first:
+            return "\0"
+        first[key] = True
+        return f"\0{len(first) - 1}\0"
+
+    code = MULTILINE_IMPORT_PATTERN.sub(collect, code)
+    keys = list(first)
+
+    def restore(match):
+        module, is_type = keys[int(match.group(1))]
+        prefix = "import type" if is_type else "import"
+        return f"{prefix} {{ {', '.join(merged[(module, is_type)])} }} from {module}"
+
+    code = re.sub(r"\0(\d+)\0", restore, code)
+    # a merged duplicate leaves an empty line behind
+    return re.sub(r"^\0\n?", "", code, flags=re.M)
+
+
+def _comments(code):
+    code = BLOCK_COMMENT_PATTERN.sub("", code)
+    code = LINE_COMMENT_PATTERN.sub("", code)
+    return _whitespace(code)
+
+
+def _dedup(blocks):
+    """Replaces runs of at least DEDUP_MIN_LINES lines already seen in an
+    earlier template by a one-line reference to it."""
+    seen = {}
+    result = []
+    for path, code in blocks:
+        lines = code.split("\n")
+        output = []
+        index = 0
+        while index < len(lines):
+            window = tuple(line.strip() for line in lines[index:index + DEDUP_MIN_LINES])
+            source = seen.get(window) if len(window) == DEDUP_MIN_LINES and any(window) else None
+            if source is None:
+                output.append(lines[index])
+                index += 1
+                continue
+            source_path, source_lines, start = source
+            length = DEDUP_MIN_LINES
+            while (index + length < len(lines) and start + length < len(source_lines)
+                   and lines[index + length].strip() == source_lines[start + length].strip()):
+                length += 1
+            indent = lines[index][:len(lines[index]) - len(lines[index].lstrip())]
+            output.append(f"{indent}/* same {length} lines as {source_path} line {start + 1}: "
+                          f"{lines[index].strip()} ... {lines[index + length - 1].strip()} */")
+            index += length
+        for start in range(len(lines) - DEDUP_MIN_LINES + 1):
+            window = tuple(line.strip() for line in lines[start:start + DEDUP_MIN_LINES])
+            seen.setdefault(window, (path, lines, start))
+        result.append((path, "\n".join(output)))
+    return result
+
+
+def compact(blocks, level):
+    """Returns [(path, code)] compacted to level, one of LEVELS."""
+    rank = LEVELS.index(level)
+    compacted = []
+    for path, code in blocks:
+        if rank >= LEVELS.index("whitespace"):
+            code = _whitespace(code)
+        if rank >= LEVELS.index("imports"):
+            code = _imports(code)
+        if rank >= LEVELS.index("comments"):
+            code = _comments(code)
+        compacted.append((path, code))
+    if rank >= LEVELS.index("dedup"):
+        compacted = _dedup(compacted)
+    return compacted
+
+
+def render_blocks(blocks, numbered=False, level="none"):
+    """Renders [(path, code)] as the boilerplate blocks of the prompts."""
+    text = ""
+    if level == "dedup" and len(blocks) > 1:
+        text = ("Comments of the form /* same N lines as FILE line L: FIRST ... LAST */ stand for "
+                "those lines of FILE, write them out in full.\n\n")
+    for index, (path, code) in enumerate(blocks):
+        marker = f" #{index+1}" if numbered else ""
+        text += (f"Start of Boilerplate{marker}: {path}\n"
+                 f"{code}\n"
+                 f"End of Boilerplate{marker}: {path}\n\n")
+    return text
+
+
+class BudgetStats:
+    """The token counts of the last builds, and totals over all of them."""
+
+    def __init__(self, keep=100):
+        self.recent = collections.deque(maxlen=keep)
+        self.builds = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        with self._lock:
+            self.recent.append(record)
+            self.builds += 1
+            self.tokens_before += record["before"]["total"]
+            self.tokens_after += record["after"]["total"]
+
+    def as_dict(self):
+        with self._lock:
+            return {"builds": self.builds, "tokens_before": self.tokens_before,
+                    "tokens_after": self.tokens_after, "recent": list(self.recent)}
+
+    def to_prometheus(self):
+        stats = self.as_dict()
+        lines = []
+        for name in ("builds", "tokens_before", "tokens_after"):
+            metric = f"kevin_prompt_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {stats[name]}"]
+        return "\n".join(lines) + "\n"
+
+
+stats = BudgetStats()
+telemetry.register("prompt_budget", stats)
+
+
+@functools.lru_cache(maxsize=64)
+def _instruction_tokens(template, model_name):
+    return count_tokens(re.sub(r"\{\w+\}", "", template), model_name)
+
+
+def section_tokens(template, inputs, model_name=None):
+    """Returns the tokens per prompt section: the template's own text under
+    "instructions", one entry per input, and the "total"."""
+    counts = {"instructions": _instruction_tokens(template, model_name)}
+    for name, value in inputs.items():
+        counts[name] = count_tokens(str(value), model_name)
+    counts["total"] = sum(counts.values())
+    return counts
+
+
+@functools.lru_cache(maxsize=256)
+def _compacted(blocks, numbered, level):
+    return render_blocks(compact(list(blocks), level), numbered, level)
+
+
+@functools.lru_cache(maxsize=256)
+def _boilerplate_tokens(blocks, numbered, level, model_name):
+    return count_tokens(_compacted(blocks, numbered, level), model_name)
+
+
+def _with_boilerplate(counts, boilerplate_tokens):
+    counts = dict(counts, boilerplate=boilerplate_tokens)
+    counts["total"] = counts["total"] + boilerplate_tokens
+    return counts
+
+
+def build_boilerplate(name, blocks, template, inputs, model_name=None, numbered=False,
+                      budget=None, level=None):
+    """Returns the boilerplate of blocks compacted enough for the prompt of
+    template with inputs (the other variables) to fit the budget.
+
+    Args:
+        name: the prompt name, for the record
+        blocks: [(path, code)] of the templates
+
+    Raises:
+        PromptBudgetError: when the prompt does not fit even fully compacted
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    level = level or PROMPT_COMPACTION
+    blocks = tuple(blocks)
+    counts = section_tokens(template, inputs, model_name)
+    before = _with_boilerplate(counts, _boilerplate_tokens(blocks, numbered, "none", model_name))
+    for level in LEVELS[LEVELS.index(level):]:
+        boilerplate = _compacted(blocks, numbered, level)
+        after = _with_boilerplate(counts, _boilerplate_tokens(blocks, numbered, level, model_name))
+        if after["total"] <= budget:
+            break
+    else:
+        raise PromptBudgetError(f"The {name} prompt needs {after['total']} tokens fully compacted, "
+                                f"over the budget of {budget}: {after}")
+    stats.record({"prompt": name, "level": level, "budget": budget,
+                  "before": before, "after": after})
+    print(f"Prompt {name}: {before['total']} -> {after['total']} tokens ({level}), "
+          f"boilerplate {before['boilerplate']} -> {after['boilerplate']}.")
+    return boilerplate
@@ -1,37 +1,42 @@
 import json
 import operator
+import os
 from pprint import pprint
 from typing import TypedDict, Annotated, Sequence
 
-from langchain_core.messages import FunctionMessage, BaseMessage
-from langchain_core.utils.function_calling import convert_to_openai_function
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import FunctionMessage, BaseMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolInvocation
 
+from llm_scheduler import ScheduledModel
+from model_registry import models
 from rqmts_tools import tool_box, tool_executor
 
-llm_model = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0,
-)
+llm_model = models.model("extraction")
 
-state_update_model = llm_model.bind_functions(
-    [convert_to_openai_function(t) for t in tool_box]
-)
+# bound as tools, not functions, so the model can answer several
+# requirements in one turn with parallel tool calls
+state_update_model = ScheduledModel(llm_model.bind_tools(tool_box), "interactive")
 
-# In this case, the state of the graph consists of two variables:
-# 'messages', and 'requirements'.
+# cap on agent calls per user message
+MAX_ROUND_TRIPS = int(os.environ.get("KEVIN_AGENT_MAX_ROUND_TRIPS", "3"))
+
+# In this case, the state of the graph consists of three variables:
+# 'messages', 'requirements' and 'round_trips', the number of agent calls
+# so far for this message.
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], operator.add]
     requirements: dict
+    round_trips: Annotated[int, operator.add]
 
 
-def call_agent(state):
+def call_agent(state, model=None):
     """Invokes the agent.
 
     Args:
         state (messages): The current state
+        model: The tool-bound chat model, defaults to state_update_model
 
     Returns:
         dict: The updated state with the agent response appended to messages
@@ -41,69 +46,120 @@ def call_agent(state):
     # print("Messages sent to model for generation:\n")
     # pprint(messages)
 
-    response = state_update_model.invoke(messages)
+    model = ScheduledModel(model, "interactive") if model else state_update_model
+    response = model.invoke(messages)
     # print("Response returned from state_update_model:\n", response)
     return {
         "messages": [response],
+        "round_trips": 1,
     }
 
 
-def call_tools(state):
-    """Invokes the tools."""
-    last_message = state['messages'][-1]
+async def acall_agent(state, model=None):
+    """Async variant of call_agent, used when the graph runs with ainvoke."""
+    model = ScheduledModel(model, "interactive") if model else state_update_model
+    response = await model.ainvoke(state['messages'])
+    return {
+        "messages": [response],
+        "round_trips": 1,
+    }
 
-    print("call_tools launched.")
 
-    action = ToolInvocation(
-        tool=last_message.additional_kwargs['function_call']['name'],
-        tool_input=json.loads(
-            last_message.additional_kwargs['function_call']['arguments'])
-    )
+def _tool_invocations(message):
+    """Returns (tool call id, ToolInvocation) for every tool call of the
+    agent message; the id is None for a legacy function_call."""
+    if getattr(message, "tool_calls", None):
+        return [(call["id"], ToolInvocation(tool=call["name"], tool_input=call["args"]))
+                for call in message.tool_calls]
+    if "function_call" in message.additional_kwargs:
+        function_call = message.additional_kwargs['function_call']
+        return [(None, ToolInvocation(tool=function_call['name'],
+                                      tool_input=json.loads(function_call['arguments'])))]
+    return []
+
+
+def _update_requirement(requirements, response):
+    name, value = list(response.items())[0]
+    if name == 'fields':
+        # Update the field as a list
+        requirements[name] = value.split(",")
+    else:
+        # Update requirements key with new value from response
+        requirements[name] = value
 
-    # Get the response from the tool execution...
-    response = tool_executor.invoke(action)
 
-    # ...and format the corresponding FunctionMessage, which will be added to
-    # the message list.
-    function_message = FunctionMessage(content=str(response), name=action.tool)
-    print(function_message)
+def call_tools(state):
+    """Invokes every tool the agent called, in parallel, and applies all the
+    update_requirement results in one step."""
+    last_message = state['messages'][-1]
 
-    if function_message.name == "update_requirement":
-        # If requirements did not exist, it is created
-        if state["requirements"] is None:
-            state["requirements"] = {}
+    print("call_tools launched.")
 
-        if list(response.keys())[0] == 'fields':
-            # Update the field as a list
-            state["requirements"].update({list(response.keys())[0]: list(response.values())[0].split(",")})
+    calls = _tool_invocations(last_message)
+    # Get the responses from the tool executions...
+    responses = tool_executor.batch([action for _, action in calls])
+
+    # If requirements did not exist, it is created
+    if state["requirements"] is None:
+        state["requirements"] = {}
+    requirements = state["requirements"]
+    messages = []
+    for (call_id, action), response in zip(calls, responses):
+        if action.tool == "update_requirement":
+            _update_requirement(requirements, response)
+            content = str(response)
+        elif action.tool == "get_requirements":
+            content = "Here are the requirements: " + json.dumps(requirements) + "\n"
         else:
-            # Update requirements key with new value from response
-            state["requirements"].update({list(response.keys())[0]: list(response.values())[0]})
-        result = {"messages": [function_message], "requirements": state["requirements"]}
-    elif function_message.name == "get_requirements":
-        function_message.content = ("Here are the requirements: "
-                                    + json.dumps(state["requirements"])
-                                    + "\n")
-        result = {"messages": [function_message]}
-    else:
-        result = {"messages": [function_message]}
+            content = str(response)
+        # ...and format the corresponding message, which will be added to
+        # the message list.
+        if call_id is None:
+            message = FunctionMessage(content=content, name=action.tool)
+        else:
+            message = ToolMessage(content=content, name=action.tool, tool_call_id=call_id)
+        print(message)
+        messages.append(message)
 
-    return result
+    return {"messages": messages, "requirements": requirements}
 
 
 def should_continue(state):
     """Determines if the agent should continue the conversation."""
     last_message = state['messages'][-1]
 
-    if "function_call" not in last_message.additional_kwargs:
+    if not _tool_invocations(last_message):
         return "end"
 
     return "continue"
 
 
-def get_requirements_bot():
+def should_call_agent(state):
+    """Goes back to the agent unless MAX_ROUND_TRIPS agent calls were made.
+
+    A model on the tools API answers every requirement it can in one turn,
+    so once all of its tool calls were requirement updates there is nothing
+    left for it to do; the next question comes from the probe chain. A
+    legacy function_call model makes one call per turn and goes back.
+    """
+    if state["round_trips"] >= MAX_ROUND_TRIPS:
+        print(f"Requirements agent stopped after {state['round_trips']} round trips.")
+        return "end"
+    results = []
+    for message in reversed(state['messages']):
+        if message.type not in ("function", "tool"):
+            break
+        results.append(message)
+    if all(message.type == "tool" and message.name == "update_requirement" for message in results):
+        return "end"
+    return "continue"
+
+
+def get_requirements_bot(model=None):
     workflow = StateGraph(AgentState)
-    workflow.add_node("agent", call_agent)
+    workflow.add_node("agent", RunnableLambda(
+        lambda state: call_agent(state, model),
+        afunc=lambda state: acall_agent(state, model)))
     workflow.add_node("tools", call_tools)
     workflow.set_entry_point("agent")
     workflow.add_conditional_edges(
@@ -114,6 +170,13 @@ def get_requirements_bot():
             "end": END,
         }
     )
-    workflow.add_edge("tools", "agent")
+    workflow.add_conditional_edges(
+        "tools",
+        should_call_agent,
+        {
+            "continue": "agent",
+            "end": END,
+        }
+    )
     state_update_bot = workflow.compile()
     return state_update_bot
\ No newline at end of file
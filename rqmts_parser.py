@@ -0,0 +1,127 @@
+"""Deterministic fast path for the requirement answers.
+
+Answers that can only mean one thing are applied without an LLM:
+
+    Invoice                              model, asked for the model
+    id, amount, dueDate                  fields, asked for the fields
+    src/app/(protected)/invoices         folder_location, asked for the folder
+    model: Invoice; fields: id, amount   any labelled requirements
+
+and the next question for the first missing requirement comes from
+QUESTIONS. Common replies (yes, ok, hello...) are never taken for a model
+or a field. parse_answer returns None for anything else, which then goes
+to the LLM.
+"""
+import re
+
+SLOTS = ["model", "fields", "folder_location"]
+QUESTIONS = {
+    "model": "What is the model entity you want to work with? 🗂️",
+    "fields": "Great! 🎉 What fields should the {model} model have? "
+              "Please list them separated by commas. ✍️",
+    "folder_location": "Awesome! 🙌 In which folder of your project should I generate "
+                       "the {model} code? 📁",
+}
+LABELS = {
+    "model": "model", "entity": "model", "table": "model",
+    "fields": "fields", "field": "fields", "columns": "fields",
+    "folder": "folder_location", "folder_location": "folder_location",
+    "location": "folder_location", "path": "folder_location",
+}
+
+MODEL_PATTERN = re.compile(r"^[A-Z][a-z0-9]+(?:[A-Z][a-z0-9]*)*$")
+FIELDS_PATTERN = re.compile(r"^[A-Za-z_]\w*(?:\s*,\s*[A-Za-z_]\w*)+,?$")
+FOLDER_PATTERN = re.compile(r"^(?:~|\.{1,2})?/?[\w.@()\[\]-]+(?:/[\w.@()\[\]-]+)+/?$|^\.{1,2}/?$")
+LABEL_PATTERN = re.compile(r"^(?P<label>[A-Za-z_]+)\s*[:=]\s*(?P<value>.+)$")
+# what a question asks for, folder first since every question names the model
+ASKED_PATTERNS = [
+    ("folder_location", re.compile(r"\b(?:folder|location|path|directory)\b", re.I)),
+    ("fields", re.compile(r"\b(?:fields?|columns?)\b", re.I)),
+    ("model", re.compile(r"\b(?:model|entity|table)\b", re.I)),
+]
+REPLY_WORDS = {
+    "yes", "yeah", "yep", "no", "nope", "ok", "okay", "sure", "fine", "please", "thanks",
+    "thank", "you", "hi", "hello", "hey", "cancel", "stop", "done", "none", "nothing",
+    "maybe", "what", "why", "how", "help", "continue", "next", "later", "good", "great",
+}
+
+
+def missing_slots(requirements):
+    return [slot for slot in SLOTS if not requirements.get(slot)]
+
+
+def is_complete(requirements):
+    return not missing_slots(requirements)
+
+
+def asked_slot(question):
+    """Returns the requirement question asks for, None when it is not
+    clear."""
+    for slot, pattern in ASKED_PATTERNS:
+        if pattern.search(question or ""):
+            return slot
+    return None
+
+
+def _parse_value(slot, value):
+    value = value.strip().strip("`'\"").strip()
+    if slot == "model":
+        if MODEL_PATTERN.match(value) and value.lower() not in REPLY_WORDS:
+            return value
+        return None
+    if slot == "fields":
+        if FIELDS_PATTERN.match(value) or re.match(r"^[A-Za-z_]\w*$", value):
+            fields = [field.strip() for field in value.split(",") if field.strip()]
+            if not any(field.lower() in REPLY_WORDS for field in fields):
+                return fields
+        return None
+    return value if FOLDER_PATTERN.match(value) else None
+
+
+def parse_answer(text, requirements, question=None):
+    """Returns the requirement updates an answer unambiguously holds, or
+    None when the answer needs the LLM.
+
+    Args:
+        question: the question answered; an unlabelled answer is only taken
+            for the requirement it asks for, the first missing one when
+            question is None
+    """
+    text = text.strip()
+    if not text:
+        return None
+    parts = [part.strip() for part in re.split(r"[;\n]", text) if part.strip()]
+    labelled = [LABEL_PATTERN.match(part) for part in parts]
+    if all(labelled):
+        updates = {}
+        for match in labelled:
+            slot = LABELS.get(match.group("label").lower())
+            value = _parse_value(slot, match.group("value")) if slot else None
+            if value is None:
+                return None
+            updates[slot] = value
+        return updates
+    if len(parts) != 1:
+        return None
+    missing = missing_slots(requirements)
+    slot = asked_slot(question) if question is not None else (missing[0] if missing else None)
+    value = _parse_value(slot, text) if slot else None
+    if value is None:
+        return None
+    return {slot: value}
+
+
+def apply_updates(requirements, updates):
+    for slot, value in updates.items():
+        if slot in SLOTS and value:
+            requirements[slot] = value
+    return requirements
+
+
+def next_question(requirements):
+    """Returns the question for the first missing requirement, or None once
+    all of them are known."""
+    missing = missing_slots(requirements)
+    if not missing:
+        return None
+    return QUESTIONS[missing[0]].format(model=requirements.get("model") or "")
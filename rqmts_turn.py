@@ -0,0 +1,50 @@
+"""One requirements turn: reads the user's answer and picks the next question.
+
+Shared by the chat handler in kevin.py and the benchmarks, so both run the
+same path: the local parser first, then either one combined LLM call
+("combined") or the requirements agent followed by the probe chain
+("graph").
+"""
+from langchain_core.exceptions import OutputParserException
+
+from probe_chain import aask_next_question, aextract_and_probe
+from rqmts_parser import apply_updates, is_complete, next_question, parse_answer
+from telemetry import telemetry
+
+
+async def arequirements_turn(answer, requirements, history, bot, mode="combined", chat_model=None):
+    """Applies the answer, the last entry of history, to requirements.
+
+    Args:
+        bot: the compiled requirements graph, used in "graph" mode and when
+            the combined answer cannot be parsed
+        chat_model: overrides the shared extraction and probing models
+
+    Returns:
+        tuple: (requirements, probe) where probe is the next question, or
+        None once the requirements are complete
+    """
+    with telemetry.stage("extraction"):
+        probe = None
+        updates = parse_answer(answer, requirements, history[-2] if len(history) > 1 else None)
+        if updates:
+            # unambiguous answer, no LLM needed
+            print(f"Requirements parsed locally: {updates}")
+            probe = next_question(apply_updates(requirements, updates))
+        elif mode == "combined":
+            try:
+                updates, probe = await aextract_and_probe(requirements, history, chat_model)
+                apply_updates(requirements, updates)
+            except OutputParserException as e:
+                print(f"Combined extraction failed, using the requirements agent: {e}")
+        if updates is None:
+            response = await bot.ainvoke({"messages": history[-2:], "requirements": requirements})
+            print(f"Requirements agent: {response.get('round_trips')} round trips for this message.")
+            requirements = response.get("requirements")
+
+    if is_complete(requirements):
+        return requirements, None
+    if not probe:
+        with telemetry.stage("probing"):
+            probe = await aask_next_question(requirements, history, chat_model)
+    return requirements, probe
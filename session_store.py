@@ -0,0 +1,178 @@
+"""Compact per-session state with idle eviction.
+
+Each chat session keeps a SessionState: the last KEVIN_SESSION_HISTORY
+messages in a ring, and the requirements as three slots instead of a
+free-form dict. The SessionStore drops sessions idle for longer than
+KEVIN_SESSION_TTL_SECONDS, checked at most every check_interval seconds
+on access, and reports the memory each session holds.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+HISTORY_LIMIT = int(os.environ.get("KEVIN_SESSION_HISTORY", "20"))
+SESSION_TTL = float(os.environ.get("KEVIN_SESSION_TTL_SECONDS", "3600"))
+
+
+def deep_size(obj, seen=None):
+    """Returns the approximate bytes held by obj and what it references."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_size(getattr(obj, slot), seen) for slot in obj.__slots__
+                    if hasattr(obj, slot))
+    elif hasattr(obj, "__dict__") and not callable(obj):
+        size += deep_size(vars(obj), seen)
+    return size
+
+
+class SessionState:
+    """The history ring and requirements of one chat session."""
+
+    __slots__ = ("id", "history", "model", "fields", "folder_location", "created", "last_seen",
+                 "speculator")
+
+    def __init__(self, session_id, history_limit=HISTORY_LIMIT):
+        self.id = session_id
+        self.history = collections.deque(maxlen=history_limit)
+        self.model = ""
+        self.fields = ()
+        self.folder_location = ""
+        self.created = self.last_seen = time.monotonic()
+        self.speculator = None
+
+    def close(self):
+        """Cancels the session's background work."""
+        if self.speculator is not None:
+            self.speculator.cancel()
+
+    def add_message(self, message):
+        self.history.append(message)
+
+    def recent(self, count=None):
+        """Returns the last count messages, all of the ring by default, as
+        a list the requirements turn can slice."""
+        messages = list(self.history)
+        return messages[-count:] if count else messages
+
+    @property
+    def requirements(self):
+        """The requirements as the dict the chains and code_gen take."""
+        return {"model": self.model, "fields": list(self.fields),
+                "folder_location": self.folder_location}
+
+    @requirements.setter
+    def requirements(self, requirements):
+        # only the three slots are kept, e.g. not the prompt's message_history
+        self.model = requirements.get("model") or ""
+        self.fields = tuple(requirements.get("fields") or ())
+        self.folder_location = requirements.get("folder_location") or ""
+
+    def memory(self):
+        return deep_size(self)
+
+
+class SessionStore:
+    """Thread-safe sessions by id, evicted after ttl seconds idle.
+
+    Args:
+        on_evict: called with the id of every evicted or dropped session,
+            e.g. to retire its telemetry
+    """
+
+    def __init__(self, ttl=SESSION_TTL, history_limit=HISTORY_LIMIT, check_interval=60.0,
+                 on_evict=None):
+        self.ttl = ttl
+        self.history_limit = history_limit
+        self.check_interval = check_interval
+        self.on_evict = on_evict
+        self.evicted = 0
+        self._sessions = {}
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def create(self, session_id):
+        """Starts a new session, replacing any with the same id."""
+        self.evict_idle()
+        state = SessionState(session_id, self.history_limit)
+        with self._lock:
+            self._sessions[session_id] = state
+        return state
+
+    def get(self, session_id):
+        """Returns the session and marks it active, None if it is unknown
+        or was evicted."""
+        self.evict_idle()
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                state.last_seen = time.monotonic()
+            return state
+
+    def drop(self, session_id):
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+        if state is not None:
+            state.close()
+            if self.on_evict:
+                self.on_evict(session_id)
+
+    def evict_idle(self, force=False):
+        """Drops the sessions idle for longer than ttl.
+
+        Returns:
+            list: the evicted session ids
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked_at < self.check_interval:
+                return []
+            self._checked_at = now
+            idle = [session_id for session_id, state in self._sessions.items()
+                    if now - state.last_seen > self.ttl]
+            states = [self._sessions.pop(session_id) for session_id in idle]
+            self.evicted += len(idle)
+        for session_id, state in zip(idle, states):
+            state.close()
+            print(f"Session {session_id} evicted after {self.ttl:.0f}s idle.")
+            if self.on_evict:
+                self.on_evict(session_id)
+        return idle
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def as_dict(self):
+        """Returns the memory per session and in aggregate, in bytes."""
+        with self._lock:
+            states = list(self._sessions.values())
+        now = time.monotonic()
+        sessions = {state.id: {"bytes": state.memory(), "messages": len(state.history),
+                               "idle_seconds": now - state.last_seen}
+                    for state in states}
+        return {"sessions": sessions, "active": len(sessions), "evicted": self.evicted,
+                "bytes": sum(session["bytes"] for session in sessions.values())}
+
+    def to_prometheus(self):
+        stats = self.as_dict()
+        lines = ["# TYPE kevin_sessions_active gauge",
+                 f"kevin_sessions_active {stats['active']}",
+                 "# TYPE kevin_sessions_evicted_total counter",
+                 f"kevin_sessions_evicted_total {stats['evicted']}",
+                 "# TYPE kevin_sessions_bytes gauge",
+                 f"kevin_sessions_bytes {stats['bytes']}",
+                 "# TYPE kevin_session_bytes gauge"]
+        for session_id, session in stats["sessions"].items():
+            escaped = str(session_id).replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'kevin_session_bytes{{session="{escaped}"}} {session["bytes"]}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,164 @@
+"""Speculative code generation while the user is still answering.
+
+The generated code depends only on the model and the fields; the folder
+only decides where it is written. Once both are known, Speculator starts
+the generation in the background with a BufferWriter keeping the files in
+memory, restarts it if the model or the fields change, and on
+confirmation writes the buffered files under the folder the user gave.
+
+SpeculationStats counts how often a speculation was used or wasted and how
+many seconds of generation it hid from the user.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from generation_cache import normalize_fields
+from telemetry import telemetry
+
+
+class BufferWriter:
+    """FileWriter stand-in keeping the staged files in memory, by their path
+    relative to the folder, which is not known yet.
+
+    Once cancelled is set, files are no longer staged; generation running
+    on a worker thread, which cancelling the task does not stop, checks it
+    too.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def stage(self, path, code):
+        if self.cancelled.is_set():
+            return "cancelled"
+        with self._lock:
+            self.files[path] = code
+        return "staged"
+
+    def flush(self):
+        return None
+
+    def commit(self, location, writer):
+        """Stages every buffered file under location in writer."""
+        with self._lock:
+            files = dict(self.files)
+        for path, code in files.items():
+            writer.stage(os.path.join(location, path), code)
+
+
+class SpeculationStats:
+    FIELDS = ("started", "cancelled", "used", "failed", "hidden_seconds", "waited_seconds")
+
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        with self._lock:
+            return {name: getattr(self, name) for name in self.FIELDS}
+
+    def to_prometheus(self):
+        lines = []
+        for name, value in self.as_dict().items():
+            metric = f"kevin_speculation_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+stats = SpeculationStats()
+telemetry.register("speculation", stats)
+
+
+class Speculator:
+    """The background generation of one session.
+
+    Args:
+        generate: coroutine function of (requirements, writer) returning
+            the save_to_file style list of files
+    """
+
+    def __init__(self, generate):
+        self.generate = generate
+        self.key = None
+        self.task = None
+        self.buffer = None
+        self.started = None
+        self.finished = None
+
+    @staticmethod
+    def _key(requirements):
+        fields = normalize_fields(requirements.get("fields") or [])
+        if not requirements.get("model") or not fields:
+            return None
+        return requirements["model"].strip(), tuple(fields)
+
+    def update(self, requirements):
+        """Starts generating for the model and fields of requirements, unless
+        that is already running; restarts when they changed."""
+        key = self._key(requirements)
+        if key is None or key == self.key:
+            return
+        self.cancel()
+        print(f"Speculatively generating {key[0]} with {list(key[1])}...")
+        self.key = key
+        self.buffer = BufferWriter()
+        self.started = time.perf_counter()
+        self.finished = None
+        # the folder is not known yet, files are buffered by relative path
+        speculative = {"model": key[0], "fields": list(key[1]), "folder_location": ""}
+        self.task = asyncio.create_task(self._run(speculative, self.buffer))
+        stats.add("started")
+
+    async def _run(self, requirements, buffer):
+        with telemetry.stage("speculation"):
+            files = await self.generate(requirements, buffer)
+        self.finished = time.perf_counter()
+        return files
+
+    def cancel(self):
+        if self.buffer is not None:
+            self.buffer.cancelled.set()
+        if self.task is not None and not self.task.done():
+            print(f"Cancelling the speculative generation of {self.key[0]}.")
+            self.task.cancel()
+            stats.add("cancelled")
+        self.key = self.task = self.buffer = None
+
+    async def collect(self, requirements, writer):
+        """Waits for the speculation matching requirements and stages its
+        files under folder_location in writer.
+
+        Returns:
+            list: the generated files, or None when there is no matching
+            speculation or it failed, so the caller generates as usual
+        """
+        if self.task is None or self._key(requirements) != self.key:
+            self.cancel()
+            return None
+        start = time.perf_counter()
+        try:
+            files = await self.task
+        except Exception as e:
+            print(f"Speculative generation failed, generating again: {type(e).__name__}: {e}")
+            stats.add("failed")
+            self.key = self.task = self.buffer = None
+            return None
+        waited = time.perf_counter() - start
+        hidden = (self.finished - self.started) - waited
+        stats.add("used")
+        stats.add("waited_seconds", waited)
+        stats.add("hidden_seconds", max(hidden, 0.0))
+        print(f"Using the speculative generation: {hidden:.2f}s hidden, {waited:.2f}s waited.")
+        await asyncio.to_thread(self.buffer.commit, requirements["folder_location"], writer)
+        self.key = self.task = self.buffer = None
+        return files
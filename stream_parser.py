@@ -0,0 +1,128 @@
+import re
+import time
+
+FILENAME_PATTERN = re.compile(r"^\s*[*#`]*\s*Filename:\s*[*`]*\s*(?P<filename>.+?)\s*[*`]*\s*$")
+CODE_PATTERN = re.compile(r"^\s*[*`]*Code:[*`]*\s*(?P<rest>.*)$")
+FENCE_PATTERN = re.compile(r"^\s*```")
+
+
+class FileTiming:
+    def __init__(self, filename, started):
+        self.filename = filename
+        self.started = started
+        self.first_byte = None
+        self.completed = None
+        self.truncated = False
+
+    def as_dict(self):
+        return {
+            "filename": self.filename,
+            "time_to_first_byte": self.first_byte,
+            "time_to_complete": self.completed,
+            "truncated": self.truncated,
+        }
+
+
+class StreamingFileParser:
+    """Incremental parser of "Filename: ... Code: ..." completions.
+
+    Feed it the completion as it streams in; on_file(filename, code) is
+    called as soon as a file is complete, which is when its closing
+    markdown fence arrives, when the next "Filename:" line starts or when
+    the stream is closed. Only the first "Code:" after a filename is a
+    marker, and a "Filename:" inside a fenced block is code, so generated
+    source containing either does not break the split.
+
+    A fenced file still open when the stream closes was cut off; it is
+    marked truncated and not passed to on_file. Blank lines between
+    "Code:" and the code are skipped, and a file without any code is not
+    passed to on_file either, so it cannot overwrite a real one.
+
+    Per file it records the time to first code byte and the time to
+    complete, both in seconds since the parser was created.
+    """
+
+    def __init__(self, on_file):
+        self.on_file = on_file
+        self.started = time.perf_counter()
+        self.timings = []
+        self._pending = ""
+        self._state = "idle"
+        self._filename = None
+        self._lines = []
+        self._fenced = False
+
+    def feed(self, text):
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._line(line)
+
+    def close(self):
+        if self._pending:
+            self._line(self._pending)
+            self._pending = ""
+        if self._state == "code" and self._fenced:
+            self.timings[-1].truncated = True
+            self._state = "idle"
+        self._complete()
+        return self.timings
+
+    def _elapsed(self):
+        return time.perf_counter() - self.started
+
+    def _line(self, line):
+        if self._state == "code":
+            if self._fenced and FENCE_PATTERN.match(line):
+                self._complete()
+                return
+            if not self._fenced:
+                if not self._lines and not line.strip():
+                    return
+                if FILENAME_PATTERN.match(line):
+                    self._complete()
+                    self._line(line)
+                    return
+                if FENCE_PATTERN.match(line):
+                    if self._lines:
+                        self._complete()
+                    else:
+                        self._fenced = True
+                    return
+            self._append(line)
+            return
+        match = FILENAME_PATTERN.match(line)
+        if match:
+            self._complete()
+            self._filename = match.group("filename").strip("`* ")
+            self._state = "header"
+            self.timings.append(FileTiming(self._filename, self._elapsed()))
+            return
+        if self._state != "header" or not line.strip():
+            return
+        match = CODE_PATTERN.match(line)
+        if match:
+            rest = match.group("rest")
+            self._state = "code"
+            if FENCE_PATTERN.match(rest):
+                self._fenced = True
+            elif rest.strip():
+                self._append(rest)
+        elif FENCE_PATTERN.match(line):
+            # some completions skip the "Code:" marker and open a fence
+            self._state = "code"
+            self._fenced = True
+
+    def _append(self, line):
+        if self.timings[-1].first_byte is None:
+            self.timings[-1].first_byte = self._elapsed()
+        self._lines.append(line)
+
+    def _complete(self):
+        if self._state == "code" and self._lines:
+            self.timings[-1].completed = self._elapsed()
+            self.on_file(self._filename, "\n".join(self._lines) + "\n")
+        self._state = "idle"
+        self._filename = None
+        self._lines = []
+        self._fenced = False
@@ -0,0 +1,355 @@
+"""Fast structural checks of a generated file before it is written.
+
+Lint only runs once the whole generation is done. These checks run on
+every file as soon as its completion is parsed, in milliseconds, and
+catch what usually breaks a completion:
+
+    fence     a markdown ``` fence left in the code
+    brackets  unbalanced (), [] or {}, e.g. a truncated file
+    jsx       unclosed or mismatched JSX tags
+    leftover  identifiers of the template entity (CaseWithRelations,
+              casesPromise...) or a file path that were not renamed to
+              the model
+    fields    a requested field missing or repeated in a field-dependent
+              section, as wide_entity checks them
+    imports   a module or name the template set does not import
+    template  no template matches the file path
+
+StructureCheck is the on_file gate of the generation functions: a file
+with problems is not written, and the caller generates it again.
+"""
+import collections
+import functools
+import os
+import re
+import threading
+import time
+
+from telemetry import telemetry
+from template_registry import registry
+from template_renderer import (
+    IMPORT_PATTERN, STRING_PATTERN, TEMPLATE_ENTITY, _matching, rename_identifiers, rename_path,
+)
+import wide_entity
+
+PAIRS = {"(": ")", "[": "]", "{": "}"}
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$]*")
+CLOSING_TAG_PATTERN = re.compile(r"</\s*(?P<name>[A-Za-z][\w.:-]*)?\s*>")
+TAG_NAME_PATTERN = re.compile(r"[A-Za-z][\w.:-]*")
+# words after which a < opens a JSX element rather than a type argument
+JSX_KEYWORDS = {"return", "yield", "await", "else", "default"}
+# the template entity is also a keyword, e.g. case in a switch
+JS_KEYWORDS = {"case"}
+
+
+def _line(code, index):
+    return code.count("\n", 0, index) + 1
+
+
+def _opens_jsx(code, index):
+    """Whether the < at code[index] opens or closes a JSX element, rather
+    than being a comparison or a type argument like useState<string>."""
+    following = code[index + 1:index + 2]
+    if following == "/":
+        return True
+    if not (following.isalpha() or following == ">"):
+        return False
+    previous = code[index - 1:index]
+    if previous.isalnum() or previous in ("_", "$", ")", "]", "."):
+        # a type argument, unless after return or the like
+        word = re.search(r"[\w$]+$", code[max(0, index - 20):index])
+        return bool(word) and word.group(0) in JSX_KEYWORDS
+    return previous != "<"
+
+
+def _tag(code, index, end):
+    """Parses the opening tag at code[index].
+
+    Returns:
+        tuple: (name, end, self_closing, expressions) with the (open, close)
+        indexes of the braces of its attribute expressions, None when it is
+        not a tag
+    """
+    name = TAG_NAME_PATTERN.match(code, index + 1)
+    if code[index + 1:index + 2] == ">":
+        return "", index + 2, False, []
+    expressions = []
+    i = name.end()
+    while i < end:
+        char = code[i]
+        if char == "{":
+            close = _matching(code, i)
+            if close < 0 or close >= end:
+                return name.group(0), end, False, expressions
+            expressions.append((i, close))
+            i = close
+        elif char in "'\"":
+            string = STRING_PATTERN.match(code, i)
+            if string:
+                i = string.end()
+                continue
+        elif code.startswith("/>", i):
+            return name.group(0), i + 2, True, expressions
+        elif char == ">":
+            return name.group(0), i + 1, False, expressions
+        elif char == "<":
+            return None
+        i += 1
+    return name.group(0), end, False, expressions
+
+
+def check_balance(code, jsx=True, start=0, end=None):
+    """Returns the first bracket or JSX tag problem of code[start:end], in
+    a list. The JSX in attribute expressions, like a render prop, is
+    checked on its own."""
+    end = len(code) if end is None else end
+    brackets = []
+    tags = []
+    i = start
+    while i < end:
+        char = code[i]
+        if char in "'\"`":
+            string = STRING_PATTERN.match(code, i)
+            # an unmatched quote is an apostrophe in JSX text
+            i = string.end() if string else i + 1
+            continue
+        if code.startswith("//", i) and code[i - 1:i] != ":":
+            line_end = code.find("\n", i, end)
+            i = end if line_end < 0 else line_end
+            continue
+        if code.startswith("/*", i):
+            comment_end = code.find("*/", i + 2, end)
+            if comment_end < 0:
+                return [f"brackets: comment at line {_line(code, i)} is not closed"]
+            i = comment_end + 2
+            continue
+        if char in PAIRS:
+            brackets.append((char, i))
+        elif char in ")]}":
+            if not brackets or PAIRS[brackets[-1][0]] != char:
+                return [f"brackets: unexpected '{char}' at line {_line(code, i)}"]
+            brackets.pop()
+        elif char == "<" and jsx and _opens_jsx(code, i):
+            if code[i + 1] == "/":
+                match = CLOSING_TAG_PATTERN.match(code, i)
+                name = (match.group("name") or "") if match else None
+                if name is None or not tags or tags[-1][0] != name:
+                    expected = f"</{tags[-1][0]}>" if tags else "no closing tag"
+                    return [f"jsx: unexpected {code[i:i + 20].split(chr(10))[0]} at line "
+                            f"{_line(code, i)}, expected {expected}"]
+                tags.pop()
+                i = match.end()
+                continue
+            tag = _tag(code, i, end)
+            if tag is not None:
+                name, tag_end, self_closing, expressions = tag
+                if tag_end >= end and not self_closing:
+                    return [f"jsx: <{name}> at line {_line(code, i)} is cut off"]
+                for open_index, close_index in expressions:
+                    problems = check_balance(code, jsx, open_index + 1, close_index)
+                    if problems:
+                        return problems
+                if not self_closing:
+                    tags.append((name, i))
+                i = tag_end
+                continue
+        i += 1
+    if brackets:
+        char, index = brackets[-1]
+        return [f"brackets: '{char}' at line {_line(code, index)} is not closed"]
+    if tags:
+        name, index = tags[-1]
+        return [f"jsx: <{name}> at line {_line(code, index)} is not closed"]
+    return []
+
+
+def _entity_pattern(source):
+    return re.compile(rf"(?<![A-Za-z])({source})(s)?(?![a-z])|(?<![A-Z])({source.capitalize()})(s)?(?![a-z])")
+
+
+@functools.lru_cache(maxsize=64)
+def _leftovers(template_code, model, source):
+    """Returns the identifiers of template_code naming the entity that the
+    rename to model changes."""
+    pattern = _entity_pattern(source)
+    renamed = set(IDENTIFIER_PATTERN.findall(rename_identifiers(template_code, model, source)))
+    return frozenset(token for token in set(IDENTIFIER_PATTERN.findall(template_code))
+                     if pattern.search(token) and token not in JS_KEYWORDS and token not in renamed)
+
+
+@functools.lru_cache(maxsize=64)
+def _template_sections(template_code):
+    return wide_entity.sections(template_code)
+
+
+def _import_names(code):
+    """Returns {module: names} of the import statements of code, the
+    default import included."""
+    imports = {}
+    for match in IMPORT_PATTERN.finditer(code):
+        names = imports.setdefault(match.group("module")[1:-1], set())
+        if match.group("default"):
+            names.add(match.group("default"))
+        for name in (match.group("named") or "").split(","):
+            name = re.sub(r"^type\s+", "", name.strip()).split(" as ")[0].strip()
+            if name:
+                names.add(name)
+    return imports
+
+
+@functools.lru_cache(maxsize=64)
+def _allowed_imports(template_codes, model, source):
+    """Returns {module: names} imported by any of template_codes, as is
+    and renamed to model."""
+    allowed = {}
+    for code in template_codes:
+        statements = "".join(match.group(0) for match in IMPORT_PATTERN.finditer(code))
+        # paths the rename leaves alone, like a shared component, count too
+        for renamed in (statements, rename_identifiers(statements, model, source)):
+            for module, names in _import_names(renamed).items():
+                allowed.setdefault(module, set()).update(names)
+    return allowed
+
+
+def check_imports(code, template_codes, model, source=TEMPLATE_ENTITY):
+    allowed = _allowed_imports(tuple(template_codes), model, source)
+    problems = []
+    for module, names in _import_names(code).items():
+        if module not in allowed:
+            problems.append(f"imports: {module} is not imported by the templates")
+        elif names - allowed[module]:
+            problems.append(f"imports: {', '.join(sorted(names - allowed[module]))} "
+                            f"not imported from {module} by the templates")
+    return problems
+
+
+class CheckStats:
+    FIELDS = ("files", "rejected", "seconds")
+
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+        self.problems = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, seconds, problems):
+        with self._lock:
+            self.files += 1
+            self.rejected += bool(problems)
+            self.seconds += seconds
+            self.problems.update(problem.split(":", 1)[0] for problem in problems)
+
+    def as_dict(self):
+        with self._lock:
+            return dict({name: getattr(self, name) for name in self.FIELDS},
+                        problems=dict(self.problems))
+
+    def to_prometheus(self):
+        stats = self.as_dict()
+        lines = []
+        for name in self.FIELDS:
+            metric = f"kevin_structure_check_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {stats[name]}"]
+        lines.append("# TYPE kevin_structure_check_problems_total counter")
+        lines += [f'kevin_structure_check_problems_total{{kind="{kind}"}} {count}'
+                  for kind, count in stats["problems"].items()]
+        return "\n".join(lines) + "\n"
+
+
+stats = CheckStats()
+telemetry.register("structure_check", stats)
+
+
+def check_code(filename, code, template=None, model=None, fields=(), source=TEMPLATE_ENTITY):
+    """Checks a generated file, against the template it was generated from
+    when known.
+
+    Returns:
+        list: the problems found, empty when the file looks sound
+    """
+    start = time.perf_counter()
+    problems = []
+    for number, line in enumerate(code.split("\n"), 1):
+        if "```" in line:
+            problems.append(f"fence: ``` at line {number}")
+            break
+    problems += check_balance(code, jsx=os.path.splitext(filename.strip())[1] in (".tsx", ".jsx"))
+    if template is not None and model:
+        expected = _normalize(rename_path(template.path, model, source))
+        if _normalize(filename) == _normalize(template.path) != expected:
+            problems.append(f"leftover: path {filename.strip()} not renamed to {model}")
+        elif _normalize(filename) not in (expected, _normalize(template.path)):
+            problems.append(f"leftover: path {filename.strip()} is not {expected}")
+        tokens = set(IDENTIFIER_PATTERN.findall(code))
+        leftover = sorted(tokens & _leftovers(template.code, model, source))
+        if leftover:
+            problems.append(f"leftover: {', '.join(leftover)} not renamed to {model}")
+        template_sections = _template_sections(template.code)
+        if fields and template_sections:
+            problems += [f"fields: {problem}"
+                         for problem in wide_entity.validate(code, fields, template_sections)]
+        problems += check_imports(code, [other.code for other in registry.templates(template.template_set)],
+                                  model, source)
+    stats.record(time.perf_counter() - start, problems)
+    return problems
+
+
+def _normalize(path):
+    path = path.strip().replace(os.sep, "/")
+    return path[len("templates/"):] if path.startswith("templates/") else path
+
+
+class StructureCheck:
+    """The on_file gate of one generation.
+
+    Calling it with a generated file returns its problems, and records the
+    file in rejected when it has any, so it is not written.
+    """
+
+    def __init__(self, requirements, source=TEMPLATE_ENTITY):
+        self.model = requirements["model"]
+        self.fields = requirements["fields"]
+        self.source = source
+        self.rejected = {}
+        self._templates = None
+        self._basenames = None
+        self._lock = threading.Lock()
+
+    def template(self, filename):
+        """Returns the template filename was generated from, by its renamed
+        path or, when the completion kept it, its own, else by its renamed
+        file name when a single template has it. None when it matches none."""
+        if self._templates is None:
+            templates = [template for template_set in registry.template_sets()
+                         for template in registry.templates(template_set)]
+            renamed = [(_normalize(rename_path(template.path, self.model, self.source)), template)
+                       for template in templates]
+            self._templates = {_normalize(template.path): template for template in templates}
+            self._templates.update(renamed)
+            self._basenames = {}
+            for path, template in renamed:
+                basename = os.path.basename(path)
+                # an ambiguous file name matches no template
+                self._basenames[basename] = None if basename in self._basenames else template
+        filename = _normalize(filename)
+        template = self._templates.get(filename)
+        if template is None:
+            template = self._basenames.get(os.path.basename(filename))
+        return template
+
+    def __call__(self, filename, code):
+        template = self.template(filename)
+        problems = check_code(filename, code, template, self.model, self.fields, self.source)
+        if template is None:
+            # without its template the file would only get the fence and
+            # bracket checks
+            problems.insert(0, f"template: no template matches {filename.strip()}")
+        if problems:
+            print(f"Not writing {filename.strip()}: {'; '.join(problems)}")
+            with self._lock:
+                self.rejected[filename.strip()] = problems
+        return problems
+
+    def describe(self):
+        return "; ".join(f"{filename}: {', '.join(problems)}"
+                         for filename, problems in self.rejected.items())
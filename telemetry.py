@@ -0,0 +1,262 @@
+"""Per-stage latency, token and cost telemetry.
+
+A stage is timed with
+
+    with telemetry.stage("generation", template="page.tsx"):
+        ...
+
+which also works inside coroutines, since the current stage and session
+live in context variables that asyncio tasks and worker threads inherit.
+LLM calls made in a stage are counted by telemetry.callback, a LangChain
+callback handler the shared models of model_registry carry; tokens come
+from the usage the model reports, or are estimated at four characters per
+token when it reports none. Stages can nest; time is recorded for each
+level and tokens for the innermost one.
+
+Metrics are kept per session and in aggregate, and can be exported as
+JSON (as_dict, write) or in the Prometheus text format (to_prometheus,
+write, or serve for a local /metrics endpoint). Other components, like
+the session store, add their own metrics to the export with register().
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+from langchain_core.callbacks import BaseCallbackHandler
+
+TELEMETRY_DIR = os.environ.get("KEVIN_TELEMETRY_DIR", "debug/telemetry")
+
+current_stage = contextvars.ContextVar("kevin_stage", default=("other", ""))
+current_session = contextvars.ContextVar("kevin_session", default="default")
+
+
+def estimate_cost(model_name, prompt_tokens, completion_tokens):
+    """Returns the cost in USD, 0 for models without a known price."""
+    try:
+        return (get_openai_token_cost_for_model(model_name, prompt_tokens)
+                + get_openai_token_cost_for_model(model_name, completion_tokens, is_completion=True))
+    except ValueError:
+        return 0.0
+
+
+class StageStats:
+    """Counters of one stage, and of one template for generation."""
+
+    FIELDS = ("calls", "seconds", "errors", "retries", "llm_calls", "prompt_tokens",
+              "completion_tokens", "cost")
+
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+
+    def merge(self, other):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class Telemetry:
+    """Stage metrics per session, keyed by (stage, template)."""
+
+    RETIRED = "retired"
+
+    def __init__(self):
+        self.sessions = {}
+        self.collectors = {}
+        self._lock = threading.Lock()
+        self.callback = TelemetryCallbackHandler(self)
+
+    def register(self, name, collector):
+        """Adds a collector's as_dict() and to_prometheus() to the export."""
+        self.collectors[name] = collector
+
+    def retire(self, session):
+        """Folds the metrics of a finished session into the "retired"
+        session, so the totals stay while the per-session rows go."""
+        with self._lock:
+            stages = self.sessions.pop(session, None)
+            if not stages or session == self.RETIRED:
+                return
+            for (stage, template), stats in stages.items():
+                self._stats(stage, template, self.RETIRED).merge(stats)
+
+    def _stats(self, stage, template="", session=None):
+        session = session or current_session.get()
+        stages = self.sessions.setdefault(session, {})
+        return stages.setdefault((stage, template), StageStats())
+
+    @contextlib.contextmanager
+    def stage(self, stage, template=""):
+        token = current_stage.set((stage, template))
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            current_stage.reset(token)
+            with self._lock:
+                stats = self._stats(stage, template)
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.errors += failed
+
+    def retry(self, stage, template=""):
+        with self._lock:
+            self._stats(stage, template).retries += 1
+
+    def record_llm(self, model_name, prompt_tokens, completion_tokens):
+        stage, template = current_stage.get()
+        cost = estimate_cost(model_name, prompt_tokens, completion_tokens)
+        with self._lock:
+            stats = self._stats(stage, template)
+            stats.llm_calls += 1
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cost += cost
+
+    def aggregate(self, session=None):
+        """Returns {stage: StageStats} summed over templates, for one
+        session or over all of them."""
+        totals = {}
+        with self._lock:
+            sessions = [self.sessions.get(session, {})] if session else list(self.sessions.values())
+            for stages in sessions:
+                for (stage, template), stats in stages.items():
+                    totals.setdefault(stage, StageStats()).merge(stats)
+        return totals
+
+    def as_dict(self):
+        with self._lock:
+            sessions = {
+                session: [dict(stats.as_dict(), stage=stage, template=template)
+                          for (stage, template), stats in stages.items()]
+                for session, stages in self.sessions.items()
+            }
+        result = {
+            "sessions": sessions,
+            "aggregate": {stage: stats.as_dict() for stage, stats in self.aggregate().items()},
+        }
+        for name, collector in self.collectors.items():
+            result[name] = collector.as_dict()
+        return result
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            rows = [(session, stage, template, stats.as_dict())
+                    for session, stages in self.sessions.items()
+                    for (stage, template), stats in stages.items()]
+        for name in StageStats.FIELDS:
+            metric = f"kevin_stage_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for session, stage, template, values in rows:
+                labels = f'session="{_escape(session)}",stage="{_escape(stage)}"'
+                if template:
+                    labels += f',template="{_escape(template)}"'
+                lines.append(f"{metric}{{{labels}}} {values[name]}")
+        text = "\n".join(lines) + "\n"
+        for collector in self.collectors.values():
+            text += collector.to_prometheus()
+        return text
+
+    def write(self, directory=TELEMETRY_DIR):
+        """Writes metrics.json and metrics.prom to directory."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "metrics.json"), "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+        with open(os.path.join(directory, "metrics.prom"), "w") as f:
+            f.write(self.to_prometheus())
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves /metrics (Prometheus) and /metrics.json on a daemon thread."""
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = telemetry.to_prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(telemetry.as_dict()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+    def clear(self):
+        with self._lock:
+            self.sessions.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """Counts the calls and tokens of every LLM call in the current stage."""
+
+    run_inline = True
+
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self._prompts = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._prompts[run_id] = (
+            sum(len(str(message.content)) for batch in messages for message in batch),
+            _model_name(serialized, kwargs))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._prompts[run_id] = (sum(map(len, prompts)), _model_name(serialized, kwargs))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_chars, model_name = self._prompts.pop(run_id, (0, ""))
+        llm_output = response.llm_output or {}
+        model_name = llm_output.get("model_name") or model_name
+        usage = llm_output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        text = ""
+        for generations in response.generations:
+            for generation in generations:
+                text += generation.text
+                usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage_metadata and not usage:
+                    prompt_tokens += usage_metadata.get("input_tokens", 0)
+                    completion_tokens += usage_metadata.get("output_tokens", 0)
+        if not prompt_tokens and not completion_tokens:
+            prompt_tokens, completion_tokens = prompt_chars // 4, len(text) // 4
+        self.telemetry.record_llm(model_name, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._prompts.pop(run_id, None)
+
+
+def _model_name(serialized, kwargs):
+    params = kwargs.get("invocation_params") or {}
+    return (params.get("model_name") or params.get("model")
+            or ((serialized or {}).get("kwargs") or {}).get("model_name") or "")
+
+
+telemetry = Telemetry()
@@ -0,0 +1,125 @@
+"""Dependencies between the templates of one or more template sets.
+
+A template depends on another when it imports it, relatively or through
+an alias ending in the other template's file name, or when it calls the
+API route the other one implements:
+
+    case-page.tsx          imports ./case-search-table
+    case-search-table.tsx  imports ./add-case
+    add-case.tsx           fetch('/api/case')  -> app/api/case/route.ts
+
+The dependencies of a generated file are summarised by signatures(): its
+exported declarations, the props they take and, for a route, the API it
+serves. That is all a dependent file needs to import and call it.
+"""
+import os
+import re
+
+IMPORT_SPEC_PATTERN = re.compile(r"""\bfrom\s+['"](?P<spec>[^'"]+)['"]""")
+API_PATTERN = re.compile(r"""(?P<url>/api/[\w\-\[\]/]*\w)""")
+EXPORT_PATTERN = re.compile(
+    r"^export\s+(?:default\s+)?(?:async\s+)?function\s+(?P<name>\w+)\s*\((?P<params>.*?)\)\s*"
+    r"(?::\s*[^{]+?)?\s*\{",
+    re.M | re.S)
+EXPORT_OTHER_PATTERN = re.compile(
+    r"^export\s+(?:default\s+)?(?:const|let|class|type|interface|enum)\s+\w+[^\n]*", re.M)
+INTERFACE_PATTERN = re.compile(r"^(?:export\s+)?(?:interface|type)\s+(?P<name>\w+)\b.*?^\}", re.M | re.S)
+SEARCH_PARAM_PATTERN = re.compile(r"searchParams\.get\(\s*['\"](?P<name>\w+)['\"]\s*\)")
+RESPONSE_KEY_PATTERN = re.compile(r"NextResponse\.json\(\s*\{\s*(?P<key>\w+)\s*:")
+SOURCE_EXTENSIONS = (".tsx", ".ts", ".jsx", ".js")
+
+
+def route_url(path):
+    """templates/app/api/case/route.ts -> /api/case, None for other files."""
+    path = path.replace(os.sep, "/")
+    match = re.search(r"(?:^|/)app(?P<url>/api/.+)/route\.\w+$", path)
+    return match.group("url") if match else None
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _resolve_import(template, spec, by_path, by_stem):
+    if spec.startswith("."):
+        base = os.path.normpath(os.path.join(os.path.dirname(template.path), spec))
+        for candidate in [base] + [base + ext for ext in SOURCE_EXTENSIONS]:
+            if candidate in by_path:
+                return candidate
+        return None
+    if spec.startswith("@"):
+        # aliased imports match a template of the same set with that file name
+        candidates = [other for other in by_stem.get(_stem(spec), [])
+                      if other.template_set == template.template_set]
+        if len(candidates) == 1:
+            return candidates[0].path
+    return None
+
+
+def dependencies(templates):
+    """Returns {template path: [paths of the templates it depends on]}."""
+    by_path = {template.path: template for template in templates}
+    by_stem = {}
+    for template in templates:
+        by_stem.setdefault(_stem(template.path), []).append(template)
+    routes = {route_url(template.path): template.path for template in templates
+              if route_url(template.path)}
+    graph = {}
+    for template in templates:
+        depends = []
+        for match in IMPORT_SPEC_PATTERN.finditer(template.code):
+            path = _resolve_import(template, match.group("spec"), by_path, by_stem)
+            if path and path != template.path and path not in depends:
+                depends.append(path)
+        for match in API_PATTERN.finditer(template.code):
+            path = routes.get(match.group("url"))
+            if path and path != template.path and path not in depends:
+                depends.append(path)
+        graph[template.path] = depends
+    return graph
+
+
+def levels(graph):
+    """Orders the graph into levels whose templates only depend on earlier
+    levels. The edges of a cycle are dropped, with a warning, so its
+    templates are generated without each other's signatures."""
+    remaining = {path: set(depends) for path, depends in graph.items()}
+    result = []
+    while remaining:
+        ready = sorted(path for path, depends in remaining.items() if not depends)
+        if not ready:
+            print(f"Dependency cycle between {sorted(remaining)}, generating them independently.")
+            for path in remaining:
+                graph[path] = [depend for depend in graph[path] if depend not in remaining]
+            ready = sorted(remaining)
+        result.append(ready)
+        for path in ready:
+            del remaining[path]
+        for depends in remaining.values():
+            depends.difference_update(ready)
+    return result
+
+
+def signatures(filename, code):
+    """Returns the exported declarations of a generated file and the props
+    interfaces they take, and for an API route its URL, methods, query
+    parameters and response keys."""
+    lines = [f"// {filename}"]
+    url = route_url(filename)
+    exported = []
+    for match in EXPORT_PATTERN.finditer(code):
+        declaration = " ".join(match.group(0).rstrip("{").split())
+        exported.append(match.group("name"))
+        lines.append(declaration)
+        for interface in INTERFACE_PATTERN.finditer(code):
+            if re.search(rf"\b{interface.group('name')}\b", match.group("params")):
+                lines.append(interface.group(0))
+    lines += EXPORT_OTHER_PATTERN.findall(code)
+    if url:
+        methods = [name for name in exported if name.isupper()]
+        params = sorted(set(SEARCH_PARAM_PATTERN.findall(code)))
+        keys = sorted(set(RESPONSE_KEY_PATTERN.findall(code)))
+        lines.append(f"API {url}: {', '.join(methods)}"
+                     + (f"; query parameters: {', '.join(params)}" if params else "")
+                     + (f"; responds with {{ {', '.join(keys)} }}" if keys else ""))
+    return "\n".join(lines)
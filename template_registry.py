@@ -0,0 +1,94 @@
+import hashlib
+import os
+import threading
+import time
+
+TEMPLATE_ROOT = "templates"
+
+
+class Template:
+    """A template file, its content and the hash of it."""
+
+    def __init__(self, path, template_set, relpath, code, mtime):
+        self.path = path
+        self.template_set = template_set
+        self.relpath = relpath
+        self.code = code
+        self.mtime = mtime
+        self.sha256 = hashlib.sha256(code.encode()).hexdigest()
+
+
+class TemplateRegistry:
+    """Process-wide index of the boilerplate templates.
+
+    Templates are indexed by template set (the directory holding them,
+    relative to the root, e.g. "app/(protected)/cases") and by their path
+    relative to that set. Files are re-read only when their mtime changed,
+    and a template is replaced only when its content actually changed, so
+    the prompts built from it (see prompt_budget) stay cached.
+    """
+
+    def __init__(self, root=TEMPLATE_ROOT, check_interval=1.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._sets = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Picks up added, changed and removed template files."""
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.check_interval:
+                return
+            seen = set()
+            for root, dirs, files in os.walk(self.root):
+                dirs.sort()
+                template_set = os.path.relpath(root, self.root)
+                for file in sorted(files):
+                    path = os.path.join(root, file)
+                    seen.add(path)
+                    self._load(path, template_set, file)
+            for template_set, templates in list(self._sets.items()):
+                for relpath, template in list(templates.items()):
+                    if template.path not in seen:
+                        del templates[relpath]
+                if not templates:
+                    del self._sets[template_set]
+            self._checked_at = time.monotonic()
+
+    def _load(self, path, template_set, relpath):
+        mtime = os.stat(path).st_mtime_ns
+        templates = self._sets.setdefault(template_set, {})
+        current = templates.get(relpath)
+        if current and current.mtime == mtime:
+            return
+        with open(path, "r") as f:
+            template = Template(path, template_set, relpath, f.read(), mtime)
+        if current and current.sha256 == template.sha256:
+            # touched but not edited, keep the cached prompts
+            current.mtime = mtime
+            return
+        templates[relpath] = template
+
+    def template_sets(self):
+        self.refresh()
+        return sorted(self._sets)
+
+    def templates(self, template_set):
+        """Returns the templates of a set, ordered by relative path."""
+        self.refresh()
+        if template_set not in self._sets:
+            raise KeyError(f"Unknown template set: {template_set}")
+        return list(self._sets[template_set].values())
+
+    def get(self, template_set, relpath):
+        self.refresh()
+        return self._sets[template_set][relpath]
+
+    def get_path(self, path):
+        """Looks a template up by its path, e.g. templates/billing/billing.tsx."""
+        relpath = os.path.relpath(path, self.root)
+        return self.get(os.path.dirname(relpath) or ".", os.path.basename(relpath))
+
+
+registry = TemplateRegistry()
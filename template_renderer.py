@@ -0,0 +1,538 @@
+"""Deterministic renderer for the CRUD templates.
+
+Does locally what generate_code asks gpt-4o to do: rename the template
+entity (case/Case/cases/caseNumber...) to the requested model in camel,
+Pascal, plural, kebab and human form, and rewrite the field-dependent
+regions (zod schema, default values, form fields, table columns, search
+columns, relation lookups and includes) from requirements["fields"].
+
+Regions the renderer cannot find are reported back in
+RenderResult.unresolved so only those templates go to the LLM.
+"""
+import os
+import re
+import sys
+import tempfile
+
+TEMPLATE_ENTITY = "case"
+
+# fields the database fills in, left out of the add form
+AUTO_FIELDS = {"id", "createdat", "updatedat", "isdeleted"}
+
+STRING_PATTERN = re.compile(r"""'(?:\\.|[^'\\\n])*'|"(?:\\.|[^"\\\n])*"|`(?:\\.|[^`\\])*`""")
+JSX_TEXT_PATTERN = re.compile(r"(?<=>)([^<>{}()\[\]=;:,'\"`]*[A-Za-z][^<>{}()\[\]=;:,'\"`]*)(?=<)")
+IMPORT_PATTERN = re.compile(
+    r"^import\s+(?:type\s+)?(?:(?P<default>\w+)\s*,?\s*)?(?:\{(?P<named>[^}]*)\})?\s*from\s+(?P<module>'[^']+'|\"[^\"]+\")[ \t]*\n",
+    re.M,
+)
+
+
+def split_words(name):
+    """Splits PurchaseOrder, purchaseOrder, purchase_order or purchase-order
+    into lowercase words."""
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name.strip())
+    return [word.lower() for word in re.split(r"[\s_\-]+", name) if word]
+
+
+def pluralize(word):
+    if re.search(r"[^aeiou]y$", word):
+        return word[:-1] + "ies"
+    if re.search(r"(s|x|z|ch|sh)$", word):
+        return word + "es"
+    return word + "s"
+
+
+class Names:
+    """All the spellings of an entity name used across the templates."""
+
+    def __init__(self, name, plural=False):
+        words = split_words(name)
+        if plural:
+            words = words[:-1] + [pluralize(words[-1])]
+        self.words = words
+        self.pascal = "".join(word.capitalize() for word in words)
+        self.camel = words[0] + self.pascal[len(words[0]):]
+        self.kebab = "-".join(words)
+        self.human = " ".join(words)
+        self.title = " ".join(word.capitalize() for word in words)
+
+
+class Field:
+    def __init__(self, name):
+        name = name.strip()
+        if not re.match(r"^[A-Za-z_$][\w$]*$", name):
+            name = Names(name).camel
+        self.name = name
+        self.label = Names(name).title
+        key = name.lower().replace("_", "")
+        self.auto = key in AUTO_FIELDS
+        if re.match(r"^(is|has)[A-Z_]", name):
+            self.kind = "boolean"
+        elif re.search(r"(Date|At|_at|_date)$", name) or key == "date":
+            self.kind = "date"
+        else:
+            self.kind = "string"
+
+
+class RenderResult:
+    def __init__(self, path, code, unresolved):
+        self.path = path
+        self.code = code
+        self.unresolved = unresolved
+
+
+def _rename_word(match, singular, plural, style):
+    word, is_plural = match.group(1), bool(match.group(2))
+    names = plural if is_plural else singular
+    if style == "kebab":
+        return names.kebab
+    if style == "human":
+        return names.title if word[0].isupper() else names.human
+    return names.pascal if word[0].isupper() else names.camel
+
+
+def _rename_text(text, singular, plural, style, source):
+    pattern = rf"(?<![A-Za-z])({source}|{source.capitalize()})(s)?(?![a-z])"
+    if style == "code":
+        # Pascal case also starts a word after a lowercase letter: AddCase, createdCase
+        pattern = rf"(?<![A-Za-z])({source})(s)?(?![a-z])|(?<![A-Z])({source.capitalize()})(s)?(?![a-z])"
+
+        def replace(match):
+            if match.group(1):
+                return _rename_word(match, singular, plural, "code")
+            word, is_plural = match.group(3), match.group(4)
+            return (plural if is_plural else singular).pascal
+        return re.sub(pattern, replace, text)
+    if style == "string":
+        def replace(match):
+            start, end = match.span()
+            near = text[max(start - 1, 0):start] + text[end:end + 1]
+            kind = "kebab" if ("/" in near or "-" in near) else "human"
+            return _rename_word(match, singular, plural, kind)
+        return re.sub(pattern, replace, text)
+    return re.sub(pattern, lambda match: _rename_word(match, singular, plural, style), text)
+
+
+def rename_identifiers(code, model, source=TEMPLATE_ENTITY):
+    """Renames the template entity to model. Identifiers get camel or Pascal
+    case, paths in strings get kebab case and other text gets words."""
+    singular, plural = Names(model), Names(model, plural=True)
+    parts = []
+    last = 0
+    for match in STRING_PATTERN.finditer(code):
+        parts.append(_rename_code(code[last:match.start()], singular, plural, source))
+        parts.append(_rename_text(match.group(0), singular, plural, "string", source))
+        last = match.end()
+    parts.append(_rename_code(code[last:], singular, plural, source))
+    return "".join(parts)
+
+
+def _rename_code(code, singular, plural, source):
+    parts = []
+    last = 0
+    for match in JSX_TEXT_PATTERN.finditer(code):
+        parts.append(_rename_text(code[last:match.start()], singular, plural, "code", source))
+        parts.append(_rename_text(match.group(0), singular, plural, "human", source))
+        last = match.end()
+    parts.append(_rename_text(code[last:], singular, plural, "code", source))
+    return "".join(parts)
+
+
+def rename_path(path, model, source=TEMPLATE_ENTITY):
+    """templates/app/(protected)/cases/add-case.tsx ->
+    templates/app/(protected)/purchase-orders/add-purchase-order.tsx"""
+    return _rename_text(path, Names(model), Names(model, plural=True), "kebab", source)
+
+
+def _matching(code, index):
+    """Returns the index of the bracket closing the one at code[index],
+    skipping strings and comments."""
+    pairs = {"{": "}", "[": "]", "(": ")"}
+    stack = []
+    i = index
+    while i < len(code):
+        char = code[i]
+        if char in "'\"`":
+            match = STRING_PATTERN.match(code, i)
+            if match:
+                i = match.end()
+                continue
+        elif code.startswith("//", i):
+            i = code.find("\n", i)
+            if i < 0:
+                return -1
+            continue
+        elif code.startswith("/*", i):
+            i = code.find("*/", i) + 2
+            if i < 2:
+                return -1
+            continue
+        elif char in pairs:
+            stack.append(pairs[char])
+        elif char in ")]}":
+            if not stack or stack.pop() != char:
+                return -1
+            if not stack:
+                return i
+        i += 1
+    return -1
+
+
+def _block(code, anchor, start=0):
+    """Finds anchor (a regex ending with an opening bracket) and returns the
+    (open, close) indexes of its bracketed block, or None."""
+    match = re.compile(anchor).search(code, start)
+    if not match:
+        return None
+    open_index = match.end() - 1
+    close_index = _matching(code, open_index)
+    if close_index < 0:
+        return None
+    return open_index, close_index
+
+
+def _indent_at(code, index):
+    line_start = code.rfind("\n", 0, index) + 1
+    return re.match(r"[ \t]*", code[line_start:]).group(0)
+
+
+def _replace_inner(code, block, lines):
+    """Replaces the inside of a multi-line bracketed block with lines,
+    indented one level deeper than the line that opens the block."""
+    open_index, close_index = block
+    indent = _indent_at(code, open_index)
+    inner = "".join(f"{indent}  {line}\n" if line else "\n" for line in "\n".join(lines).split("\n")) if lines else ""
+    return code[:open_index + 1] + ("\n" + inner + indent if lines else "") + code[close_index:]
+
+
+def _top_level_items(code, block):
+    """Splits the inside of an array block into (start, end) spans of its
+    top-level {...} items."""
+    items = []
+    i = block[0] + 1
+    while i < block[1]:
+        if code[i] == "{":
+            end = _matching(code, i)
+            if end < 0:
+                return None
+            items.append((i, end + 1))
+            i = end + 1
+        else:
+            i += 1
+    return items
+
+
+def _prisma_imports(code):
+    names = set()
+    for match in IMPORT_PATTERN.finditer(code):
+        if match.group("module")[1:-1] == "@db/prisma" and match.group("named"):
+            names.update(name.strip() for name in match.group("named").split(",") if name.strip())
+    return names
+
+
+def prune_unused_imports(code):
+    """Drops named and default imports that are no longer referenced."""
+    # names only inside quotes (labels, titles) do not count as a use
+    body = re.sub(r"'[^'\n]*'|\"[^\"\n]*\"", "''", IMPORT_PATTERN.sub("", code))
+
+    def used(name):
+        return re.search(rf"(?<![\w$.]){re.escape(name)}(?![\w$])", body) is not None
+
+    def replace(match):
+        default = match.group("default")
+        named = match.group("named")
+        keep_default = default if default and used(default) else None
+        keep_named = []
+        if named is not None:
+            for item in named.split(","):
+                item = item.strip()
+                if item and used(re.split(r"\s+as\s+", item)[-1].replace("type ", "").strip()):
+                    keep_named.append(item)
+        if not keep_default and not keep_named:
+            return ""
+        if keep_default == default and named is None:
+            return match.group(0)
+        if keep_default == default and len(keep_named) == len([i for i in named.split(",") if i.strip()]):
+            return match.group(0)
+        statement = "import "
+        if match.group(0).startswith("import type"):
+            statement += "type "
+        statement += ", ".join(filter(None, [keep_default, "{ " + ", ".join(keep_named) + " }" if keep_named else None]))
+        return f"{statement} from {match.group('module')}\n"
+
+    return IMPORT_PATTERN.sub(replace, code)
+
+
+def ensure_import(code, name, module):
+    if re.search(rf"import[^;]*?\b{name}\b[^;]*?from", code):
+        return code
+    statement = f"import {{ {name} }} from '{module}'\n"
+    imports = list(IMPORT_PATTERN.finditer(code))
+    index = imports[-1].end() if imports else 0
+    return code[:index] + statement + code[index:]
+
+
+def _drop_lookups(code):
+    """Drops the relation lookups (lists of related Prisma records passed
+    down as props or fetched by the page). Kevin's fields are scalar."""
+    lookups = set()
+    prisma_types = _prisma_imports(code)
+    pattern = re.compile(r"const (\w+): (\w+)\[\] = await fetch\(")
+    start = 0
+    while True:
+        match = pattern.search(code, start)
+        if not match:
+            break
+        end = _matching(code, match.end() - 1)
+        if match.group(2) not in prisma_types or end < 0:
+            start = match.end()
+            continue
+        then = re.compile(r"\s*\.then\(").match(code, end + 1)
+        if then:
+            end = _matching(code, then.end() - 1)
+        line_end = code.find("\n", end)
+        code = code[:match.start()] + code[line_end + 1:]
+        lookups.add(match.group(1))
+        start = match.start()
+    block = _block(code, r"interface (\w+)Props \{")
+    if block:
+        inner = code[block[0] + 1:block[1]]
+        for member in re.finditer(r"^\s*(\w+): (\w+)\[\]\s*$", inner, re.M):
+            if member.group(2) in prisma_types:
+                lookups.add(member.group(1))
+    return _drop_lookups_named(code, lookups)
+
+
+def _drop_lookups_named(code, lookups):
+    if not lookups:
+        return code
+    block = _block(code, r"interface (\w+)Props \{")
+    if block:
+        inner = code[block[0] + 1:block[1]]
+        kept = [line for line in inner.split("\n")
+                if not re.match(rf"^\s*({'|'.join(lookups)}):", line)]
+        if any(line.strip() for line in kept):
+            code = code[:block[0] + 1] + "\n".join(kept) + code[block[1]:]
+        else:
+            props = re.search(r"interface (\w+Props) \{", code).group(1)
+            statement_start = code.rfind("\n", 0, block[0]) + 1
+            code = code[:statement_start] + code[block[1] + 1:].lstrip("\n")
+            code = re.sub(rf"\(\{{[^}}]*\}}: {props}\)", "()", code)
+    for name in lookups:
+        # destructured props and JSX attributes
+        code = re.sub(rf"^[ \t]*{name},[ \t]*\n", "", code, flags=re.M)
+        code = re.sub(rf",\s*{name}(?=\s*\}})", "", code)
+        code = re.sub(rf"(?<=\{{)\s*{name},\s*", " ", code)
+        code = re.sub(rf"[ \t]*\n?[ \t]*\b{name}=\{{{name}\}}", "", code)
+    return code
+
+
+def _schema_entry(field):
+    if field.kind == "boolean":
+        return f"{field.name}: z.boolean(),"
+    if field.kind == "date":
+        return (f"{field.name}: z.date({{\n"
+                f"  required_error: '{field.label} is required.',\n"
+                f"}}),")
+    return f"{field.name}: z.string().min(1, {{ message: '{field.label} is required' }}),"
+
+
+def _default_value(field):
+    if field.kind == "boolean":
+        return f"{field.name}: false,"
+    if field.kind == "string":
+        return f"{field.name}: '',"
+    return None
+
+
+def _form_field(field):
+    if field.kind == "boolean":
+        control = "<Checkbox\n  checked={field.value}\n  onCheckedChange={field.onChange}\n/>"
+    elif field.kind == "date":
+        control = ("<DatePicker\n  id=\":rd:-form-item\"\n"
+                   "  fieldValue={field.value}\n  fieldOnChange={field.onChange}\n/>")
+    else:
+        control = f'<Input placeholder="Enter {field.label.lower()}" {{...field}} />'
+    control = "\n".join("        " + line for line in control.split("\n"))
+    return ("<FormField\n"
+            "  control={form.control}\n"
+            f'  name="{field.name}"\n'
+            "  render={({ field }) => (\n"
+            "    <FormItem>\n"
+            f"      <FormLabel>{field.label}</FormLabel>\n"
+            "      <FormControl>\n"
+            f"{control}\n"
+            "      </FormControl>\n"
+            "      <FormMessage />\n"
+            "    </FormItem>\n"
+            "  )}\n"
+            "/>")
+
+
+def _column(field):
+    if field.kind == "date":
+        cell = (f"const {field.name} = new Date(\n"
+                f"  row.getValue('{field.name}')\n"
+                ").toLocaleString('en-US', {\n"
+                "  month: '2-digit',\n"
+                "  day: '2-digit',\n"
+                "  year: '2-digit'\n"
+                "})\n"
+                f"return <DataTableTextField value={{{field.name}}} />")
+    elif field.kind == "boolean":
+        cell = f"return <DataTableTextField value={{row.original.{field.name} ? 'Yes' : 'No'}} />"
+    else:
+        cell = (f"const {field.name} = row.original.{field.name}\n"
+                f"return <DataTableTextField value={{{field.name}}} />")
+    cell = "\n".join("    " + line for line in cell.split("\n"))
+    return ("{\n"
+            f"  accessorKey: '{field.name}',\n"
+            "  header: ({ column }) => (\n"
+            f'    <DataTableColumnHeader column={{column}} title="{field.label}" />\n'
+            "  ),\n"
+            "  cell: ({ row }) => {\n"
+            f"{cell}\n"
+            "  }\n"
+            "}")
+
+
+def _indent(text, indent):
+    return "\n".join(indent + line if line else line for line in text.split("\n"))
+
+
+def _render_add(code, fields, unresolved):
+    form_fields = [field for field in fields if not field.auto]
+    block = _block(code, r"z\.object\(\{")
+    if block:
+        code = _replace_inner(code, block, [_schema_entry(field) for field in form_fields])
+    else:
+        unresolved.append("form schema")
+    block = _block(code, r"defaultValues: \{")
+    if block:
+        code = _replace_inner(code, block, list(filter(None, map(_default_value, form_fields))))
+    else:
+        unresolved.append("default values")
+    match = re.search(r"(\n([ \t]*)<FormField\b.*?)(?=\n[ \t]*<Button[^>]*type=\"submit\")", code, re.S)
+    if match:
+        indent = match.group(2)
+        rendered = "\n".join(_indent(_form_field(field), indent) for field in form_fields)
+        code = code[:match.start()] + "\n" + rendered + code[match.end():]
+    else:
+        unresolved.append("form fields")
+    if any(field.kind == "boolean" for field in form_fields):
+        code = ensure_import(code, "Checkbox", "@ui/core/shadcn/checkbox")
+    if any(field.kind == "date" for field in form_fields):
+        code = ensure_import(code, "DatePicker", "@ui/core/shadcn/datepicker")
+    return code
+
+
+def _render_search_table(code, fields, unresolved):
+    columns = [field for field in fields if field.name != "id"]
+    block = _block(code, r"\(\)\s*=>\s*\[")
+    items = _top_level_items(code, block) if block else None
+    if items:
+        keep = [(start, end) for start, end in items
+                if re.match(r"\{\s*id: '(select|actions)'", code[start:end])]
+        indent = _indent_at(code, items[0][0])
+        rendered = []
+        for start, end in keep:
+            if "'actions'" in code[start:start + 40]:
+                rendered += [_indent(_column(field), indent).lstrip() for field in columns]
+            rendered.append(code[start:end])
+        if not any("'actions'" in item[:40] for item in rendered):
+            rendered += [_indent(_column(field), indent).lstrip() for field in columns]
+        code = (code[:items[0][0]] + (",\n" + indent).join(rendered) + code[items[-1][1]:])
+    else:
+        unresolved.append("columns")
+    block = _block(code, r"DataTableSearchableColumn<\w+>\[\] = \[")
+    if block:
+        searchable = [field for field in columns if field.kind == "string"][:2]
+        code = _replace_inner(code, block, [
+            "{\n"
+            f"  id: '{field.name}',\n"
+            f"  title: '{field.label}',\n"
+            f"  placeholder: 'Filter {field.label.lower()}...'\n"
+            "}" + ("," if index < len(searchable) - 1 else "")
+            for index, field in enumerate(searchable)])
+    else:
+        unresolved.append("searchable columns")
+    code = re.sub(r"hiddenColumns: \[[^\]]*\]", "hiddenColumns: []", code)
+    return code
+
+
+def _render_page(code, fields, unresolved):
+    columns = len([field for field in fields if field.name != "id"]) + 2
+    code = re.sub(r"columnCount=\{\d+\}", f"columnCount={{{columns}}}", code)
+    return code
+
+
+def _render_route(code, fields, unresolved):
+    while True:
+        match = re.search(r"\n([ \t]*// include fields that referenced another table\n)?[ \t]*include: \{", code)
+        if not match:
+            break
+        end = _matching(code, match.end() - 1)
+        if end < 0:
+            unresolved.append("includes")
+            break
+        if code[end + 1:end + 2] == ",":
+            end += 1
+        code = code[:match.start()] + code[end + 1:]
+    if "isDeleted" not in [field.name for field in fields]:
+        code = re.sub(r"where: \{\s*isDeleted: false,?\s*\}", "where: {}", code)
+    return code
+
+
+RENDERERS = [
+    (re.compile(r"^add-"), _render_add),
+    (re.compile(r"-search-table\.tsx$"), _render_search_table),
+    (re.compile(r"-page\.tsx$"), _render_page),
+    (re.compile(r"^route\.ts$"), _render_route),
+]
+
+
+def render_template(path, code, model, fields, source=TEMPLATE_ENTITY):
+    """Renders one template for model and fields.
+
+    Returns:
+        RenderResult: the renamed output path, the rendered code and the
+        names of the regions that could not be rendered. A template with
+        no renderer reports a single "template" region.
+    """
+    fields = [Field(field) for field in fields if field.strip()]
+    unresolved = []
+    renderer = next((render for pattern, render in RENDERERS
+                     if pattern.search(os.path.basename(path))), None)
+    if renderer is None:
+        return RenderResult(rename_path(path, model, source), code, ["template"])
+    code = _drop_lookups(code)
+    code = rename_identifiers(code, model, source)
+    code = renderer(code, fields, unresolved)
+    code = prune_unused_imports(code)
+    return RenderResult(rename_path(path, model, source), code, unresolved)
+
+
+def main():
+    """Renders the cases templates for a few models into a temp folder."""
+    from template_registry import registry
+
+    samples = [
+        ("Department", ["id", "name", "type", "category", "description", "isRequired"]),
+        ("PurchaseOrder", ["id", "orderNumber", "supplier", "orderDate", "amount"]),
+        ("category", ["id", "name", "createdAt", "updatedAt"]),
+    ]
+    location = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+    for model, fields in samples:
+        for template_set in ["app/(protected)/cases", "app/api/case"]:
+            for template in registry.templates(template_set):
+                result = render_template(template.path, template.code, model, fields)
+                output = os.path.join(location, result.path)
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                with open(output, "w") as f:
+                    f.write(result.code)
+                print(f"{model:<14} {result.path:<70} unresolved: {result.unresolved or '-'}")
+    print(f"Rendered into {location}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from stream_parser import StreamingFileParser
+
+
+def parse(completion, chunk_size=7):
+    files = []
+    parser = StreamingFileParser(lambda filename, code: files.append((filename, code)))
+    for start in range(0, len(completion), chunk_size):
+        parser.feed(completion[start:start + chunk_size])
+    parser.close()
+    return files
+
+
+def test_fenced_files():
+    completion = ("Filename: a.tsx\nCode: ```tsx\nconst a = 1\n```\n"
+                  "Filename: b.ts\nCode:\n```typescript\nconst b = 2\n```\n")
+    assert parse(completion) == [("a.tsx", "const a = 1\n"), ("b.ts", "const b = 2\n")]
+
+
+def test_blank_lines_before_the_fence():
+    completion = "Filename: a.tsx\nCode:\n\n\n```tsx\nconst a = 1\n\nexport default a\n```\n"
+    assert parse(completion) == [("a.tsx", "const a = 1\n\nexport default a\n")]
+
+
+def test_file_without_code_is_skipped():
+    assert parse("Filename: a.tsx\nCode:\n\nFilename: b.tsx\nCode: const b = 2\n") == [
+        ("b.tsx", "const b = 2\n")]
+
+
+def test_empty_fence_is_skipped():
+    assert parse("Filename: app/a.tsx\nCode:\n```tsx\n```\n") == []
+
+
+def test_markdown_filename():
+    completion = "**Filename:** `a.tsx`\n**Code:**\n```tsx\nconst a = 1\n```\n"
+    assert parse(completion) == [("a.tsx", "const a = 1\n")]
+
+
+def test_truncated_file_is_not_passed_on():
+    files = []
+    parser = StreamingFileParser(lambda filename, code: files.append(filename))
+    parser.feed("Filename: a.tsx\nCode: ```tsx\nconst a = ")
+    timings = parser.close()
+    assert files == [] and timings[0].truncated
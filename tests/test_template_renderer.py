@@ -0,0 +1,40 @@
+import re
+
+import pytest
+
+import wide_entity
+from template_registry import registry
+from template_renderer import Field, render_template
+
+CASES_TEMPLATE_SET = "app/(protected)/cases"
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$]*")
+LEFTOVER_PATTERN = re.compile(r"(?<![A-Za-z])cases?(?![a-z])|Cases?(?![a-z])")
+
+MODELS = [
+    ("Department", ["id", "name", "type", "description", "isRequired"]),
+    ("PurchaseOrder", ["id", "orderNumber", "supplier", "orderDate", "amount"]),
+    ("Address", ["id", "street", "city", "postalCode", "createdAt"]),
+    ("Category", ["id", "name", "isActive", "updatedAt"]),
+]
+
+TEMPLATES = registry.templates(CASES_TEMPLATE_SET)
+
+
+@pytest.mark.parametrize("model, fields", MODELS, ids=[model for model, _ in MODELS])
+@pytest.mark.parametrize("template", TEMPLATES, ids=[template.path for template in TEMPLATES])
+def test_render_cases_template(template, model, fields):
+    result = render_template(template.path, template.code, model, fields)
+
+    assert result.unresolved == []
+    assert "case" not in result.path.lower()
+    # the keyword of a switch statement is not the entity
+    leftovers = {token for token in IDENTIFIER_PATTERN.findall(result.code)
+                 if token != "case" and LEFTOVER_PATTERN.search(token)}
+    assert leftovers == set()
+    sections = wide_entity.sections(template.code)
+    assert wide_entity.validate(result.code, fields, sections) == []
+    if sections:
+        # the database fills in the auto fields, the form leaves them out
+        missing = [field.name for field in map(Field, fields)
+                   if not field.auto and field.name not in result.code]
+        assert missing == []
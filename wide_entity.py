@@ -0,0 +1,250 @@
+"""Chunked generation of very wide entities.
+
+A form or table for an entity with a hundred fields does not fit one
+completion, the output token limit truncates it. generate_code_wide splits
+the fields into groups of KEVIN_WIDE_FIELD_GROUP, generates every
+field-dependent template once per group, concurrently, and merges the
+outputs here into one file per template.
+
+The first group's file is the skeleton. Each field-dependent section of
+it (form schema, default values, form fields, table columns) is rebuilt
+from the items of every group, in field order, each group contributing
+only the items of its own fields. validate() checks that every field
+appears exactly once in each section, first on every group's output and
+then on the merged file.
+"""
+import os
+import re
+
+from template_renderer import (
+    IMPORT_PATTERN, STRING_PATTERN, Field, ensure_import,
+    _block, _indent_at, _matching, _top_level_items,
+)
+
+WIDE_FIELD_GROUP = int(os.environ.get("KEVIN_WIDE_FIELD_GROUP", "20"))
+
+KEY_PATTERN = re.compile(r"""(?P<key>[\w$]+|'[^'\n]*'|"[^"\n]*")\s*:""")
+COMMENT_PATTERN = re.compile(r"\s*(?://[^\n]*|/\*.*?\*/)", re.S)
+
+
+def field_groups(fields, size=None):
+    """Splits fields into consecutive groups of at most size fields."""
+    size = size or WIDE_FIELD_GROUP
+    fields = [field for field in fields if field.strip()]
+    return [fields[start:start + size] for start in range(0, len(fields), size)] or [[]]
+
+
+def _key(name):
+    return name.strip("'\"").lower().replace("_", "")
+
+
+def _object_entries(code, block):
+    """Returns the (key, start, end) of the top-level entries of an object
+    literal, end excluding the comma after the entry."""
+    entries = []
+    i = block[0] + 1
+    while i < block[1]:
+        match = COMMENT_PATTERN.match(code, i)
+        while match and match.end() > i:
+            i = match.end()
+            match = COMMENT_PATTERN.match(code, i)
+        while i < block[1] and code[i] in " \t\n,":
+            i += 1
+        match = KEY_PATTERN.match(code, i)
+        if i >= block[1] or not match:
+            break
+        j = match.end()
+        while j < block[1] and code[j] != ",":
+            if code[j] in "({[":
+                j = _matching(code, j)
+                if j < 0:
+                    return None
+            elif code[j] in "'\"`":
+                string = STRING_PATTERN.match(code, j)
+                if string:
+                    j = string.end()
+                    continue
+            j += 1
+        end = j
+        while code[end - 1] in " \t\n":
+            end -= 1
+        entries.append((match.group("key").strip("'\""), i, end))
+        i = j + 1
+    return entries
+
+
+def _object_items(anchor):
+    def find(code):
+        block = _block(code, anchor)
+        return _object_entries(code, block) if block else None
+    return find
+
+
+def _column_items(code):
+    block = _block(code, r"\(\)\s*=>\s*\[")
+    spans = _top_level_items(code, block) if block else None
+    if not spans:
+        return None
+    items = []
+    for start, end in spans:
+        text = code[start:end]
+        accessor = re.search(r"\baccessorKey:\s*['\"]([\w$]+)['\"]", text)
+        column_id = re.match(r"\{\s*id:\s*['\"]([\w$]+)['\"]", text)
+        if accessor:
+            items.append((accessor.group(1), start, end))
+        elif column_id and column_id.group(1) not in ("select", "actions"):
+            items.append((column_id.group(1), start, end))
+        else:
+            items.append((None, start, end))
+    return items
+
+
+def _element_end(code, start, tag):
+    """Returns the index past the JSX element opening at code[start]."""
+    i = start
+    while i < len(code):
+        if code[i] == "{":
+            i = _matching(code, i)
+            if i < 0:
+                return -1
+        elif code[i] in "'\"":
+            string = STRING_PATTERN.match(code, i)
+            if string:
+                i = string.end()
+                continue
+        elif code.startswith("/>", i):
+            return i + 2
+        elif code[i] == ">":
+            close = code.find(f"</{tag}>", i)
+            return close + len(tag) + 3 if close >= 0 else -1
+        i += 1
+    return -1
+
+
+def _form_field_items(code):
+    items = []
+    for match in re.finditer(r"<FormField\b", code):
+        end = _element_end(code, match.start(), "FormField")
+        if end < 0:
+            return None
+        name = re.search(r"\bname=\{?['\"]([\w$]+)['\"]", code[match.start():end])
+        items.append((name.group(1) if name else None, match.start(), end))
+    return items or None
+
+
+class Section:
+    """A field-dependent region of a template.
+
+    Args:
+        find: returns the (key, start, end) items of the region in code, key
+            None for items that belong to no field, or None when code does
+            not have the region
+        comma: whether the items are separated by commas
+        expected: returns whether a Field must appear in the region, the
+            others may appear at most once
+    """
+
+    def __init__(self, name, find, comma, expected):
+        self.name = name
+        self.find = find
+        self.comma = comma
+        self.expected = expected
+
+
+SECTIONS = [
+    Section("form schema", _object_items(r"z\.object\(\{"), True, lambda field: not field.auto),
+    Section("default values", _object_items(r"defaultValues: \{"), True, lambda field: False),
+    Section("form fields", _form_field_items, False, lambda field: not field.auto),
+    Section("columns", _column_items, True, lambda field: field.name != "id"),
+]
+
+
+def sections(code):
+    """Returns the field-dependent sections found in a template."""
+    return [section for section in SECTIONS if section.find(code)]
+
+
+def validate(code, fields, template_sections):
+    """Checks that every field appears exactly once in each section.
+
+    Returns:
+        list: the problems found, empty when the code is valid
+    """
+    fields = [Field(field) for field in fields if field.strip()]
+    problems = []
+    for section in template_sections:
+        items = section.find(code)
+        if not items:
+            problems.append(f"{section.name}: not found")
+            continue
+        counts = {}
+        for key, _, _ in items:
+            if key is not None:
+                counts[_key(key)] = counts.get(_key(key), 0) + 1
+        missing = [field.name for field in fields
+                   if section.expected(field) and not counts.get(_key(field.name))]
+        duplicated = [field.name for field in fields if counts.get(_key(field.name), 0) > 1]
+        if missing:
+            problems.append(f"{section.name}: missing {', '.join(missing)}")
+        if duplicated:
+            problems.append(f"{section.name}: duplicated {', '.join(duplicated)}")
+    return problems
+
+
+def _merge_imports(code, others):
+    """Adds the imports of others that code lacks, e.g. the Checkbox only
+    a later group's boolean field uses."""
+    for other in others:
+        for match in IMPORT_PATTERN.finditer(other):
+            module = match.group("module")[1:-1]
+            default = match.group("default")
+            if default and not re.search(rf"^import\s+{re.escape(default)}\b", code, re.M):
+                imports = list(IMPORT_PATTERN.finditer(code))
+                index = imports[-1].end() if imports else 0
+                code = code[:index] + f"import {default} from '{module}'\n" + code[index:]
+            for name in (match.group("named") or "").split(","):
+                name = name.strip()
+                if re.match(r"^[\w$]+$", name):
+                    code = ensure_import(code, name, module)
+    return code
+
+
+def merge(codes, groups, template_sections):
+    """Merges the outputs of a template for each group of fields into one
+    file, the first output being the skeleton.
+
+    Items of a section whose key is not a field of the group that generated
+    them, like fields left over from the template, are dropped.
+    """
+    skeleton = codes[0]
+    for section in template_sections:
+        texts = []
+        for code, fields in zip(codes, groups):
+            keys = {_key(Field(field).name) for field in fields}
+            texts.append([code[start:end] for key, start, end in section.find(code) or []
+                          if key is not None and _key(key) in keys])
+        skeleton = _merge_section(skeleton, section, texts)
+    return _merge_imports(skeleton, codes[1:])
+
+
+def _merge_section(code, section, texts):
+    """Rebuilds the section of code from the item texts of every group,
+    keeping its fixed items in place."""
+    items = section.find(code)
+    if not items:
+        return code
+    merged = [text for group in texts for text in group]
+    rebuilt = []
+    inserted = False
+    for key, start, end in items:
+        if key is None:
+            rebuilt.append(code[start:end])
+        elif not inserted:
+            rebuilt += merged
+            inserted = True
+    if not inserted:
+        # no field items in the skeleton: before its last fixed item, like
+        # the table columns before the actions column
+        rebuilt[-1:-1] = merged
+    separator = ("," if section.comma else "") + "\n" + _indent_at(code, items[0][1])
+    return code[:items[0][1]] + separator.join(rebuilt) + code[items[-1][2]:]